@@ -9,10 +9,18 @@
 支持两种模式：
 - production: 生产模式（默认），从 hiq_background_db 读取数据
 - editor: 建设模式，从 hiq_editor 读取数据（tw_exchanges, tw_processes）
+
+--workers N 时将 process_id 分发到 N 个子进程，每个子进程一个构建器和数据库连接；
+汇总、输出文件和失败列表与串行运行相同（按输入顺序）。
 """
 
 import os
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+from typing import Optional
 from datetime import datetime
 
 # 添加 src 目录到路径
@@ -20,6 +28,10 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from build_main_chain import MainChainBuilder
 import config
+import db_pool
+
+# 进程池 worker 内的构建器（每个 worker 进程一个，由 _init_worker 创建）
+_worker_builder = None
 
 
 def read_process_ids(file_path: str = "process_ids.txt"):
@@ -58,7 +70,137 @@ def read_process_ids(file_path: str = "process_ids.txt"):
     return process_ids
 
 
-def analyze_main_chains(process_ids: list, mode: str = "production", output_dir: str = None):
+def _create_builder(mode: str, use_snapshot: bool, precompute: bool, use_prepared: bool,
+                    top_k: int, use_disk_cache: bool = False, use_offline_store: bool = False,
+                    category_exchange_ids: Optional[frozenset] = None) -> MainChainBuilder:
+    """创建并连接构建器（按需加载快照 / 预计算后继表 / 磁盘缓存 / 离线文件；已给出 category 过滤集合时不再加载）"""
+    builder = MainChainBuilder(mode=mode)
+    builder.category_exchange_ids = category_exchange_ids
+    builder.use_prepared = builder.use_prepared and use_prepared
+    builder.use_disk_cache = builder.use_disk_cache or use_disk_cache
+    builder.use_offline_store = builder.use_offline_store or use_offline_store
+    builder.connect_db()
+    try:
+        if use_snapshot:
+            builder.load_snapshot()
+        if precompute and top_k <= 1:
+            builder.precompute_successors()
+    except Exception:
+        builder.close_db()
+        raise
+    return builder
+
+
+def _analyze_process(builder: MainChainBuilder, process_id: str, output_dir: str,
+                     top_k: int, rank_by: str, idx: int, total: int) -> dict:
+    """
+    分析单个 process 并写出 TXT 文件
+    
+    Returns:
+        dict: 成功时为 {'process_id', 'txt'}，失败时为 {'process_id', 'error'}
+    """
+    print(f"\n{'=' * 80}")
+    print(f"[{idx}/{total}] 分析 Process: {process_id}")
+    print(f"{'=' * 80}")
+    
+    try:
+        # 重置访问记录（每个 process 独立分析）
+        builder.visited.clear()
+        
+        process_short = process_id[:8]
+        
+        if top_k > 1:
+            print(f"开始搜索 Top-{top_k} 链路（rank_by={rank_by}）...\n")
+            chains = builder.build_top_k_chains(process_id, top_k, rank_by)
+            txt_file = os.path.join(output_dir, f"main_chain_top{top_k}_{process_short}.txt")
+            builder.generate_top_k_txt(chains, txt_file, rank_by)
+        else:
+            # 构建主链路
+            print(f"开始构建主链路...\n")
+            if builder.successors is not None:
+                head_node = builder.build_chain_from_successors(process_id)
+            else:
+                head_node = builder.build_chain_recursive(
+                    process_id=process_id,
+                    flow_id=None,
+                    value=0.0,
+                    level=0
+                )
+            
+            # 生成输出文件（仅 TXT 格式）
+            # 紧凑 TXT 格式
+            txt_file = os.path.join(output_dir, f"main_chain_{process_short}.txt")
+            builder.generate_compact_txt(head_node, txt_file)
+        
+        print(f"\n✅ 完成!")
+        print(f"   - 输出文件: {txt_file}")
+        return {
+            'process_id': process_id,
+            'txt': txt_file
+        }
+        
+    except Exception as e:
+        print(f"\n❌ 分析失败: {e}")
+        traceback.print_exc()
+        return {
+            'process_id': process_id,
+            'error': str(e)
+        }
+
+
+def _close_worker():
+    """worker 进程退出前归还连接并关闭连接池（子进程退出时不执行 atexit）"""
+    global _worker_builder
+    if _worker_builder is not None:
+        _worker_builder.close_db()
+        _worker_builder = None
+    db_pool.close_all()
+
+
+def _init_worker(mode: str, use_snapshot: bool, precompute: bool, use_prepared: bool, top_k: int,
+                 use_disk_cache: bool, use_offline_store: bool, category_exchange_ids: Optional[frozenset]):
+    """进程池 worker 初始化：每个 worker 创建自己的构建器和数据库连接，整个批次内复用"""
+    global _worker_builder
+    Finalize(None, _close_worker, exitpriority=10)
+    _worker_builder = _create_builder(mode, use_snapshot, precompute, use_prepared, top_k, use_disk_cache,
+                                      use_offline_store, category_exchange_ids)
+
+
+def _worker_analyze(task: tuple) -> dict:
+    """在 worker 进程中分析一个 process（task 为 _analyze_process 的其余参数）"""
+    return _analyze_process(_worker_builder, *task)
+
+
+def _run_pool(process_ids: list, workers: int, output_dir: str, mode: str, use_snapshot: bool,
+              precompute: bool, use_prepared: bool, top_k: int, rank_by: str,
+              use_disk_cache: bool = False, use_offline_store: bool = False,
+              category_exchange_ids: Optional[frozenset] = None) -> list:
+    """
+    用进程池分析所有 process，结果按输入顺序返回
+    
+    category_exchange_ids 为父进程中加载的建设模式过滤集合，通过 initializer 传给各 worker。
+    worker 初始化失败（如无法连接数据库）时进程池不可用，尚未完成的 process 记为失败。
+    """
+    total = len(process_ids)
+    tasks = [(process_id, output_dir, top_k, rank_by, idx, total)
+             for idx, process_id in enumerate(process_ids, 1)]
+    outcomes = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(mode, use_snapshot, precompute, use_prepared, top_k,
+                                       use_disk_cache, use_offline_store, category_exchange_ids)) as executor:
+        futures = [executor.submit(_worker_analyze, task) for task in tasks]
+        for process_id, future in zip(process_ids, futures):
+            try:
+                outcomes.append(future.result())
+            except BrokenProcessPool as e:
+                outcomes.append({'process_id': process_id, 'error': f"进程池异常终止: {e}"})
+    return outcomes
+
+
+def analyze_main_chains(process_ids: list, mode: str = "production", output_dir: str = None,
+                        use_snapshot: bool = False, precompute: bool = False,
+                        use_prepared: bool = True, top_k: int = 1, rank_by: str = "value",
+                        workers: int = 1, use_disk_cache: bool = False, use_offline_store: bool = False):
     """
     批量分析主链路
     
@@ -66,6 +208,14 @@ def analyze_main_chains(process_ids: list, mode: str = "production", output_dir:
         process_ids: process_id 列表
         mode: 运行模式 - "production" 或 "editor"
         output_dir: 输出目录（如果为 None 则根据模式自动设置）
+        use_snapshot: 是否先一次性加载 exchange 快照（之后逐跳不再查询 tb_exchanges）
+        precompute: 是否预计算整个版本的后继表（一次 DISTINCT ON 查询，链路在内存中沿指针生成）
+        use_prepared: 是否对热点查询使用 PREPARE/EXECUTE（False 时使用即席查询，便于对比）
+        top_k: 大于 1 时为每个 process 输出得分最高的 top_k 条链路（上游候选在所有 process 间共享缓存）
+        rank_by: Top-k 排序依据 - "value"（value 乘积）或 "gwp"（GWP 贡献度乘积）
+        workers: 大于 1 时使用进程池并行分析（每个 worker 一个构建器和连接，快照/后继表在各 worker 内分别加载）
+        use_disk_cache: 是否使用本地磁盘缓存（重跑同一版本时逐跳查询、名称等直接读取缓存，见 disk_cache.py）
+        use_offline_store: 是否从离线文件读取全部数据，不连接数据库（见 offline_store.py）
     """
     if not process_ids:
         print("❌ 没有可分析的 process_id")
@@ -96,6 +246,17 @@ def analyze_main_chains(process_ids: list, mode: str = "production", output_dir:
     else:
         print(f"数据库: {config.PG_DATABASE}")
     print(f"版本: {config.VERSION}")
+    if use_offline_store:
+        print(f"离线文件: {config.OFFLINE_STORE_PATH}（不连接数据库）")
+    if workers > 1:
+        print(f"并行 worker 数: {workers}")
+        if use_snapshot or precompute:
+            loads = " / ".join(name for name, used in (("快照", use_snapshot), ("后继表", precompute)) if used)
+            if use_offline_store:
+                print(f"⚠ 每个 worker 各自加载{loads}：内存中共有 {workers} 份")
+            else:
+                print(f"⚠ 每个 worker 各自加载{loads}：对数据库执行 {workers} 次整个版本的全表扫描，"
+                      f"内存中共有 {workers} 份；以降低数据库负载为目标时请改用单进程（--workers 1）")
     print("=" * 80)
     print()
     
@@ -104,55 +265,28 @@ def analyze_main_chains(process_ids: list, mode: str = "production", output_dir:
         'failed': []
     }
     
-    # 连接数据库一次，复用连接
-    builder = MainChainBuilder(mode=mode)
-    builder.connect_db()
+    if workers > 1:
+        # 建设模式的 category 过滤集合在父进程中只读取一次 hiq_editor，再传给各 worker（离线文件中已有）
+        category_exchange_ids = None
+        if mode == "editor" and not use_offline_store:
+            filter_builder = MainChainBuilder(mode=mode)
+            filter_builder.ensure_category_filter()
+            category_exchange_ids = filter_builder.category_exchange_ids
+        outcomes = _run_pool(process_ids, workers, output_dir, mode, use_snapshot,
+                             precompute, use_prepared, top_k, rank_by, use_disk_cache, use_offline_store,
+                             category_exchange_ids)
+    else:
+        # 连接数据库一次，复用连接
+        builder = _create_builder(mode, use_snapshot, precompute, use_prepared, top_k, use_disk_cache,
+                                  use_offline_store)
+        try:
+            outcomes = [_analyze_process(builder, process_id, output_dir, top_k, rank_by, idx, len(process_ids))
+                        for idx, process_id in enumerate(process_ids, 1)]
+        finally:
+            builder.close_db()
     
-    try:
-        for idx, process_id in enumerate(process_ids, 1):
-            print(f"\n{'=' * 80}")
-            print(f"[{idx}/{len(process_ids)}] 分析 Process: {process_id}")
-            print(f"{'=' * 80}")
-            
-            try:
-                # 重置访问记录（每个 process 独立分析）
-                builder.visited.clear()
-                
-                # 构建主链路
-                print(f"开始构建主链路...\n")
-                head_node = builder.build_chain_recursive(
-                    process_id=process_id,
-                    flow_id=None,
-                    value=0.0,
-                    level=0
-                )
-                
-                # 生成输出文件（仅 TXT 格式）
-                process_short = process_id[:8]
-                
-                # 紧凑 TXT 格式
-                txt_file = os.path.join(output_dir, f"main_chain_{process_short}.txt")
-                builder.generate_compact_txt(head_node, txt_file)
-                
-                results['success'].append({
-                    'process_id': process_id,
-                    'txt': txt_file
-                })
-                
-                print(f"\n✅ 完成!")
-                print(f"   - 输出文件: {txt_file}")
-                
-            except Exception as e:
-                print(f"\n❌ 分析失败: {e}")
-                import traceback
-                traceback.print_exc()
-                results['failed'].append({
-                    'process_id': process_id,
-                    'error': str(e)
-                })
-    
-    finally:
-        builder.close_db()
+    for item in outcomes:
+        results['failed' if 'error' in item else 'success'].append(item)
     
     # 打印总结
     print("\n" + "=" * 80)
@@ -182,6 +316,30 @@ def main():
                        help='运行模式: production (生产模式，默认) 或 editor (建设模式)')
     parser.add_argument('--output', '-o',
                        help='自定义输出目录（默认: production模式用output/, editor模式用output/battery/）')
+    parser.add_argument('--snapshot', '-s',
+                       action='store_true',
+                       help='先一次性加载当前版本的 exchange 快照，遍历时不再逐跳查询数据库')
+    parser.add_argument('--precompute', '-p',
+                       action='store_true',
+                       help='一次查询预计算整个版本的主链路后继表，链路在内存中沿指针生成')
+    parser.add_argument('--top-k', '-k',
+                       type=int, default=1,
+                       help='为每个 process 输出得分最高的 K 条链路（最佳优先搜索，默认 1 即单一主链路）')
+    parser.add_argument('--rank-by',
+                       choices=['value', 'gwp'], default='value',
+                       help='Top-k 排序依据: value（路径 value 乘积，默认）或 gwp（路径 GWP 贡献度乘积）')
+    parser.add_argument('--no-prepared',
+                       action='store_true',
+                       help='不使用 PREPARE/EXECUTE，热点查询每次由服务端重新解析（用于对比耗时）')
+    parser.add_argument('--workers', '-w',
+                       type=int, default=1,
+                       help='并行 worker 进程数（每个 worker 一个数据库连接，默认 1 即串行；与 --snapshot / --precompute 同用时每个 worker 各加载一份）')
+    parser.add_argument('--disk-cache',
+                       action='store_true',
+                       help='使用本地磁盘缓存（按版本和模式分区，过期时间见 config.DISK_CACHE_TTL；清除: python src/disk_cache.py --clear）')
+    parser.add_argument('--offline',
+                       action='store_true',
+                       help='从离线文件读取数据，不连接数据库（先运行 python src/offline_store.py --export，建设模式加 --editor）')
     
     args = parser.parse_args()
     
@@ -200,10 +358,16 @@ def main():
         print("\n运行模式:")
         print("   python batch_main_chain.py              # 生产模式（默认）")
         print("   python batch_main_chain.py --mode editor  # 建设模式")
+        print("   python batch_main_chain.py --top-k 5 --rank-by gwp  # 每个 process 输出前 5 条链路")
+        print("   python batch_main_chain.py --workers 8  # 8 个进程并行分析")
+        print("   python batch_main_chain.py --offline    # 使用离线文件，不连接数据库")
         return
     
     # 执行批量分析
-    analyze_main_chains(process_ids, mode=args.mode, output_dir=args.output)
+    analyze_main_chains(process_ids, mode=args.mode, output_dir=args.output,
+                        use_snapshot=args.snapshot, precompute=args.precompute,
+                        use_prepared=not args.no_prepared, top_k=args.top_k, rank_by=args.rank_by,
+                        workers=args.workers, use_disk_cache=args.disk_cache, use_offline_store=args.offline)
 
 
 if __name__ == "__main__":
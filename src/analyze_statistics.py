@@ -26,30 +26,58 @@ class TreeStatistics:
         self.fanout_distribution: Dict[int, int] = defaultdict(int)
         self.leaf_nodes: List[str] = []
         self.all_nodes: List[str] = []
+        self.shared_refs = 0  # 未展开的共享子树引用数
+        self.cycle_refs = 0  # 循环依赖（回边）数
+        self.condensed_cycles = 0  # 压缩为单个节点的循环数（condense_cycles 模式）
+        self.condensed_members = 0  # 这些循环包含的 process 数
+        self.frontier_nodes = 0  # anytime 构建未展开的 frontier 节点数
     
     def analyze(self):
         """执行统计分析"""
         self._traverse_tree(self.root)
     
     def _traverse_tree(self, node: ProcessTreeNode):
-        """遍历树并收集统计信息"""
-        # 记录节点
-        self.all_nodes.append(node.process_id)
-        
-        # 层级分布
-        self.level_distribution[node.level] += 1
-        
-        # 扇出度
-        fanout = len(node.children)
-        self.fanout_distribution[fanout] += 1
-        
-        # 叶子节点
-        if fanout == 0:
-            self.leaf_nodes.append(node.process_id)
-        
-        # 递归处理子节点
-        for child in node.children:
-            self._traverse_tree(child)
+        """
+        遍历树并收集统计信息（先序，显式栈迭代）
+        
+        回边和未展开的共享子树引用单独计数，不计入节点统计；
+        builder.expand_shared 为 True 时按完整展开的树统计，层级取节点在展开树中的实际深度。
+        压缩模式下每个循环按一个节点统计，另外记录循环数和成员数。
+        anytime 构建未展开的 frontier 节点按叶子节点统计，另外单独计数。
+        """
+        stack = [(node, node.level)]
+        while stack:
+            node, level = stack.pop()
+            
+            if node.is_cycle:
+                self.cycle_refs += 1
+                continue
+            if node.shared and not self.builder.expand_shared:
+                self.shared_refs += 1
+                continue
+            
+            # 记录节点
+            self.all_nodes.append(node.process_id)
+            if node.frontier:
+                self.frontier_nodes += 1
+            if node.members:
+                self.condensed_cycles += 1
+                self.condensed_members += len(node.members)
+            
+            # 层级分布
+            self.level_distribution[level] += 1
+            
+            # 扇出度
+            fanout = len(node.children)
+            self.fanout_distribution[fanout] += 1
+            
+            # 叶子节点
+            if fanout == 0:
+                self.leaf_nodes.append(node.process_id)
+            
+            # 子节点逆序入栈，保持先序
+            for child in reversed(node.children):
+                stack.append((child, level + 1))
     
     def get_max_depth(self) -> int:
         """获取最大深度"""
@@ -75,24 +103,36 @@ class TreeStatistics:
     
     def get_critical_path(self) -> List[str]:
         """获取关键路径（最长路径）"""
+        # 后序计算每个节点向下的最长路径长度（节点数）
+        heights: Dict[int, int] = {}
+        stack = [(self.root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                heights[id(node)] = 1 + max((heights[id(child)] for child in node.children), default=0)
+            elif id(node) not in heights:
+                # 共享子树的节点对象相同，只计算一次
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children)
+        
+        # 从根节点沿最长的子树向下（长度相同时取第一个子节点）
         path = []
-        
-        def find_longest_path(node: ProcessTreeNode) -> List[str]:
-            if not node.children:
-                return [node.process_id]
-            
-            longest = []
+        node = self.root
+        while node is not None:
+            path.append(node.process_id)
+            longest = None
             for child in node.children:
-                child_path = find_longest_path(child)
-                if len(child_path) > len(longest):
-                    longest = child_path
-            
-            return [node.process_id] + longest
+                if longest is None or heights[id(child)] > heights[id(longest)]:
+                    longest = child
+            node = longest
         
-        return find_longest_path(self.root)
+        return path
     
     def generate_report(self, output_file: str = "statistics_report.md"):
         """生成统计报告"""
+        # 渲染前批量解析名称
+        self.builder.prefetch_names(self.root)
+        
         lines = []
         
         lines.append("# 过程树统计分析报告")
@@ -109,6 +149,12 @@ class TreeStatistics:
         lines.append(f"- **非叶子节点数:** {len(self.all_nodes) - len(self.leaf_nodes)}")
         lines.append(f"- **最大深度:** {self.get_max_depth()}")
         lines.append(f"- **平均扇出度:** {self.get_avg_fanout():.2f}")
+        lines.append(f"- **共享子树引用数:** {self.shared_refs}")
+        lines.append(f"- **循环依赖（回边）数:** {self.cycle_refs}")
+        if self.builder.condense_cycles:
+            lines.append(f"- **压缩的循环数:** {self.condensed_cycles}（共 {self.condensed_members} 个 process）")
+        if self.frontier_nodes:
+            lines.append(f"- **未展开的 frontier 节点数:** {self.frontier_nodes}（部分树：{self.builder.budget_exhausted}）")
         lines.append("")
         
         # 层级分布
@@ -217,7 +263,7 @@ def main():
         print(f"平均扇出度: {stats.get_avg_fanout():.2f}")
         print(f"关键路径长度: {len(stats.get_critical_path())}")
         print("=" * 60)
-        
+    
     except Exception as e:
         print(f"\n✗ 执行失败: {e}")
         import traceback
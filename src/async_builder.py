@@ -0,0 +1,489 @@
+"""
+Async Builders - asyncio 版过程树 / 主链路构建器
+
+ProcessTreeBuilder / MainChainBuilder 仍是同步 API。AsyncProcessTreeBuilder / AsyncMainChainBuilder
+继承它们，只把数据库访问换成 asyncpg 连接池上的协程，便于嵌入 async 服务：
+
+    - 在途查询数受 max_in_flight 限制（连接池大小，默认 config.ASYNC_MAX_IN_FLIGHT），
+      单个进程即可同时保持几十个查询在途，不需要线程
+    - 名称查询与 exchange 查询流水线并行：每批 exchange 返回后立即提交新发现的
+      process / flow 的名称查询，不等遍历结束
+    - 数据进入缓存后，由同步构建器在内存中组装和渲染，树、链路和导出文件与同步版本相同
+
+可选依赖 asyncpg：未安装时 ASYNCPG_AVAILABLE 为 False，connect 时报错；同步构建器不受影响。
+"""
+
+import asyncio
+import os
+import re
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime
+import config
+from build_process_tree import ProcessTreeBuilder, ProcessTreeNode, OUTPUT_DIR, _branch_factor, apply_cutoff_args
+from build_main_chain import MainChainBuilder, MainChainNode
+from name_resolver import names_query, collect_tree_ids, collect_chain_ids
+
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+
+
+def _numbered(query: str) -> str:
+    """把 %s 占位符转换为 asyncpg 使用的 $1, $2, ..."""
+    counter = iter(range(1, query.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f"${next(counter)}", query)
+
+
+async def _uuid_as_text(connection):
+    """uuid 列按文本收发：asyncpg 默认返回 uuid.UUID，而缓存、名称字典和同步构建器都以 str 为键"""
+    await connection.set_type_codec('uuid', encoder=str, decoder=str, schema='pg_catalog', format='text')
+
+
+class AsyncDatabase:
+    """asyncpg 连接池：连接数即在途查询上限，池满时新查询等待空闲连接"""
+    
+    def __init__(self, database: str, max_in_flight: Optional[int] = None):
+        self.database = database
+        self.max_in_flight = max_in_flight or config.ASYNC_MAX_IN_FLIGHT
+        self.pool = None
+        self.query_count = 0
+    
+    async def open(self):
+        """创建连接池"""
+        if not ASYNCPG_AVAILABLE:
+            raise ImportError("asyncpg 未安装，无法使用 asyncio 构建器；安装: pip install asyncpg")
+        try:
+            self.pool = await asyncpg.create_pool(
+                host=config.PG_HOST,
+                port=config.PG_PORT,
+                user=config.PG_USER,
+                password=config.PG_PASSWORD,
+                database=self.database,
+                min_size=1,
+                max_size=self.max_in_flight,
+                init=_uuid_as_text
+            )
+            print(f"✓ 成功连接到数据库: {self.database}（asyncpg，最多 {self.max_in_flight} 个在途查询）")
+        except Exception as e:
+            print(f"✗ 数据库连接失败: {e}")
+            raise
+    
+    async def fetch(self, query: str, *params) -> List[Dict]:
+        """执行查询（%s 占位符），返回 dict 行（asyncpg 自动缓存每个连接上的预备语句）"""
+        self.query_count += 1
+        rows = await self.pool.fetch(_numbered(query), *params)
+        return [dict(row) for row in rows]
+    
+    async def close(self):
+        """关闭连接池"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+
+async def fetch_names_async(db: AsyncDatabase, table: str, ids, version: Optional[str] = None,
+                            latest_fallback: bool = True) -> Dict[str, Dict]:
+    """
+    fetch_names 的 asyncio 版本：按 NAME_BATCH_SIZE 分块，各块并发查询
+    
+    Returns:
+        Dict: id -> {'id', 'name', 'version'}（未找到的 ID 不在结果中）
+    """
+    ids = list(dict.fromkeys(i for i in ids if i))
+    if not ids:
+        return {}
+    
+    query = names_query(table, version, latest_fallback)
+    chunks = [ids[start:start + config.NAME_BATCH_SIZE] for start in range(0, len(ids), config.NAME_BATCH_SIZE)]
+    results: Dict[str, Dict] = {}
+    try:
+        for rows in await asyncio.gather(*(db.fetch(query, *((chunk,) if version is None else (chunk, version)))
+                                           for chunk in chunks)):
+            for row in rows:
+                results[row['id']] = row
+    except Exception as e:
+        print(f"⚠️  批量获取名称失败 ({table}): {e}")
+    return results
+
+
+class AsyncProcessTreeBuilder(ProcessTreeBuilder):
+    """ProcessTreeBuilder 的 asyncio 版本：异步预取上游闭包和名称，在内存中组装"""
+    
+    def __init__(self, batch_size: Optional[int] = None, max_in_flight: Optional[int] = None):
+        """
+        Args:
+            batch_size: 每次 ANY 查询最多包含的 process 数（默认使用 config.FRONTIER_BATCH_SIZE）
+            max_in_flight: 在途查询上限（默认使用 config.ASYNC_MAX_IN_FLIGHT）
+        """
+        super().__init__(batch_size)
+        self.db = AsyncDatabase(config.PG_DATABASE, max_in_flight)
+        self._missing: Set[str] = set()  # 组装时遇到的未预取 process
+    
+    async def connect(self):
+        """创建 asyncpg 连接池"""
+        await self.db.open()
+    
+    async def close(self):
+        """关闭连接池"""
+        await self.db.close()
+        print("✓ 数据库连接池已关闭")
+    
+    def get_upstream_exchanges(self, process_id: str) -> List[Dict]:
+        """组装阶段只读缓存：未预取的 process 记入 _missing 并暂按叶子处理，由 build_tree_async 补查后重新组装"""
+        if process_id in self.exchange_cache or self.snapshot is not None:
+            return super().get_upstream_exchanges(process_id)
+        self._missing.add(process_id)
+        return []
+    
+    async def _fetch_upstream(self, process_ids: List[str]) -> Dict[str, List[Dict]]:
+        """一次 ANY 查询获取一块 process 的上游 exchanges（不写缓存）"""
+        grouped: Dict[str, List[Dict]] = {pid: [] for pid in process_ids}
+        for row in await self.db.fetch(self._upstream_batch_query(), process_ids, config.VERSION):
+            grouped[row['process_id']].append(row)
+        return grouped
+    
+    async def resolve_names_async(self, process_ids: List[str], flow_ids: List[str]):
+        """resolve_names 的 asyncio 版本（两类名称并发查询，规则相同：只接受 VERSION 版本）"""
+        missing_processes = [pid for pid in dict.fromkeys(process_ids) if pid not in self.process_names]
+        missing_flows = [fid for fid in dict.fromkeys(flow_ids) if fid not in self.flow_names]
+        process_rows, flow_rows = await asyncio.gather(
+            fetch_names_async(self.db, "public.tb_processes", missing_processes, config.VERSION,
+                              latest_fallback=False),
+            fetch_names_async(self.db, "public.tb_flows", missing_flows, config.VERSION,
+                              latest_fallback=False))
+        for pid in missing_processes:
+            row = process_rows.get(pid)
+            self.process_names[pid] = row['name'] if row and row['name'] else f"Process-{pid[:8]}..."
+        for fid in missing_flows:
+            row = flow_rows.get(fid)
+            self.flow_names[fid] = row['name'] if row and row['name'] else f"Flow-{fid[:8]}..."
+    
+    async def prefetch_upstream_async(self, root_process_id: str):
+        """
+        异步预取根节点的上游闭包，名称查询与 exchange 查询流水线并行
+        
+        待查询的 process 分块后全部提交，由连接池限制在途数量；任何一块返回后立即把新发现的
+        provider 提交查询，同时为新发现的 process / flow 提交名称查询。
+        
+        cutoff > 0 时只预取首次到达时累计比例不低于 cutoff 的 process（规则与
+        prefetch_upstream_concurrent 相同），遗漏的由 build_tree_async 补查。
+        """
+        cutoff = self.cutoff or 0.0
+        queued: Set[str] = {root_process_id}
+        pending: List[Tuple[str, float]] = []  # 待查询的 (process_id, 首次到达时的累计比例)
+        found_processes: List[str] = [root_process_id, config.ROOT_PROCESS_ID]  # 待解析名称的 process
+        found_flows: List[str] = [config.ROOT_FLOW_ID]  # 待解析名称的 flow
+        named_processes: Set[str] = set()  # 已提交名称查询的 process
+        named_flows: Set[str] = set()  # 已提交名称查询的 flow
+        tasks: Dict[asyncio.Future, Optional[Dict[str, float]]] = {}  # exchange 查询 -> 各 process 的累计比例；名称查询为 None
+        
+        def discover(process_id: str, scale: float):
+            # 已缓存的 process 直接在内存中继续向上游展开，只有未缓存的进入待查询队列
+            stack = [(process_id, scale)]
+            while stack:
+                current_id, current_scale = stack.pop()
+                if current_id not in self.exchange_cache:
+                    pending.append((current_id, current_scale))
+                    continue
+                provider_factors: Dict[str, float] = {}
+                for exchange in self.exchange_cache[current_id]:
+                    provider_id = exchange['provider_id']
+                    provider_factors[provider_id] = (provider_factors.get(provider_id, 0.0)
+                                                     + _branch_factor(exchange, self.cutoff_by))
+                    found_flows.append(exchange['flow_id'])
+                for provider_id, factor in provider_factors.items():
+                    child_scale = current_scale * factor
+                    if provider_id in queued or (cutoff and child_scale < cutoff):
+                        continue
+                    queued.add(provider_id)
+                    found_processes.append(provider_id)
+                    stack.append((provider_id, child_scale))
+        
+        def submit_names():
+            # 每个 ID 只提交一次名称查询
+            process_ids = [pid for pid in dict.fromkeys(found_processes)
+                           if pid not in self.process_names and pid not in named_processes]
+            flow_ids = [fid for fid in dict.fromkeys(found_flows)
+                        if fid and fid not in self.flow_names and fid not in named_flows]
+            named_processes.update(process_ids)
+            named_flows.update(flow_ids)
+            found_processes.clear()
+            found_flows.clear()
+            if process_ids or flow_ids:
+                tasks[asyncio.ensure_future(self.resolve_names_async(process_ids, flow_ids))] = None
+        
+        discover(root_process_id, 1.0)
+        try:
+            while pending or tasks:
+                # 待查询的 process 分块提交（块数不超过在途上限，每块不超过 batch_size）
+                size = min(self.batch_size, -(-len(pending) // self.db.max_in_flight)) if pending else 0
+                while pending:
+                    chunk = pending[:size]
+                    del pending[:size]
+                    tasks[asyncio.ensure_future(self._fetch_upstream([pid for pid, _ in chunk]))] = dict(chunk)
+                submit_names()
+                
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    scales = tasks.pop(task)
+                    result = task.result()
+                    if scales is None:
+                        continue
+                    self.exchange_cache.update(result)
+                    for process_id, scale in scales.items():
+                        discover(process_id, scale)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        print(f"✓ 异步预取完成: {len(self.exchange_cache)} 个 process, {self.db.query_count} 次查询（含名称）, "
+              f"最多 {self.db.max_in_flight} 个在途")
+    
+    async def build_tree_async(self, process_id: str, full_lci_mode: bool = False) -> ProcessTreeNode:
+        """
+        异步构建过程树：预取上游闭包和名称，再由 build_tree_recursive 在内存中组装
+        
+        组装遇到未预取的 process（剪枝模式下经由比例更高的分支才需要展开）时，补查后重新组装。
+        返回时树中全部名称均已解析，之后可直接调用同步的 generate_markdown 和各导出器。
+        
+        Args:
+            process_id: 根 process ID
+            full_lci_mode: 是否为 Full LCI 模式
+        
+        Returns:
+            ProcessTreeNode: 根节点
+        """
+        if self.snapshot is None:
+            # 循环压缩需要完整的上游闭包，此时不按 cutoff 限制预取范围
+            cutoff = self.cutoff
+            if self.condense_cycles:
+                self.cutoff = 0.0
+            try:
+                await self.prefetch_upstream_async(process_id)
+            finally:
+                self.cutoff = cutoff
+            print()
+        
+        while True:
+            self._missing.clear()
+            root = self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
+            if not self._missing:
+                break
+            missing = sorted(self._missing)
+            print(f"\n⚠ {len(missing)} 个 process 未预取，补查后重新组装\n")
+            chunks = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+            for grouped in await asyncio.gather(*(self._fetch_upstream(chunk) for chunk in chunks)):
+                self.exchange_cache.update(grouped)
+            self.reset_tree()
+        
+        process_ids, flow_ids = collect_tree_ids(root)
+        process_ids.append(config.ROOT_PROCESS_ID)
+        flow_ids.append(config.ROOT_FLOW_ID)
+        await self.resolve_names_async(process_ids, flow_ids)
+        return root
+
+
+class AsyncMainChainBuilder(MainChainBuilder):
+    """MainChainBuilder 的 asyncio 版本：多条链路并发追溯，逐跳异步查询"""
+    
+    def __init__(self, mode: str = "production", max_in_flight: Optional[int] = None):
+        """
+        Args:
+            mode: 运行模式 - "production"（生产模式）或 "editor"（建设模式）
+            max_in_flight: 在途查询上限（默认使用 config.ASYNC_MAX_IN_FLIGHT）
+        """
+        super().__init__(mode)
+        self.db = AsyncDatabase(self.database, max_in_flight)
+        self._candidate_tasks: Dict[str, asyncio.Future] = {}  # 在途的候选查询（多条链路共用）
+    
+    async def connect(self):
+        """创建连接池；建设模式同时从 filter 数据库加载 category 过滤集合"""
+        await self.db.open()
+        if self.mode == "editor" and self.filter_db and self.category_exchange_ids is None:
+            filter_db = AsyncDatabase(self.filter_db, 1)
+            await filter_db.open()
+            start_time = datetime.now()
+            try:
+                rows = await filter_db.fetch(self._category_filter_query(), self.category_filter)
+            finally:
+                await filter_db.close()
+            self.category_exchange_ids = frozenset(row['id'] for row in rows)
+            duration = (datetime.now() - start_time).total_seconds()
+            print(f"✓ 已加载 category 过滤集合: {len(self.category_exchange_ids)} 条 exchange "
+                  f"(category_id={self.category_filter}), 耗时 {duration:.2f} 秒")
+    
+    async def close(self):
+        """关闭连接池"""
+        await self.db.close()
+        print("✓ 数据库连接池已关闭")
+    
+    def get_max_value_exchange(self, process_id: str) -> Optional[Dict]:
+        """已异步查询过候选的 process 直接取 value 最大的一条（候选按 value 降序）"""
+        if self.successors is None and self.snapshot is None and process_id in self._candidates:
+            candidates = self._candidates[process_id]
+            return candidates[0] if candidates else None
+        return super().get_max_value_exchange(process_id)
+    
+    async def _fetch_candidates(self, process_id: str) -> List[Dict]:
+        """异步获取 process 的上游候选（同一 process 的并发请求共用一次查询）"""
+        if process_id in self._candidates:
+            return self._candidates[process_id]
+        task = self._candidate_tasks.get(process_id)
+        if task is None:
+            task = asyncio.ensure_future(self.db.fetch(self._candidates_query(), process_id, config.VERSION))
+            self._candidate_tasks[process_id] = task
+        try:
+            rows = await task
+        finally:
+            self._candidate_tasks.pop(process_id, None)
+        if process_id not in self._candidates:
+            self._store_candidates(process_id, rows)
+        return self._candidates[process_id]
+    
+    async def resolve_names_async(self, process_ids: List[str] = (), flow_ids: List[str] = (),
+                                  unit_ids: List[str] = ()):
+        """resolve_names 的 asyncio 版本（三类名称并发查询，规则相同：指定版本优先、否则取最新版本）"""
+        missing_processes = [pid for pid in dict.fromkeys(process_ids) if pid and pid not in self.process_names]
+        missing_flows = [fid for fid in dict.fromkeys(flow_ids) if fid and fid not in self.flow_names]
+        missing_units = [uid for uid in dict.fromkeys(unit_ids) if uid and uid not in self.unit_names]
+        process_rows, flow_rows, unit_rows = await asyncio.gather(
+            fetch_names_async(self.db, f"{self.schema}.{self.processes_table}", missing_processes, config.VERSION),
+            fetch_names_async(self.db, f"{self.schema}.{self.flows_table}", missing_flows, config.VERSION),
+            fetch_names_async(self.db, f"{self.schema}.{self.units_table}", missing_units))
+        for pid in missing_processes:
+            self.process_names[pid] = self._format_name(process_rows.get(pid)) or f"Process-{pid[:8]}..."
+        for fid in missing_flows:
+            self.flow_names[fid] = self._format_name(flow_rows.get(fid)) or f"Flow-{fid[:8]}..."
+        for uid in missing_units:
+            row = unit_rows.get(uid)
+            self.unit_names[uid] = row['name'] if row and row['name'] else "N/A"
+    
+    async def build_chain_async(self, process_id: str) -> MainChainNode:
+        """
+        异步构建主链路：逐跳查询 value 最大的上游（每跳依赖上一跳的结果），再由
+        build_chain_recursive 在内存中组装，链路与同步版本相同
+        """
+        seen: Set[str] = set()
+        current = process_id
+        while current not in seen:
+            seen.add(current)
+            candidates = await self._fetch_candidates(current)
+            if not candidates:
+                break
+            current = candidates[0]['provider_id']
+        
+        # 组装过程中没有 await，与其他并发链路互不干扰
+        self.visited.clear()
+        return self.build_chain_recursive(process_id=process_id, flow_id=None, value=0.0, level=0)
+    
+    async def analyze_async(self, process_id: str, output_file: str) -> str:
+        """
+        分析单个 process 并生成紧凑 TXT（与 generate_compact_txt 输出相同）
+        
+        根节点 exchanges 与链路的逐跳查询同时进行；名称查询与其他链路的 exchange 查询流水线并行。
+        """
+        root_task = asyncio.ensure_future(self.db.fetch(self._all_exchanges_query(), process_id, config.VERSION))
+        try:
+            head_node = await self.build_chain_async(process_id)
+            exchanges = self._group_exchanges(await root_task)
+        except BaseException:
+            root_task.cancel()
+            raise
+        
+        self._all_exchanges[process_id] = exchanges
+        process_ids, flow_ids, unit_ids = collect_chain_ids(head_node)
+        for exchange in exchanges['inputs'] + exchanges['outputs']:
+            flow_ids.append(exchange['flow_id'])
+            unit_ids.append(exchange['unit_id'])
+        await self.resolve_names_async(process_ids + [process_id], flow_ids, unit_ids)
+        
+        self.generate_compact_txt(head_node, output_file)
+        return output_file
+
+
+async def _build_tree(argv: List[str]):
+    """异步构建 ROOT_PROCESS_ID 的过程树并生成 Markdown"""
+    full_lci_mode = "--full-lci" in argv
+    builder = AsyncProcessTreeBuilder(max_in_flight=_max_in_flight(argv))
+    builder.condense_cycles = builder.condense_cycles or "--condense" in argv
+    apply_cutoff_args(builder, argv)
+    try:
+        await builder.connect()
+        start_time = datetime.now()
+        root = await builder.build_tree_async(config.ROOT_PROCESS_ID, full_lci_mode=full_lci_mode)
+        duration = (datetime.now() - start_time).total_seconds()
+        print(f"\n✓ 异步构建完成，耗时 {duration:.2f} 秒")
+        
+        mode = "full_lci" if full_lci_mode else "skeleton"
+        builder.generate_markdown(root, os.path.join(OUTPUT_DIR, f"process_tree_async_{mode}.md"), mode=mode)
+    finally:
+        await builder.close()
+
+
+async def _build_chains(argv: List[str]):
+    """为 process_ids.txt 中全部 process 并发生成主链路（输出文件与 batch_main_chain.py 相同）"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from batch_main_chain import read_process_ids
+    process_ids = read_process_ids("process_ids.txt")
+    if not process_ids:
+        return
+    
+    mode = "editor" if "--mode" in argv and argv[argv.index("--mode") + 1] == "editor" else "production"
+    output_dir = os.path.join("output", "steel") if mode == "editor" else "output"
+    os.makedirs(output_dir, exist_ok=True)
+    
+    builder = AsyncMainChainBuilder(mode=mode, max_in_flight=_max_in_flight(argv))
+    try:
+        await builder.connect()
+        start_time = datetime.now()
+        outcomes = await asyncio.gather(
+            *(builder.analyze_async(pid, os.path.join(output_dir, f"main_chain_{pid[:8]}.txt")) for pid in process_ids),
+            return_exceptions=True)
+        duration = (datetime.now() - start_time).total_seconds()
+    finally:
+        await builder.close()
+    
+    failed = [(pid, outcome) for pid, outcome in zip(process_ids, outcomes) if isinstance(outcome, BaseException)]
+    print("\n" + "=" * 80)
+    print(f"✅ 成功: {len(process_ids) - len(failed)} 个，耗时 {duration:.2f} 秒")
+    if failed:
+        print(f"❌ 失败: {len(failed)} 个")
+        for pid, error in failed:
+            print(f"   - {pid[:8]}... : {error}")
+    print("=" * 80)
+
+
+def _max_in_flight(argv: List[str]) -> Optional[int]:
+    return int(argv[argv.index("--max-in-flight") + 1]) if "--max-in-flight" in argv else None
+
+
+def main():
+    """
+    主函数：默认异步构建 ROOT_PROCESS_ID 的 Skeleton 过程树（--full-lci、--condense、--cutoff 同同步版本）；
+    --chains 时为 process_ids.txt 中全部 process 并发生成主链路（--mode editor 为建设模式）。
+    --max-in-flight N 设置在途查询上限。
+    """
+    print("=" * 60)
+    print("Async Builders - asyncio 构建器")
+    print("=" * 60)
+    print()
+    if not ASYNCPG_AVAILABLE:
+        print("✗ asyncpg 未安装，无法使用 asyncio 构建器；安装: pip install asyncpg")
+        return
+    
+    try:
+        if "--chains" in sys.argv:
+            asyncio.run(_build_chains(sys.argv))
+        else:
+            asyncio.run(_build_tree(sys.argv))
+    except Exception as e:
+        print(f"\n✗ 执行失败: {e}")
+        import traceback
+        traceback.print_exc()
+
+
+if __name__ == "__main__":
+    main()
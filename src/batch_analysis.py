@@ -49,14 +49,7 @@ class BatchAnalyzer:
         builder = ProcessTreeBuilder()
         
         try:
-            # 临时修改 config
-            original_flow = config.ROOT_FLOW_ID
-            original_process = config.ROOT_PROCESS_ID
-            
-            config.ROOT_FLOW_ID = flow_id
-            config.ROOT_PROCESS_ID = process_id
-            
-            # 连接数据库
+            # 从共享连接池借用连接（多个根节点复用同一连接，避免重复握手）
             builder.connect_db()
             
             # 构建树
@@ -66,57 +59,114 @@ class BatchAnalyzer:
             
             duration = (end_time - start_time).total_seconds()
             
+            return self._write_result(builder, root, flow_id, process_id, name, duration)
+            
+        except Exception as e:
+            return self._failed_result(flow_id, process_id, name, e)
+            
+        finally:
+            builder.close_db()
+    
+    def _write_result(self, builder: ProcessTreeBuilder, root, flow_id: str, process_id: str,
+                      name: str, duration: float) -> dict:
+        """生成单个根节点的 Markdown 输出并返回统计信息"""
+        # 临时修改 config（Markdown 标题中的根 flow / process）
+        original_flow = config.ROOT_FLOW_ID
+        original_process = config.ROOT_PROCESS_ID
+        
+        config.ROOT_FLOW_ID = flow_id
+        config.ROOT_PROCESS_ID = process_id
+        
+        try:
             # 生成输出
             output_file = os.path.join(self.output_dir, f"{name}_tree.md")
             builder.generate_markdown(root, output_file)
-            
-            # 统计信息
-            stats = {
-                "name": name,
-                "flow_id": flow_id,
-                "process_id": process_id,
-                "total_processes": len(builder.visited),
-                "max_depth": builder._get_max_depth(root),
-                "duration_seconds": duration,
-                "output_file": output_file,
-                "success": True,
-                "error": None
-            }
-            
-            print(f"✓ 完成")
-            print(f"  - 总节点数: {stats['total_processes']}")
-            print(f"  - 最大深度: {stats['max_depth']}")
-            print(f"  - 耗时: {duration:.2f} 秒")
-            print(f"  - 输出: {output_file}")
-            
+        finally:
             # 恢复 config
             config.ROOT_FLOW_ID = original_flow
             config.ROOT_PROCESS_ID = original_process
+        
+        # 统计信息
+        stats = {
+            "name": name,
+            "flow_id": flow_id,
+            "process_id": process_id,
+            "total_processes": len(builder.visited),
+            "max_depth": builder._get_max_depth(root),
+            "duration_seconds": duration,
+            "output_file": output_file,
+            "success": True,
+            "error": None
+        }
+        
+        print(f"✓ 完成")
+        print(f"  - 总节点数: {stats['total_processes']}")
+        print(f"  - 最大深度: {stats['max_depth']}")
+        print(f"  - 耗时: {duration:.2f} 秒")
+        print(f"  - 输出: {output_file}")
+        
+        return stats
+    
+    def _failed_result(self, flow_id: str, process_id: str, name: str, error: Exception) -> dict:
+        """失败的根节点的结果"""
+        print(f"✗ 失败: {error}")
+        
+        return {
+            "name": name,
+            "flow_id": flow_id,
+            "process_id": process_id,
+            "success": False,
+            "error": str(error)
+        }
+    
+    def analyze_forest(self, roots: List[Tuple[str, str, str]]):
+        """
+        森林模式：所有根节点共用一个构建器（同一份 exchange 缓存、名称缓存和连接）
+        
+        先批量预取全部根节点上游闭包的并集，共享的背景供应链只查询一次，
+        查询量约为各闭包的并集而不是总和；每个根节点的输出和统计与逐个分析时相同。
+        
+        Args:
+            roots: [(flow_id, process_id, name), ...]
+        """
+        names = [name or process_id[:8] for _, process_id, name in roots]
+        builder = ProcessTreeBuilder()
+        
+        try:
+            builder.connect_db()
             
-            return stats
+            start_time = datetime.now()
+            forest = builder.build_forest([process_id for _, process_id, _ in roots])
+            for i, (flow_id, process_id, _) in enumerate(roots):
+                print(f"\n[{i + 1}/{len(roots)}] 分析: {names[i]}")
+                try:
+                    _, root, error = next(forest)
+                    if error is not None:
+                        raise error
+                    duration = (datetime.now() - start_time).total_seconds()
+                    result = self._write_result(builder, root, flow_id, process_id, names[i], duration)
+                except Exception as e:
+                    result = self._failed_result(flow_id, process_id, names[i], e)
+                self.results.append(result)
+                start_time = datetime.now()
             
+            print(f"\n✓ 森林模式: {len(roots)} 个根节点共查询 {len(builder.exchange_cache)} 个 process 的上游")
+        
         except Exception as e:
-            print(f"✗ 失败: {e}")
-            
-            stats = {
-                "name": name,
-                "flow_id": flow_id,
-                "process_id": process_id,
-                "success": False,
-                "error": str(e)
-            }
-            
-            return stats
-            
+            # 预取失败：尚未分析的根节点全部记为失败
+            for (flow_id, process_id, _), name in list(zip(roots, names))[len(self.results):]:
+                self.results.append(self._failed_result(flow_id, process_id, name, e))
+        
         finally:
             builder.close_db()
     
-    def analyze_batch(self, roots: List[Tuple[str, str, str]]):
+    def analyze_batch(self, roots: List[Tuple[str, str, str]], forest: bool = False):
         """
         批量分析
         
         Args:
             roots: [(flow_id, process_id, name), ...]
+            forest: 是否使用森林模式（所有根节点共用 exchange / 名称缓存，见 analyze_forest）
         """
         print("=" * 60)
         print("批量过程树分析")
@@ -127,12 +177,15 @@ class BatchAnalyzer:
         # 创建输出目录
         self.setup_output_dir()
         
-        # 逐个分析
-        for i, (flow_id, process_id, name) in enumerate(roots, 1):
-            print(f"\n[{i}/{len(roots)}]")
-            
-            result = self.analyze_single(flow_id, process_id, name)
-            self.results.append(result)
+        if forest:
+            self.analyze_forest(roots)
+        else:
+            # 逐个分析
+            for i, (flow_id, process_id, name) in enumerate(roots, 1):
+                print(f"\n[{i}/{len(roots)}]")
+                
+                result = self.analyze_single(flow_id, process_id, name)
+                self.results.append(result)
         
         # 生成汇总报告
         self.generate_summary_report()
@@ -204,7 +257,8 @@ class BatchAnalyzer:
 
 
 def main():
-    """主函数 - 示例用法"""
+    """主函数 - 示例用法（--forest: 所有根节点共用一份上游缓存）"""
+    import sys
     
     # 定义要分析的根节点列表
     # 格式: (flow_id, process_id, name)
@@ -233,7 +287,7 @@ def main():
     analyzer = BatchAnalyzer()
     
     # 执行批量分析
-    analyzer.analyze_batch(roots)
+    analyzer.analyze_batch(roots, forest="--forest" in sys.argv)
     
     print("\n" + "=" * 60)
     print("✓ 批量分析完成！")
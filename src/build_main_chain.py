@@ -5,14 +5,23 @@ UPR Main Chain Builder - 主链路生成器
 按照 exchange value 最大值规则，递归追溯上游生产过程，构建单一主链路。
 
 规则：在每个层级，选择 value 最大的 input exchange 作为主要来源
+
+Top-k 模式：最佳优先搜索，按路径上 value 的乘积（或 GWP 贡献度的乘积）输出得分最高的 k 条链路
 """
 
-import psycopg2
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from datetime import datetime
+import heapq
 import os
 import config
+import db_pool
+from exchange_snapshot import ExchangeSnapshot, get_snapshot
+from cycle_condensation import strongly_connected_components
+from disk_cache import DiskCache
+from offline_store import OfflineStore, open_store
+from name_resolver import fetch_names, cacheable_names, collect_chain_ids
+from db_pool import execute_statement
 
 # 确保输出目录存在
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'output')
@@ -22,6 +31,9 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 class MainChainNode:
     """表示主链路的一个节点"""
     
+    __slots__ = ('process_id', 'flow_id', 'value', 'level', 'unit_id', 'gwp',
+                 'gwp_contribution', 'next_node')
+    
     def __init__(self, process_id: str, flow_id: Optional[str] = None, 
                  value: float = 0.0, level: int = 0,
                  unit_id: Optional[str] = None,
@@ -54,10 +66,25 @@ class MainChainBuilder:
         self.mode = mode
         self.conn = None
         self.cursor = None
+        self.filter_conn = None
+        self.filter_cursor = None
         self.visited = set()  # 记录已访问的 process，防止循环
         self.process_names: Dict[str, str] = {}  # 缓存 process 名称
         self.flow_names: Dict[str, str] = {}  # 缓存 flow 名称
         self.unit_names: Dict[str, str] = {}  # 缓存 unit 名称
+        self.snapshot: Optional[ExchangeSnapshot] = None  # 内存快照（加载后遍历不再查询数据库）
+        self.successors: Optional[Dict[str, Dict]] = None  # 预计算的后继表：process_id -> value 最大的 input exchange
+        self._suffix_cache: Dict[str, Tuple[tuple, int]] = {}  # process_id -> (共享的链路 exchanges, 起始偏移)
+        self.use_prepared = config.USE_PREPARED_STATEMENTS  # 热点查询是否使用 PREPARE/EXECUTE
+        self.category_exchange_ids: Optional[frozenset] = None  # 建设模式：符合 category 过滤的 exchange ID 集合
+        self._candidates: Dict[str, List[Dict]] = {}  # Top-k 搜索：process_id -> 可追溯的上游 input exchanges
+        self._suffix_bounds: Dict[str, float] = {}  # Top-k 搜索（rank_by="value"）：process_id -> 上游路径 value 乘积的上界
+        self._max_values: Dict[str, Optional[Dict]] = {}  # process_id -> 查询到的 value 最大的上游（None 表示没有）
+        self._all_exchanges: Dict[str, Dict[str, List[Dict]]] = {}  # process_id -> get_all_exchanges 结果
+        self.use_disk_cache = config.DISK_CACHE_ENABLED  # 是否使用本地磁盘缓存（见 disk_cache.py）
+        self.disk_cache: Optional[DiskCache] = None
+        self.use_offline_store = config.OFFLINE_MODE  # 是否从离线文件读取（不连接数据库，见 offline_store.py）
+        self.store: Optional[OfflineStore] = None
         
         # 根据模式设置数据库配置
         if mode == "editor":
@@ -84,52 +111,313 @@ class MainChainBuilder:
             self.category_filter = None
     
     def connect_db(self):
-        """连接到 PostgreSQL 数据库"""
+        """从共享连接池借用 PostgreSQL 数据库连接（离线模式下改为打开离线文件并加载其中的快照）"""
+        if self.use_offline_store:
+            self.connect_store()
+            return
         try:
-            self.conn = psycopg2.connect(
-                host=config.PG_HOST,
-                port=config.PG_PORT,
-                user=config.PG_USER,
-                password=config.PG_PASSWORD,
-                database=self.database
-            )
+            self.conn = db_pool.get_connection(self.database)
             self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
             mode_text = "建设模式" if self.mode == "editor" else "生产模式"
             print(f"✓ 成功连接到数据库: {self.database} ({mode_text})")
             
-            # Editor 模式需要额外连接 filter 数据库
-            if self.mode == "editor" and self.filter_db:
-                self.filter_conn = psycopg2.connect(
-                    host=config.PG_HOST,
-                    port=config.PG_PORT,
-                    user=config.PG_USER,
-                    password=config.PG_PASSWORD,
-                    database=self.filter_db
-                )
-                self.filter_cursor = self.filter_conn.cursor(cursor_factory=RealDictCursor)
-                print(f"✓ 成功连接到过滤数据库: {self.filter_db}")
+            # 磁盘缓存中有 category 过滤集合时不再连接 filter 数据库
+            if self.use_disk_cache and self.disk_cache is None:
+                self.open_disk_cache()
+            
+            # Editor 模式启动时从 filter 数据库一次性加载 category 过滤集合，之后不再需要该连接
+            self.ensure_category_filter()
         except Exception as e:
             print(f"✗ 数据库连接失败: {e}")
             raise
     
+    def ensure_category_filter(self):
+        """建设模式：category 过滤集合尚未设置时，借用 filter 数据库连接一次性加载，之后归还该连接"""
+        if self.mode != "editor" or not self.filter_db or self.category_exchange_ids is not None:
+            return
+        self.filter_conn = db_pool.get_connection(self.filter_db)
+        self.filter_cursor = self.filter_conn.cursor(cursor_factory=RealDictCursor)
+        print(f"✓ 成功连接到过滤数据库: {self.filter_db}")
+        try:
+            self.load_category_filter()
+        finally:
+            self.filter_cursor.close()
+            self.filter_cursor = None
+            db_pool.release_connection(self.filter_conn, self.filter_db)
+            self.filter_conn = None
+    
+    def connect_store(self):
+        """离线模式：打开离线文件，快照、名称、根节点 exchanges 和 category 过滤集合都从文件读取"""
+        self.store = open_store()
+        if self.snapshot is None:
+            self.snapshot = self.store.exchange_graph()
+        mode_text = "建设模式" if self.mode == "editor" else "生产模式"
+        print(f"✓ 离线模式: {self.store.path} (VERSION {self.store.version}, {mode_text})")
+        if self.mode == "editor" and self.filter_db and self.category_exchange_ids is None:
+            self.category_exchange_ids = self.store.category_exchange_ids(self.category_filter)
+            if self.category_exchange_ids is None:
+                raise ValueError(f"离线文件中没有 category {self.category_filter} 的过滤集合，"
+                                 f"请使用 python src/offline_store.py --export --editor 重新导出")
+    
+    def load_category_filter(self):
+        """
+        建设模式：一次性读取 hiq_editor 中所有符合 EDITOR_CATEGORY_FILTER 的 input exchange ID
+        
+        结果保存为内存中的 frozenset，之后每一跳在本地过滤，不再跨库查询 tw_exchanges / tw_process_data。
+        """
+        start_time = datetime.now()
+        # 使用服务端游标分批读取
+        cursor = self.filter_conn.cursor(name="category_filter_ids")
+        cursor.itersize = 50000
+        try:
+            cursor.execute(self._category_filter_query(), (self.category_filter,))
+            self.category_exchange_ids = frozenset(row[0] for row in cursor)
+        finally:
+            cursor.close()
+        duration = (datetime.now() - start_time).total_seconds()
+        print(f"✓ 已加载 category 过滤集合: {len(self.category_exchange_ids)} 条 exchange "
+              f"(category_id={self.category_filter}), 耗时 {duration:.2f} 秒")
+    
+    def _category_filter_query(self) -> str:
+        """category 过滤集合的 SQL（参数: category_id）"""
+        return f"""
+            SELECT DISTINCT e.id
+            FROM public.tw_exchanges e
+            INNER JOIN public.{self.process_data_table} pd ON e.id = pd.id
+            WHERE e.is_input = true
+              AND e.is_deleted = false
+              AND pd.category_id = %s
+        """
+    
     def close_db(self):
-        """关闭数据库连接"""
+        """关闭游标并将连接归还连接池（启用磁盘缓存时先写回本次新查询的记录；离线文件由同进程的构建器共用，不关闭）"""
+        if self.store is not None:
+            return
+        if self.disk_cache is not None:
+            self.save_disk_cache()
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.conn:
-            self.conn.close()
-        if self.mode == "editor" and hasattr(self, 'filter_cursor'):
-            if self.filter_cursor:
-                self.filter_cursor.close()
-            if self.filter_conn:
-                self.filter_conn.close()
-        print("✓ 数据库连接已关闭")
+            db_pool.release_connection(self.conn, self.database)
+            self.conn = None
+        if self.filter_cursor:
+            self.filter_cursor.close()
+            self.filter_cursor = None
+        if self.filter_conn:
+            db_pool.release_connection(self.filter_conn, self.filter_db)
+            self.filter_conn = None
+        print("✓ 数据库连接已归还连接池")
+    
+    def load_snapshot(self, use_copy: bool = True):
+        """一次性加载当前 VERSION 的 exchange 快照，之后的遍历不再逐节点查询 tb_exchanges（离线模式已加载）"""
+        if self.store is not None:
+            return
+        self.snapshot = get_snapshot(self.conn, self.database, self.schema,
+                                     self.exchanges_table, use_copy=use_copy)
+    
+    def open_disk_cache(self):
+        """
+        打开本地磁盘缓存（按数据库、版本、模式和 category 过滤分区），载入未过期的
+        逐跳查询结果、Top-k 候选、根节点 exchanges、名称和建设模式的 category 过滤集合
+        """
+        self.disk_cache = DiskCache(self.database, config.VERSION, self.mode, self.category_filter)
+        self._max_values.update(self.disk_cache.load("max_value"))
+        self._candidates.update(self.disk_cache.load("candidates"))
+        self._all_exchanges.update(self.disk_cache.load("all_exchanges"))
+        self.process_names.update(cacheable_names(self.disk_cache.load("process"), "Process"))
+        self.flow_names.update(cacheable_names(self.disk_cache.load("flow"), "Flow"))
+        self.unit_names.update(cacheable_names(self.disk_cache.load("unit")))
+        if self.category_filter and self.category_exchange_ids is None:
+            exchange_ids = self.disk_cache.load("category_filter").get(self.category_filter)
+            if exchange_ids is not None:
+                self.category_exchange_ids = frozenset(exchange_ids)
+        print(f"✓ 磁盘缓存: {len(self._max_values) + len(self._candidates)} 个 process 的上游, "
+              f"{len(self.process_names) + len(self.flow_names) + len(self.unit_names)} 个名称 "
+              f"({self.disk_cache.path})")
+    
+    def save_disk_cache(self):
+        """把本次新查询的记录写回磁盘缓存（不写占位名称；已加载快照时候选来自快照，不写回），并关闭缓存文件"""
+        try:
+            self.disk_cache.save("max_value", self._max_values)
+            if self.snapshot is None:
+                self.disk_cache.save("candidates", self._candidates)
+            self.disk_cache.save("all_exchanges", self._all_exchanges)
+            self.disk_cache.save("process", cacheable_names(self.process_names, "Process"))
+            self.disk_cache.save("flow", cacheable_names(self.flow_names, "Flow"))
+            self.disk_cache.save("unit", cacheable_names(self.unit_names))
+            if self.category_filter and self.category_exchange_ids is not None:
+                self.disk_cache.save("category_filter", {self.category_filter: self.category_exchange_ids})
+            print(f"✓ 磁盘缓存已写回: {self.disk_cache.written} 条新记录")
+        finally:
+            self.disk_cache.close()
+            self.disk_cache = None
+    
+    def precompute_successors(self):
+        """
+        预计算整个版本的主链路后继表
+        
+        用一次 DISTINCT ON (process_id) 查询为每个 process 选出 value 最大的 input exchange，
+        保存为内存中的后继表。之后任意 process 的主链路都只需在内存中沿指针前进。
+        已加载快照时直接从快照计算，不再访问数据库。
+        建设模式下使用预加载的 category 过滤集合在本地筛选。
+        """
+        start_time = datetime.now()
+        successors: Dict[str, Dict] = {}
+        allowed_ids = self.category_exchange_ids if self.mode == "editor" else None
+        
+        if self.snapshot is not None:
+            for process_id in self.snapshot.processes():
+                exchange = self.snapshot.max_value_exchange(process_id, allowed_ids)
+                if exchange:
+                    successors[process_id] = exchange
+        elif allowed_ids is not None:
+            # 建设模式：按 value 降序读取全部候选，在本地取每个 process 第一条符合 category 的记录
+            query = f"""
+                SELECT 
+                    id,
+                    process_id,
+                    flow_id,
+                    provider_id,
+                    value,
+                    unit_id,
+                    gwp,
+                    gwp_contribution
+                FROM {self.schema}.{self.exchanges_table}
+                WHERE is_input = true
+                  AND provider_id IS NOT NULL
+                  AND provider_id != ''
+                  AND is_deleted = false
+                  AND version = %s
+                ORDER BY process_id, value DESC NULLS LAST
+            """
+            cursor = self.conn.cursor(name="main_chain_successors", cursor_factory=RealDictCursor)
+            cursor.itersize = 20000
+            try:
+                cursor.execute(query, (config.VERSION,))
+                for row in cursor:
+                    if row['process_id'] not in successors and row['id'] in allowed_ids:
+                        successors[row['process_id']] = row
+            finally:
+                cursor.close()
+        else:
+            query = f"""
+                SELECT DISTINCT ON (process_id)
+                    process_id,
+                    flow_id,
+                    provider_id,
+                    value,
+                    unit_id,
+                    gwp,
+                    gwp_contribution
+                FROM {self.schema}.{self.exchanges_table}
+                WHERE is_input = true
+                  AND provider_id IS NOT NULL
+                  AND provider_id != ''
+                  AND is_deleted = false
+                  AND version = %s
+                ORDER BY process_id, value DESC NULLS LAST
+            """
+            # 使用服务端游标分批读取，避免一次性缓存整个结果集
+            cursor = self.conn.cursor(name="main_chain_successors", cursor_factory=RealDictCursor)
+            cursor.itersize = 20000
+            try:
+                cursor.execute(query, (config.VERSION,))
+                for row in cursor:
+                    successors[row['process_id']] = row
+            finally:
+                cursor.close()
+        
+        self.successors = successors
+        self._suffix_cache.clear()
+        duration = (datetime.now() - start_time).total_seconds()
+        print(f"✓ 后继表预计算完成: {len(successors)} 个 process, 耗时 {duration:.2f} 秒")
+    
+    def _follow_successors(self, process_id: str) -> tuple:
+        """
+        沿后继表前进，返回从 process_id 出发的主链路 exchanges
+        
+        遇到已缓存后缀的 process 时直接复用其后缀；新走过的、不在环上的 process
+        记录为共享后缀的 (tuple, 偏移)，供以后以它为起点或经过它的链路复用。
+        """
+        path: List[Dict] = []
+        walked: List[str] = []
+        position: Dict[str, int] = {}
+        current = process_id
+        cycle_start = None
+        
+        while True:
+            if current in self._suffix_cache:
+                suffix, offset = self._suffix_cache[current]
+                path.extend(suffix[offset:])
+                break
+            
+            walked.append(current)
+            position[current] = len(walked) - 1
+            exchange = self.successors.get(current)
+            if not exchange:
+                break
+            
+            path.append(exchange)
+            current = exchange['provider_id']
+            if current in position:
+                # 回到本链路上已访问的 process：环上的节点后缀取决于起点，不缓存
+                cycle_start = position[current]
+                break
+        
+        chain = tuple(path)
+        cacheable = len(walked) if cycle_start is None else cycle_start
+        for index in range(cacheable):
+            self._suffix_cache[walked[index]] = (chain, index)
+        return chain
+    
+    def build_chain_from_successors(self, process_id: str, flow_id: Optional[str] = None,
+                                    value: float = 0.0) -> MainChainNode:
+        """
+        基于预计算的后继表构建主链路（不查询数据库）
+        
+        结果与 build_chain_recursive 相同：遇到已访问的 process 时停止追溯。
+        
+        Args:
+            process_id: 链路起点 process ID
+            flow_id: 起点的 flow（可选）
+            value: 起点的权重值
+        
+        Returns:
+            MainChainNode: 链路头节点
+        """
+        if self.successors is None:
+            self.precompute_successors()
+        if self.successors is None:
+            return self.build_chain_recursive(process_id, flow_id, value, 0)
+        
+        chain = self._follow_successors(process_id)
+        
+        head = MainChainNode(process_id, flow_id, value, 0)
+        self.visited.add(process_id)
+        current = head
+        for level, exchange in enumerate(chain, 1):
+            node = MainChainNode(
+                exchange['provider_id'],
+                exchange['flow_id'],
+                float(exchange['value']) if exchange['value'] else 0.0,
+                level,
+                exchange.get('unit_id'),
+                float(exchange.get('gwp')) if exchange.get('gwp') else None,
+                float(exchange.get('gwp_contribution')) if exchange.get('gwp_contribution') else None
+            )
+            current.set_next(node)
+            current = node
+            self.visited.add(node.process_id)
+        
+        print(f"✓ 主链路: {len(chain) + 1} 个节点（后继表）")
+        return head
     
     def get_max_value_exchange(self, process_id: str) -> Optional[Dict]:
         """
         获取指定 process 的 value 最大的上游 input exchange
         
-        在 editor 模式下，只查找"原材料和燃料"类型的物料
+        在 editor 模式下，只查找"原材料和燃料"类型的物料（使用预加载的 category 过滤集合）
         
         返回满足以下条件的记录中 value 最大的一条：
         - is_input = true
@@ -138,32 +426,24 @@ class MainChainBuilder:
         - version = VERSION
         - value 最大
         - (editor模式) 物料类型为"原材料和燃料"
+        
+        已预计算后继表时直接查表；查询结果按 process 缓存（批量分析中共用的上游只查询一次）
         """
+        if self.successors is not None:
+            return self.successors.get(process_id)
+        
+        if process_id in self._max_values:
+            return self._max_values[process_id]
+        
         if self.mode == "editor" and self.process_data_table:
-            # 建设模式：分两步查询（跨数据库）
-            # 步骤1：从 hiq_editor.tw_process_data 获取这个 process 下符合 category 的 exchange IDs
-            # 优化：只查询当前 process_id 的数据，不全量查询
-            filter_query = f"""
-                SELECT DISTINCT e.id
-                FROM public.tw_exchanges e
-                INNER JOIN public.{self.process_data_table} pd ON e.id = pd.id
-                WHERE e.process_id = %s
-                  AND e.is_input = true
-                  AND e.provider_id IS NOT NULL
-                  AND e.provider_id != ''
-                  AND e.is_deleted = false
-                  AND pd.category_id = %s
-            """
-            self.filter_cursor.execute(filter_query, (process_id, self.category_filter))
-            filter_results = self.filter_cursor.fetchall()
-            valid_ids = [row['id'] for row in filter_results]
-            
-            if not valid_ids:
-                return None
+            # 建设模式：category 过滤使用启动时加载的 ID 集合，在本地完成
+            if self.snapshot is not None:
+                return self.snapshot.max_value_exchange(process_id, self.category_exchange_ids)
             
-            # 步骤2：从 hiq_background_db.tb_exchanges 查询这些 IDs 的数据
+            # 按 value 降序读取候选，取第一条符合 category 的记录
             query = f"""
                 SELECT 
+                    id,
                     process_id,
                     flow_id,
                     provider_id,
@@ -182,12 +462,16 @@ class MainChainBuilder:
                   AND provider_id != ''
                   AND is_deleted = false
                   AND version = %s
-                  AND id = ANY(%s)
                 ORDER BY value DESC NULLS LAST
-                LIMIT 1
             """
-            self.cursor.execute(query, (process_id, config.VERSION, valid_ids))
+            execute_statement(self.cursor, "max_value_candidates", query,
+                              (process_id, config.VERSION), self.use_prepared)
+            result = next((row for row in self.cursor.fetchall()
+                           if row['id'] in self.category_exchange_ids), None)
         else:
+            if self.snapshot is not None:
+                return self.snapshot.max_value_exchange(process_id)
+            
             # 生产模式：原有逻辑
             query = f"""
                 SELECT 
@@ -212,9 +496,12 @@ class MainChainBuilder:
                 ORDER BY value DESC NULLS LAST
                 LIMIT 1
             """
-            self.cursor.execute(query, (process_id, config.VERSION))
+            execute_statement(self.cursor, "max_value_exchange", query,
+                              (process_id, config.VERSION), self.use_prepared)
         
-        result = self.cursor.fetchone()
+            result = self.cursor.fetchone()
+        
+        self._max_values[process_id] = result
         return result
     
     def get_all_exchanges(self, process_id: str) -> Dict[str, List[Dict]]:
@@ -226,26 +513,21 @@ class MainChainBuilder:
         Returns:
             Dict with 'inputs' and 'outputs' keys, each containing list of exchanges
         """
+        if process_id in self._all_exchanges:
+            return self._all_exchanges[process_id]
+        
+        if self.store is not None:
+            exchanges = self._group_exchanges(self.store.all_exchanges(process_id))
+        else:
+            self.cursor.execute(self._all_exchanges_query(), (process_id, config.VERSION))
+            exchanges = self._group_exchanges(self.cursor.fetchall())
+        self._all_exchanges[process_id] = exchanges
+        return exchanges
+    
+    def _all_exchanges_query(self) -> str:
+        """get_all_exchanges 的 SQL（建设模式额外读取 id，用于 category 过滤）"""
         if self.mode == "editor" and self.process_data_table:
-            # 建设模式：分两步查询
-            # 步骤1：获取这个 process 下符合 category 的 exchange IDs（优化：不全量查询）
-            filter_query = f"""
-                SELECT DISTINCT e.id
-                FROM public.tw_exchanges e
-                INNER JOIN public.{self.process_data_table} pd ON e.id = pd.id
-                WHERE e.process_id = %s
-                  AND e.is_input = true
-                  AND e.is_deleted = false
-                  AND pd.category_id = %s
-            """
-            self.filter_cursor.execute(filter_query, (process_id, self.category_filter))
-            filter_results = self.filter_cursor.fetchall()
-            valid_ids = [row['id'] for row in filter_results]
-            
-            # 步骤2：从 tb_exchanges 查询数据
-            # 输出：全部显示
-            # 输入：只显示在 valid_ids 中的
-            query = f"""
+            return f"""
                 SELECT 
                     flow_id,
                     provider_id,
@@ -257,37 +539,34 @@ class MainChainBuilder:
                     description,
                     id
                 FROM {self.schema}.{self.exchanges_table}
-                WHERE process_id = %s
-                  AND is_deleted = false
-                  AND version = %s
-                  AND (
-                    is_input = false 
-                    OR (is_input = true AND id = ANY(%s))
-                  )
-                ORDER BY is_input DESC, value DESC NULLS LAST
-            """
-            self.cursor.execute(query, (process_id, config.VERSION, valid_ids))
-        else:
-            # 生产模式：原有逻辑
-            query = f"""
-                SELECT 
-                    flow_id,
-                    provider_id,
-                    value,
-                    is_input,
-                    unit_id,
-                    gwp,
-                    gwp_contribution,
-                    description
-                FROM {self.schema}.{self.exchanges_table}
                 WHERE process_id = %s
                   AND is_deleted = false
                   AND version = %s
                 ORDER BY is_input DESC, value DESC NULLS LAST
             """
-            self.cursor.execute(query, (process_id, config.VERSION))
-        
-        results = self.cursor.fetchall()
+        # 生产模式：原有逻辑
+        return f"""
+            SELECT 
+                flow_id,
+                provider_id,
+                value,
+                is_input,
+                unit_id,
+                gwp,
+                gwp_contribution,
+                description
+            FROM {self.schema}.{self.exchanges_table}
+            WHERE process_id = %s
+              AND is_deleted = false
+              AND version = %s
+            ORDER BY is_input DESC, value DESC NULLS LAST
+        """
+    
+    def _group_exchanges(self, results: List[Dict]) -> Dict[str, List[Dict]]:
+        """把 get_all_exchanges 的查询结果分为输入 / 输出（建设模式的输入只保留 category 过滤集合中的）"""
+        if self.mode == "editor" and self.process_data_table:
+            results = [row for row in results
+                       if not row['is_input'] or row['id'] in self.category_exchange_ids]
         
         exchanges = {
             'inputs': [],
@@ -312,81 +591,29 @@ class MainChainBuilder:
         
         return exchanges
     
+    def _format_name(self, row: Optional[Dict]) -> Optional[str]:
+        """格式化名称：非指定版本的名称附加 [v版本号]"""
+        if not row or not row['name']:
+            return None
+        if row['version'] == config.VERSION:
+            return row['name']
+        return f"{row['name']} [v{row['version']}]"
+    
     def get_process_name(self, process_id: str) -> str:
-        """获取 process 的名称（优先查询指定版本，如果没有则查询任意版本）"""
+        """获取 process 的名称（优先指定版本，如果没有则取最新版本，在同一条 SQL 中选择）"""
         if process_id in self.process_names:
             return self.process_names[process_id]
         
-        name = None
-        try:
-            # 先尝试查询指定版本
-            query = f"""
-                SELECT name, version FROM {self.schema}.{self.processes_table}
-                WHERE id = %s AND version = %s
-            """
-            self.cursor.execute(query, (process_id, config.VERSION))
-            result = self.cursor.fetchone()
-            
-            if result:
-                name = result['name']
-            else:
-                # 如果指定版本没有，尝试查询任意版本（优先较新版本）
-                query = f"""
-                    SELECT name, version FROM {self.schema}.{self.processes_table}
-                    WHERE id = %s
-                    ORDER BY version DESC
-                    LIMIT 1
-                """
-                self.cursor.execute(query, (process_id,))
-                result = self.cursor.fetchone()
-                if result:
-                    name = f"{result['name']} [v{result['version']}]"
-        except Exception as e:
-            print(f"⚠️  获取 process 名称失败: {e}")
-        
-        if not name:
-            name = f"Process-{process_id[:8]}..."
-        
-        self.process_names[process_id] = name
-        return name
+        self.resolve_names(process_ids=[process_id])
+        return self.process_names[process_id]
     
     def get_flow_name(self, flow_id: str) -> str:
-        """获取 flow 的名称（优先查询指定版本，如果没有则查询任意版本）"""
+        """获取 flow 的名称（优先指定版本，如果没有则取最新版本，在同一条 SQL 中选择）"""
         if flow_id in self.flow_names:
             return self.flow_names[flow_id]
         
-        name = None
-        try:
-            # 先尝试查询指定版本
-            query = f"""
-                SELECT name, version FROM {self.schema}.{self.flows_table}
-                WHERE id = %s AND version = %s
-            """
-            self.cursor.execute(query, (flow_id, config.VERSION))
-            result = self.cursor.fetchone()
-            
-            if result:
-                name = result['name']
-            else:
-                # 如果指定版本没有，尝试查询任意版本（优先较新版本）
-                query = f"""
-                    SELECT name, version FROM {self.schema}.{self.flows_table}
-                    WHERE id = %s
-                    ORDER BY version DESC
-                    LIMIT 1
-                """
-                self.cursor.execute(query, (flow_id,))
-                result = self.cursor.fetchone()
-                if result:
-                    name = f"{result['name']} [v{result['version']}]"
-        except Exception as e:
-            print(f"⚠️  获取 flow 名称失败: {e}")
-        
-        if not name:
-            name = f"Flow-{flow_id[:8]}..."
-        
-        self.flow_names[flow_id] = name
-        return name
+        self.resolve_names(flow_ids=[flow_id])
+        return self.flow_names[flow_id]
     
     def get_unit_name(self, unit_id: str) -> str:
         """获取 unit 的名称"""
@@ -396,23 +623,59 @@ class MainChainBuilder:
         if unit_id in self.unit_names:
             return self.unit_names[unit_id]
         
-        try:
-            query = f"""
-                SELECT name FROM {self.schema}.{self.units_table}
-                WHERE id = %s
-                LIMIT 1
-            """
-            self.cursor.execute(query, (unit_id,))
-            result = self.cursor.fetchone()
-            name = result['name'] if result else None
-        except:
-            name = None
+        self.resolve_names(unit_ids=[unit_id])
+        return self.unit_names[unit_id]
+    
+    def resolve_names(self, process_ids: List[str] = (), flow_ids: List[str] = (),
+                      unit_ids: List[str] = ()):
+        """
+        批量解析 process / flow / unit 名称并填充缓存
+        
+        每类只发出一次 id = ANY(%s) 查询，指定版本优先、否则取最新版本的选择在 SQL 中完成。
+        """
+        missing = [pid for pid in dict.fromkeys(process_ids) if pid and pid not in self.process_names]
+        if missing:
+            rows = self._fetch_names(f"{self.schema}.{self.processes_table}", missing, config.VERSION)
+            for pid in missing:
+                self.process_names[pid] = self._format_name(rows.get(pid)) or f"Process-{pid[:8]}..."
         
-        if not name:
-            name = "N/A"
+        missing = [fid for fid in dict.fromkeys(flow_ids) if fid and fid not in self.flow_names]
+        if missing:
+            rows = self._fetch_names(f"{self.schema}.{self.flows_table}", missing, config.VERSION)
+            for fid in missing:
+                self.flow_names[fid] = self._format_name(rows.get(fid)) or f"Flow-{fid[:8]}..."
         
-        self.unit_names[unit_id] = name
-        return name
+        missing = [uid for uid in dict.fromkeys(unit_ids) if uid and uid not in self.unit_names]
+        if missing:
+            rows = self._fetch_names(f"{self.schema}.{self.units_table}", missing)
+            for uid in missing:
+                row = rows.get(uid)
+                self.unit_names[uid] = row['name'] if row and row['name'] else "N/A"
+    
+    def _fetch_names(self, table: str, ids: List[str], version: Optional[str] = None) -> Dict[str, Dict]:
+        """名称查询：离线模式读取离线文件，否则查询数据库"""
+        if self.store is not None:
+            return self.store.fetch_names(table, ids, version)
+        return fetch_names(self.cursor, table, ids, version, prepared=self.use_prepared)
+    
+    def prefetch_chain_names(self, head_node: MainChainNode, exchanges: Optional[Dict] = None,
+                             root_process_id: Optional[str] = None):
+        """
+        收集主链路（以及根节点输入/输出 exchanges）涉及的全部 ID，在渲染前一次性解析名称
+        
+        Args:
+            head_node: 链路头节点
+            exchanges: get_all_exchanges 的结果（可选）
+            root_process_id: 额外需要解析的根 process ID（可选）
+        """
+        process_ids, flow_ids, unit_ids = collect_chain_ids(head_node)
+        if root_process_id:
+            process_ids.append(root_process_id)
+        if exchanges:
+            for exchange in exchanges['inputs'] + exchanges['outputs']:
+                flow_ids.append(exchange['flow_id'])
+                unit_ids.append(exchange['unit_id'])
+        self.resolve_names(process_ids, flow_ids, unit_ids)
     
     def build_chain_recursive(self, process_id: str, flow_id: Optional[str] = None, 
                              value: float = 0.0, level: int = 0,
@@ -420,7 +683,7 @@ class MainChainBuilder:
                              gwp: Optional[float] = None,
                              gwp_contribution: Optional[float] = None) -> MainChainNode:
         """
-        递归构建主链路
+        构建主链路（逐跳迭代，不受 Python 递归深度限制）
         
         Args:
             process_id: 当前 process ID
@@ -432,57 +695,304 @@ class MainChainBuilder:
             gwp_contribution: GWP贡献度
         
         Returns:
-            MainChainNode: 当前节点
+            MainChainNode: 链路头节点
         """
-        # 创建当前节点
-        node = MainChainNode(process_id, flow_id, value, level, unit_id, gwp, gwp_contribution)
-        
-        # 检查是否已访问（防止循环）
-        if process_id in self.visited:
-            print(f"{'  ' * level}⚠ 检测到循环: {process_id[:8]}... (已访问，停止追溯)")
-            return node
+        head = None
+        previous = None
         
-        # 标记为已访问
-        self.visited.add(process_id)
-        
-        # 获取 value 最大的上游 exchange
-        max_exchange = self.get_max_value_exchange(process_id)
-        
-        if max_exchange:
+        while True:
+            # 创建当前节点
+            node = MainChainNode(process_id, flow_id, value, level, unit_id, gwp, gwp_contribution)
+            if previous is None:
+                head = node
+            else:
+                previous.set_next(node)
+            previous = node
+            
+            # 检查是否已访问（防止循环）
+            if process_id in self.visited:
+                print(f"{'  ' * level}⚠ 检测到循环: {process_id[:8]}... (已访问，停止追溯)")
+                break
+            
+            # 标记为已访问
+            self.visited.add(process_id)
+            
+            # 获取 value 最大的上游 exchange
+            max_exchange = self.get_max_value_exchange(process_id)
+            
+            if not max_exchange:
+                process_name = self.process_names.get(process_id, f"{process_id[:8]}...")[:50]
+                print(f"{'  ' * level}└─ Process: {process_name} (叶子节点)")
+                break
+            
             upstream_process_id = max_exchange['provider_id']
             upstream_flow_id = max_exchange['flow_id']
             upstream_value = float(max_exchange['value']) if max_exchange['value'] else 0.0
             
-            process_name = self.get_process_name(process_id)[:50]
-            flow_name = self.get_flow_name(upstream_flow_id)[:50]
-            unit_name = self.get_unit_name(max_exchange.get('unit_id'))
+            # 名称在渲染前统一批量解析，遍历时只使用已缓存的名称
+            process_name = self.process_names.get(process_id, f"{process_id[:8]}...")[:50]
+            flow_name = self.flow_names.get(upstream_flow_id, f"{upstream_flow_id[:8]}...")[:50]
+            unit_name = self.unit_names.get(max_exchange.get('unit_id'), "")
             gwp = max_exchange.get('gwp')
             gwp_cont = max_exchange.get('gwp_contribution')
             
             print(f"{'  ' * level}├─ Process: {process_name}")
-            basis_parts = [f"value={upstream_value:.6f} {unit_name}", f"flow={flow_name}"]
+            basis_parts = [f"value={upstream_value:.6f} {unit_name}".rstrip(), f"flow={flow_name}"]
             if gwp is not None:
                 basis_parts.append(f"GWP={float(gwp):.6f}")
             if gwp_cont is not None:
                 basis_parts.append(f"贡献度={float(gwp_cont)*100:.2f}%")
             print(f"{'  ' * level}│  └─ 选择依据: {', '.join(basis_parts)}")
             
-            # 递归处理上游
-            next_node = self.build_chain_recursive(
-                upstream_process_id,
-                upstream_flow_id,
-                upstream_value,
-                level + 1,
-                max_exchange.get('unit_id'),
-                float(max_exchange.get('gwp')) if max_exchange.get('gwp') else None,
-                float(max_exchange.get('gwp_contribution')) if max_exchange.get('gwp_contribution') else None
-            )
-            node.set_next(next_node)
+            # 继续追溯上游
+            process_id = upstream_process_id
+            flow_id = upstream_flow_id
+            value = upstream_value
+            level += 1
+            unit_id = max_exchange.get('unit_id')
+            gwp = float(gwp) if gwp else None
+            gwp_contribution = float(gwp_cont) if gwp_cont else None
+        
+        return head
+    
+    def get_upstream_candidates(self, process_id: str) -> List[Dict]:
+        """
+        获取 process 可追溯的全部上游 input exchanges（Top-k 搜索的分支）
+        
+        条件与 get_max_value_exchange 相同（建设模式只保留 category 过滤集合中的记录）。
+        结果按 process 缓存，批量分析中多个起点共用的上游只查询一次；已加载快照时不查询数据库。
+        """
+        if process_id in self._candidates:
+            return self._candidates[process_id]
+        
+        if self.snapshot is not None:
+            rows = self.snapshot.upstream_exchanges(process_id)
         else:
-            process_name = self.get_process_name(process_id)[:50]
-            print(f"{'  ' * level}└─ Process: {process_name} (叶子节点)")
+            execute_statement(self.cursor, "upstream_candidates", self._candidates_query(),
+                              (process_id, config.VERSION), self.use_prepared)
+            rows = self.cursor.fetchall()
+        
+        return self._store_candidates(process_id, rows)
+    
+    def prefetch_candidates(self, process_id: str):
+        """
+        按层级批量读取 process_id 可达的全部上游候选（suffix_bound 需要整个可达候选图）
+        
+        每一层未缓存的 process 按 FRONTIER_BATCH_SIZE 分块，每块一次 process_id = ANY(%s) 查询，
+        查询次数随深度增长而不是随节点数增长。已加载快照时不需要预取；已有上界的 process 不再向上游展开。
+        """
+        if self.snapshot is not None:
+            return
+        
+        frontier = [process_id]
+        seen = {process_id}
+        while frontier:
+            pending = [pid for pid in frontier if pid not in self._candidates]
+            for start in range(0, len(pending), config.FRONTIER_BATCH_SIZE):
+                chunk = pending[start:start + config.FRONTIER_BATCH_SIZE]
+                grouped: Dict[str, List[Dict]] = {pid: [] for pid in chunk}
+                execute_statement(self.cursor, "upstream_candidates_batch", self._candidates_query(batch=True),
+                                  (chunk, config.VERSION), self.use_prepared)
+                for row in self.cursor.fetchall():
+                    grouped[row['process_id']].append(row)
+                for pid, rows in grouped.items():
+                    self._store_candidates(pid, rows)
+            
+            next_frontier = []
+            for pid in frontier:
+                for exchange in self._candidates[pid]:
+                    provider_id = exchange['provider_id']
+                    if provider_id not in seen and provider_id not in self._suffix_bounds:
+                        seen.add(provider_id)
+                        next_frontier.append(provider_id)
+            frontier = next_frontier
+    
+    def _candidates_query(self, batch: bool = False) -> str:
+        """
+        get_upstream_candidates 的 SQL（按 value 降序，第一条即 value 最大的 exchange）
+        
+        batch 为 True 时参数为 process ID 列表（ANY 查询），结果先按 process_id 分组。
+        """
+        process_filter = "process_id = ANY(%s)" if batch else "process_id = %s"
+        order = "process_id, value DESC NULLS LAST" if batch else "value DESC NULLS LAST"
+        return f"""
+            SELECT 
+                id,
+                process_id,
+                flow_id,
+                provider_id,
+                value,
+                unit_id,
+                gwp,
+                gwp_contribution
+            FROM {self.schema}.{self.exchanges_table}
+            WHERE {process_filter}
+              AND is_input = true
+              AND provider_id IS NOT NULL
+              AND provider_id != ''
+              AND is_deleted = false
+              AND version = %s
+            ORDER BY {order}
+        """
+    
+    def _store_candidates(self, process_id: str, rows: List[Dict]) -> List[Dict]:
+        """过滤（空 provider、建设模式的 category）后写入候选缓存"""
+        allowed_ids = self.category_exchange_ids if self.mode == "editor" and self.process_data_table else None
+        candidates = [row for row in rows
+                      if row['provider_id'] and (allowed_ids is None or row['id'] in allowed_ids)]
+        self._candidates[process_id] = candidates
+        return candidates
+    
+    @staticmethod
+    def _chain_factor(exchange: Dict, rank_by: str) -> float:
+        """一跳对链路得分的乘数：value 或 GWP 贡献度（空值和负值记为 0）"""
+        factor = exchange['gwp_contribution'] if rank_by == "gwp" else exchange['value']
+        return max(float(factor), 0.0) if factor else 0.0
+    
+    def suffix_bound(self, process_id: str) -> float:
+        """
+        从 process_id 向上游任意延伸的路径，value 乘积的上界（Top-k 搜索 rank_by="value" 的剪枝依据）
+        
+        value 可以大于 1，部分路径的得分不是其完整链路得分的上界。这里对可达的候选图做一次
+        强连通分量压缩（上游在前），按分量计算：
+        
+            上界 = 分量内各边 max(1, value) 之积 × max(1, 出边 value × 目标分量上界)
+        
+        简单路径在分量内每条边至多经过一次，所以这是有效上界；无环时即为精确的最大乘积。
+        可达的候选先由 prefetch_candidates 按层级批量读取；结果按 process 缓存，批量分析中多个起点共用。
+        """
+        if process_id in self._suffix_bounds:
+            return self._suffix_bounds[process_id]
+        self.prefetch_candidates(process_id)
+        
+        def providers(pid: str) -> List[str]:
+            return [exchange['provider_id'] for exchange in self.get_upstream_candidates(pid)
+                    if exchange['provider_id'] not in self._suffix_bounds]
+        
+        for component in strongly_connected_components([process_id], providers):
+            members = set(component)
+            inner, outer = 1.0, 1.0
+            for pid in component:
+                for exchange in self.get_upstream_candidates(pid):
+                    provider = exchange['provider_id']
+                    factor = self._chain_factor(exchange, "value")
+                    if provider == pid:
+                        continue  # 自环不会出现在链路中
+                    if provider in members:
+                        inner *= max(factor, 1.0)
+                    else:
+                        outer = max(outer, factor * self._suffix_bounds[provider])
+            bound = inner * outer
+            for pid in component:
+                self._suffix_bounds[pid] = bound
+        return self._suffix_bounds[process_id]
+    
+    def build_top_k_chains(self, process_id: str, k: int = 5, rank_by: str = "value",
+                           flow_id: Optional[str] = None) -> List[Tuple[float, MainChainNode]]:
+        """
+        最佳优先搜索得分最高的 k 条链路
+        
+        链路从 process_id 出发沿上游 input exchange 追溯，直到叶子节点或只剩回到本链路的边为止。
+        得分为路径上各跳乘数之积（rank_by="value"：exchange value；rank_by="gwp"：GWP 贡献度，
+        即该路径在根节点 GWP 中所占的份额）。
+        
+        优先队列按部分路径的得分上界弹出：GWP 贡献度不大于 1，上界即当前得分；value 可以大于 1，
+        上界为当前得分 × suffix_bound（需要先按层级批量读取起点可达的全部候选）。队列中没有上界超过第 k 条
+        已完成链路得分的部分路径时停止，结果是精确的。队列长度超过 TOP_K_MAX_FRONTIER 时只保留
+        上界最高的部分路径，弹出次数超过 TOP_K_MAX_EXPANSIONS 时提前结束（两者都会打印提示）。
+        
+        Args:
+            process_id: 链路起点 process ID
+            k: 输出链路数
+            rank_by: "value" 或 "gwp"
+            flow_id: 起点的 flow（可选）
+        
+        Returns:
+            [(得分, 链路头节点)]，按得分降序
+        """
+        max_frontier = config.TOP_K_MAX_FRONTIER
+        bound = self.suffix_bound if rank_by == "value" else (lambda pid: 1.0)
+        # 队列元素: (-得分上界, 序号, process_id, 层级, 到达该 process 的 exchange, 父元素, 得分)
+        start = (-bound(process_id), 0, process_id, 0, None, None, 1.0)
+        frontier = [start]
+        sequence = 1
+        completed = []
+        best_scores: List[float] = []  # 已完成链路中得分最高的 k 个（最小堆）
+        pruned = False
+        expansions = 0
+        
+        while frontier:
+            if len(best_scores) == k and -frontier[0][0] <= best_scores[0]:
+                break
+            if expansions >= config.TOP_K_MAX_EXPANSIONS:
+                pruned = True
+                break
+            entry = heapq.heappop(frontier)
+            expansions += 1
+            _, _, current_id, level, _, _, current_score = entry
+            
+            # 当前链路上的 process（环只追溯到回到链路为止）
+            on_path = set()
+            node = entry
+            while node is not None:
+                on_path.add(node[2])
+                node = node[5]
+            
+            extended = False
+            for exchange in self.get_upstream_candidates(current_id):
+                if exchange['provider_id'] in on_path:
+                    continue
+                score = current_score * self._chain_factor(exchange, rank_by)
+                heapq.heappush(frontier, (-score * bound(exchange['provider_id']), sequence,
+                                          exchange['provider_id'], level + 1, exchange, entry, score))
+                sequence += 1
+                extended = True
+            
+            if not extended:
+                completed.append(entry)
+                if len(best_scores) < k:
+                    heapq.heappush(best_scores, current_score)
+                elif current_score > best_scores[0]:
+                    heapq.heapreplace(best_scores, current_score)
+            
+            if len(frontier) > 2 * max_frontier:
+                frontier = heapq.nsmallest(max_frontier, frontier)
+                heapq.heapify(frontier)
+                pruned = True
+        
+        if pruned:
+            print(f"⚠ 搜索队列超过 {max_frontier} 条部分路径或展开次数超过 {config.TOP_K_MAX_EXPANSIONS}，"
+                  f"已提前截断（结果可能不精确）")
+        
+        # 完成顺序不一定是得分顺序（value 乘数可以大于 1），按得分排序后取前 k 条
+        completed.sort(key=lambda entry: (-entry[6], entry[1]))
+        chains = []
+        for entry in completed[:k]:
+            hops = []
+            node = entry
+            while node[5] is not None:
+                hops.append(node[4])
+                node = node[5]
+            hops.reverse()
+            
+            head = MainChainNode(process_id, flow_id, 0.0, 0)
+            current = head
+            for level, exchange in enumerate(hops, 1):
+                next_node = MainChainNode(
+                    exchange['provider_id'],
+                    exchange['flow_id'],
+                    float(exchange['value']) if exchange['value'] else 0.0,
+                    level,
+                    exchange.get('unit_id'),
+                    float(exchange.get('gwp')) if exchange.get('gwp') else None,
+                    float(exchange.get('gwp_contribution')) if exchange.get('gwp_contribution') else None
+                )
+                current.set_next(next_node)
+                current = next_node
+            chains.append((entry[6], head))
         
-        return node
+        print(f"✓ Top-{k} 链路: 找到 {len(chains)} 条（rank_by={rank_by}，展开 {expansions} 条部分路径）")
+        return chains
     
     def generate_markdown(self, head_node: MainChainNode, output_file: str):
         """
@@ -506,12 +1016,15 @@ class MainChainBuilder:
             f.write("---\n\n")
             
             # 添加根节点的输入输出信息
+            exchanges = self.get_all_exchanges(config.ROOT_PROCESS_ID)
+            
+            # 渲染前批量解析名称
+            self.prefetch_chain_names(head_node, exchanges, config.ROOT_PROCESS_ID)
+            
             f.write("## 根节点 (Level 0) 详细信息\n\n")
             root_process_name = self.get_process_name(config.ROOT_PROCESS_ID)
             f.write(f"**Process**: {root_process_name}\n\n")
             
-            exchanges = self.get_all_exchanges(config.ROOT_PROCESS_ID)
-            
             # 输入信息
             f.write(f"### 输入 (Inputs) - 共 {len(exchanges['inputs'])} 项\n\n")
             if exchanges['inputs']:
@@ -604,90 +1117,19 @@ class MainChainBuilder:
             f.write("=" * 80 + "\n")
             f.write(f"UPR 主链路 (Main Chain)\n")
             f.write("=" * 80 + "\n\n")
-            if self.mode == "editor":
-                f.write(f"物料类型过滤: 原材料和燃料 (category_id={self.category_filter})\n")
-            f.write(f"分析 Process ID: {head_node.process_id}\n")
-            f.write("规则: 每个层级选择 exchange value 最大的边\n")
-            if self.mode == "editor":
-                f.write("      建设模式下仅追溯\"原材料和燃料\"类型的上游物料\n")
-            f.write("\n")
-            
-            f.write("格式说明:\n")
-            f.write("  L<层级>: <Process名称> | <Process完整UUID>\n")
-            f.write("    << <Flow名称> | <Flow完整UUID> | value=<数值>\n")
-            f.write("    ↓\n\n")
-            f.write("=" * 80 + "\n\n")
+            self._write_compact_header(f, head_node.process_id, "每个层级选择 exchange value 最大的边")
             
             # 添加根节点详细信息（使用当前分析的 process）
-            root_process_name = self.get_process_name(head_node.process_id)
-            f.write("[根节点详细信息]\n")
-            f.write(f"Process: {root_process_name}\n\n")
-            
             exchanges = self.get_all_exchanges(head_node.process_id)
             
-            # 输入
-            f.write(f"输入 ({len(exchanges['inputs'])}项):\n")
-            if exchanges['inputs']:
-                for inp in exchanges['inputs']:
-                    flow_name = self.get_flow_name(inp['flow_id'])
-                    provider_short = inp['provider_id'][:8] if inp['provider_id'] else 'N/A'
-                    unit_name = self.get_unit_name(inp['unit_id'])
-                    parts = [f"value={inp['value']:.6f}", unit_name]
-                    if inp['gwp'] is not None:
-                        parts.append(f"GWP={inp['gwp']:.6f}")
-                    if inp['gwp_contribution'] is not None:
-                        parts.append(f"贡献度={inp['gwp_contribution']*100:.2f}%")
-                    f.write(f"  ← {flow_name} | {inp['flow_id']} | provider={provider_short}... | {' | '.join(parts)}\n")
-            else:
-                f.write("  (无)\n")
-            
-            f.write("\n")
+            # 渲染前批量解析名称
+            self.prefetch_chain_names(head_node, exchanges)
             
-            # 输出
-            f.write(f"输出 ({len(exchanges['outputs'])}项):\n")
-            if exchanges['outputs']:
-                for out in exchanges['outputs']:
-                    flow_name = self.get_flow_name(out['flow_id'])
-                    unit_name = self.get_unit_name(out['unit_id'])
-                    parts = [f"value={out['value']:.6f}", unit_name]
-                    if out['gwp'] is not None:
-                        parts.append(f"GWP={out['gwp']:.6f}")
-                    if out['gwp_contribution'] is not None:
-                        parts.append(f"贡献度={out['gwp_contribution']*100:.2f}%")
-                    f.write(f"  → {flow_name} | {out['flow_id']} | {' | '.join(parts)}\n")
-            else:
-                f.write("  (无)\n")
-            
-            f.write("\n" + "=" * 80 + "\n\n")
+            self._write_root_details(f, head_node.process_id, exchanges)
             f.write("[主链路路径]\n\n")
             
             # 遍历链路
-            current = head_node
-            chain_length = 0
-            
-            while current:
-                chain_length += 1
-                
-                # Process 行
-                process_name = self.get_process_name(current.process_id)
-                f.write(f"L{current.level}: {process_name} | {current.process_id}\n")
-                
-                # Flow 信息（只有当前节点有 flow_id 时才显示，即不是根节点）
-                if current.flow_id:
-                    flow_name = self.get_flow_name(current.flow_id)
-                    unit_name = self.get_unit_name(current.unit_id)
-                    parts = [f"value={current.value:.6f}", unit_name]
-                    if current.gwp is not None:
-                        parts.append(f"GWP={current.gwp:.6f}")
-                    if current.gwp_contribution is not None:
-                        parts.append(f"贡献度={current.gwp_contribution*100:.2f}%")
-                    f.write(f"  << {flow_name} | {current.flow_id} | {' | '.join(parts)}\n")
-                
-                # 如果有下一个节点，显示箭头
-                if current.next_node:
-                    f.write("  ↓\n")
-                
-                current = current.next_node
+            chain_length = self._write_chain_path(f, head_node)
             
             # 统计信息
             f.write("\n" + "=" * 80 + "\n")
@@ -697,8 +1139,149 @@ class MainChainBuilder:
         
         print(f"✓ 紧凑 TXT 文件已生成")
     
-    def run(self):
-        """运行完整流程"""
+    def generate_top_k_txt(self, chains: List[Tuple[float, MainChainNode]], output_file: str,
+                           rank_by: str = "value"):
+        """
+        生成 Top-k 链路的紧凑 TXT（每条链路的格式与 generate_compact_txt 相同）
+        
+        Args:
+            chains: build_top_k_chains 的结果
+            output_file: 输出文件路径
+            rank_by: 排序依据（"value" 或 "gwp"）
+        """
+        print(f"\n生成 Top-{len(chains)} 紧凑 TXT 文件: {output_file}")
+        if not chains:
+            return
+        
+        head_process_id = chains[0][1].process_id
+        rule = "value 乘积" if rank_by != "gwp" else "GWP 贡献度乘积"
+        
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write("=" * 80 + "\n")
+            f.write(f"UPR 主链路 Top-{len(chains)} (Main Chains)\n")
+            f.write("=" * 80 + "\n\n")
+            self._write_compact_header(f, head_process_id, f"按路径上各跳 {rule} 排序，输出得分最高的 {len(chains)} 条链路")
+            
+            exchanges = self.get_all_exchanges(head_process_id)
+            
+            # 渲染前一次性解析全部链路涉及的名称
+            process_ids, flow_ids, unit_ids = [], [], []
+            for _, head_node in chains:
+                chain_ids = collect_chain_ids(head_node)
+                process_ids.extend(chain_ids[0])
+                flow_ids.extend(chain_ids[1])
+                unit_ids.extend(chain_ids[2])
+            for exchange in exchanges['inputs'] + exchanges['outputs']:
+                flow_ids.append(exchange['flow_id'])
+                unit_ids.append(exchange['unit_id'])
+            self.resolve_names(process_ids, flow_ids, unit_ids)
+            
+            self._write_root_details(f, head_process_id, exchanges)
+            
+            for rank, (score, head_node) in enumerate(chains, 1):
+                f.write(f"[链路 #{rank}] 得分={score:.6g} ({rule})\n\n")
+                chain_length = self._write_chain_path(f, head_node)
+                f.write(f"\n链路长度: {chain_length} 个节点\n")
+                f.write("\n" + "=" * 80 + "\n\n")
+        
+        print(f"✓ Top-{len(chains)} 紧凑 TXT 文件已生成")
+    
+    def _write_compact_header(self, f, process_id: str, rule: str):
+        """紧凑 TXT 的过滤说明、规则和格式说明"""
+        if self.mode == "editor":
+            f.write(f"物料类型过滤: 原材料和燃料 (category_id={self.category_filter})\n")
+        f.write(f"分析 Process ID: {process_id}\n")
+        f.write(f"规则: {rule}\n")
+        if self.mode == "editor":
+            f.write("      建设模式下仅追溯\"原材料和燃料\"类型的上游物料\n")
+        f.write("\n")
+        
+        f.write("格式说明:\n")
+        f.write("  L<层级>: <Process名称> | <Process完整UUID>\n")
+        f.write("    << <Flow名称> | <Flow完整UUID> | value=<数值>\n")
+        f.write("    ↓\n\n")
+        f.write("=" * 80 + "\n\n")
+    
+    def _write_root_details(self, f, process_id: str, exchanges: Dict[str, List[Dict]]):
+        """根节点的输入 / 输出 exchanges（名称须已解析）"""
+        root_process_name = self.get_process_name(process_id)
+        f.write("[根节点详细信息]\n")
+        f.write(f"Process: {root_process_name}\n\n")
+        
+        # 输入
+        f.write(f"输入 ({len(exchanges['inputs'])}项):\n")
+        if exchanges['inputs']:
+            for inp in exchanges['inputs']:
+                flow_name = self.get_flow_name(inp['flow_id'])
+                provider_short = inp['provider_id'][:8] if inp['provider_id'] else 'N/A'
+                unit_name = self.get_unit_name(inp['unit_id'])
+                parts = [f"value={inp['value']:.6f}", unit_name]
+                if inp['gwp'] is not None:
+                    parts.append(f"GWP={inp['gwp']:.6f}")
+                if inp['gwp_contribution'] is not None:
+                    parts.append(f"贡献度={inp['gwp_contribution']*100:.2f}%")
+                f.write(f"  ← {flow_name} | {inp['flow_id']} | provider={provider_short}... | {' | '.join(parts)}\n")
+        else:
+            f.write("  (无)\n")
+        
+        f.write("\n")
+        
+        # 输出
+        f.write(f"输出 ({len(exchanges['outputs'])}项):\n")
+        if exchanges['outputs']:
+            for out in exchanges['outputs']:
+                flow_name = self.get_flow_name(out['flow_id'])
+                unit_name = self.get_unit_name(out['unit_id'])
+                parts = [f"value={out['value']:.6f}", unit_name]
+                if out['gwp'] is not None:
+                    parts.append(f"GWP={out['gwp']:.6f}")
+                if out['gwp_contribution'] is not None:
+                    parts.append(f"贡献度={out['gwp_contribution']*100:.2f}%")
+                f.write(f"  → {flow_name} | {out['flow_id']} | {' | '.join(parts)}\n")
+        else:
+            f.write("  (无)\n")
+        
+        f.write("\n" + "=" * 80 + "\n\n")
+    
+    def _write_chain_path(self, f, head_node: MainChainNode) -> int:
+        """写入一条链路的逐层路径，返回链路节点数"""
+        current = head_node
+        chain_length = 0
+        
+        while current:
+            chain_length += 1
+            
+            # Process 行
+            process_name = self.get_process_name(current.process_id)
+            f.write(f"L{current.level}: {process_name} | {current.process_id}\n")
+            
+            # Flow 信息（只有当前节点有 flow_id 时才显示，即不是根节点）
+            if current.flow_id:
+                flow_name = self.get_flow_name(current.flow_id)
+                unit_name = self.get_unit_name(current.unit_id)
+                parts = [f"value={current.value:.6f}", unit_name]
+                if current.gwp is not None:
+                    parts.append(f"GWP={current.gwp:.6f}")
+                if current.gwp_contribution is not None:
+                    parts.append(f"贡献度={current.gwp_contribution*100:.2f}%")
+                f.write(f"  << {flow_name} | {current.flow_id} | {' | '.join(parts)}\n")
+            
+            # 如果有下一个节点，显示箭头
+            if current.next_node:
+                f.write("  ↓\n")
+            
+            current = current.next_node
+        
+        return chain_length
+    
+    def run(self, top_k: int = 1, rank_by: str = "value"):
+        """
+        运行完整流程
+        
+        Args:
+            top_k: 大于 1 时输出得分最高的 top_k 条链路（见 build_top_k_chains）
+            rank_by: Top-k 排序依据 - "value" 或 "gwp"
+        """
         print("=" * 80)
         print("UPR 主链路生成器 (Main Chain Builder)")
         print("=" * 80)
@@ -713,6 +1296,15 @@ class MainChainBuilder:
         self.connect_db()
         
         try:
+            if top_k > 1:
+                print(f"开始搜索 Top-{top_k} 链路（rank_by={rank_by}）...\n")
+                chains = self.build_top_k_chains(config.ROOT_PROCESS_ID, top_k, rank_by,
+                                                 flow_id=config.ROOT_FLOW_ID)
+                txt_file = os.path.join(OUTPUT_DIR, f"main_chain_top{top_k}_{config.ROOT_FLOW_ID[:8]}.txt")
+                self.generate_top_k_txt(chains, txt_file, rank_by)
+                print(f"\n✓ Top-{top_k} 链路生成完成: {txt_file}")
+                return
+            
             # 构建主链路
             print("开始构建主链路（按 value 最大值）...\n")
             head_node = self.build_chain_recursive(
@@ -740,8 +1332,20 @@ class MainChainBuilder:
 
 def main():
     """主函数"""
+    import sys
+    
+    # --top-k N：输出得分最高的 N 条链路；--rank-by gwp：按 GWP 贡献度乘积排序；--disk-cache：使用本地磁盘缓存；--offline：使用离线文件
+    top_k = 1
+    rank_by = "value"
+    if "--top-k" in sys.argv:
+        top_k = int(sys.argv[sys.argv.index("--top-k") + 1])
+    if "--rank-by" in sys.argv:
+        rank_by = sys.argv[sys.argv.index("--rank-by") + 1]
+    
     builder = MainChainBuilder()
-    builder.run()
+    builder.use_disk_cache = builder.use_disk_cache or "--disk-cache" in sys.argv
+    builder.use_offline_store = builder.use_offline_store or "--offline" in sys.argv
+    builder.run(top_k=top_k, rank_by=rank_by)
 
 
 if __name__ == "__main__":
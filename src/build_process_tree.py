@@ -6,27 +6,49 @@ UPR Process Tree Builder
 并生成 Markdown 格式的树状逻辑图。
 """
 
-import psycopg2
 from psycopg2.extras import RealDictCursor
-from typing import Dict, List, Set, Optional
+from typing import Dict, Iterable, Iterator, List, Set, Optional, Tuple
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, wait
 from datetime import datetime
+import heapq
 import os
+import time
 import config
+import db_pool
+from exchange_snapshot import ExchangeSnapshot, get_snapshot
+from cycle_condensation import CondensedGraph, write_cycle_report
+from disk_cache import DiskCache
+from offline_store import OfflineStore, open_store
+from name_resolver import fetch_names, cacheable_names, collect_tree_ids
+from db_pool import ConnectionWorkers, execute_statement
 
 # 确保输出目录存在
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'output')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
+# 栈标记：process 的子树已处理完毕（见 build_tree_recursive）
+_EXIT = object()
+
+
 class ProcessTreeNode:
     """表示过程树的一个节点"""
     
+    # 大型树有数十万个节点，使用 __slots__ 省去每个实例的 __dict__
+    __slots__ = ('process_id', 'flow_id', 'flows', 'level', 'children', 'shared', 'is_cycle', 'members',
+                 'frontier')
+    
     def __init__(self, process_id: str, flow_id: Optional[str] = None, level: int = 0):
         self.process_id = process_id
         self.flow_id = flow_id  # 通过哪个 flow 连接到此 process（Skeleton 模式：单条）
         self.flows = []  # Full LCI 模式：存储所有 flow_id
         self.level = level
         self.children: List[ProcessTreeNode] = []
+        self.shared = False  # 引用已展开过的 process：children 与首次展开的节点共享同一列表
+        self.is_cycle = False  # 回边：指向当前路径上的祖先 process（真正的循环依赖）
+        self.members: Optional[tuple] = None  # 循环压缩模式：节点代表的整个循环（SCC 成员）
+        self.frontier = False  # 预算用尽时尚未展开的节点（anytime 模式）
     
     def add_child(self, child: 'ProcessTreeNode'):
         """添加子节点"""
@@ -38,40 +60,237 @@ class ProcessTreeNode:
             self.flows.append(flow_id)
 
 
+def _branch_factor(exchange: Dict, cutoff_by: str) -> float:
+    """一条 exchange 对分支累计比例的乘数：value 或 gwp_contribution（空值记为 0）"""
+    factor = exchange['gwp_contribution'] if cutoff_by == "gwp" else exchange['value']
+    return abs(float(factor)) if factor else 0.0
+
+
+def apply_cutoff_args(builder: 'ProcessTreeBuilder', argv: List[str]):
+    """解析命令行的 --cutoff <阈值> / --cutoff-by value|gwp（构建器和各导出器共用）"""
+    if "--cutoff" in argv:
+        builder.cutoff = float(argv[argv.index("--cutoff") + 1])
+    if "--cutoff-by" in argv:
+        builder.cutoff_by = argv[argv.index("--cutoff-by") + 1]
+
+
+def _node_marker(node: ProcessTreeNode, canonical_cycle: bool = False) -> str:
+    """Markdown 中共享子树 / 循环依赖节点的标记（canonical_cycle 见 RenderedPath）"""
+    if node.is_cycle:
+        return " ⟲ *(cycle in canonical expansion)*" if canonical_cycle else " ⟲ *(cycle)*"
+    if node.frontier:
+        return " ⋯ *(unexpanded)*"
+    marker = f" ⊚ *(cycle of {len(node.members)} processes)*" if node.members else ""
+    if node.shared:
+        marker += " ↺ *(shared)*"
+    return marker
+
+
+def iter_tree(root: ProcessTreeNode,
+              expand_shared: bool = False) -> Iterator[Tuple[int, ProcessTreeNode, List[str], bool]]:
+    """
+    先序遍历过程树，逐个产生 (depth, node, edge, is_last) 事件（显式栈，不构建节点列表）
+    
+    depth 为相对 root 的深度；edge 为节点与父节点之间的 flow_id 列表（Full LCI 为全部 flow，
+    根节点为空）；is_last 表示是否为父节点的最后一个子节点（根节点为 True）。
+    共享子树默认只在首次出现处展开，expand_shared 为 True 时在每个引用处展开。
+    栈的大小与树的深度和扇出成正比，与输出规模无关。
+    """
+    stack = [(root, 0, True)]
+    while stack:
+        node, depth, is_last = stack.pop()
+        edge = node.flows if node.flows else ([node.flow_id] if node.flow_id else [])
+        yield depth, node, edge, is_last
+        
+        if node.shared and not expand_shared:
+            continue
+        
+        children = node.children
+        child_count = len(children)
+        for i in range(child_count - 1, -1, -1):
+            stack.append((children[i], depth + 1, i == child_count - 1))
+
+
+class RenderedPath:
+    """
+    按 iter_tree 的先序事件记录当前输出路径上的 process，重新判断回边
+    
+    is_cycle 按共享子树首次展开时的路径计算。expand_shared 在其他引用处重复展开时，被标记的
+    process 不一定是当前输出路径上的祖先，渲染器将其标为 "cycle in canonical expansion"。
+    不展开共享子树时输出路径即首次展开的路径，不需要记录。
+    """
+    
+    def __init__(self, expand_shared: bool):
+        self.expand_shared = expand_shared
+        self.process_ids: List[str] = []  # process_ids[d]: 当前路径上深度 d 的 process
+    
+    def canonical_cycle(self, depth: int, node: ProcessTreeNode) -> bool:
+        """记录节点；返回它是否只在首次展开的路径上构成回边（当前路径上没有同一 process 的祖先）"""
+        if not self.expand_shared:
+            return False
+        del self.process_ids[depth:]
+        self.process_ids.append(node.process_id)
+        return node.is_cycle and node.process_id not in self.process_ids[:-1]
+
+
+class LineWriter:
+    """
+    逐行写入文件，输出与 '\\n'.join(lines) 完全相同
+    
+    提供与 list 相同的 append 接口，导出器直接把行写入带缓冲的文件句柄，
+    不在内存中累积整个输出。
+    """
+    
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+    
+    def append(self, line: str):
+        if self.count:
+            self.f.write('\n')
+        self.f.write(line)
+        self.count += 1
+
+
+def open_output(output_file: str):
+    """以 EXPORT_BUFFER_SIZE 的缓冲区打开输出文件（UTF-8）"""
+    return open(output_file, 'w', encoding='utf-8', buffering=config.EXPORT_BUFFER_SIZE)
+
+
+class TraversalView(ExchangeSnapshot):
+    """
+    以快照接口提供过程树遍历已获取的上游 exchanges（供 MainChainBuilder 使用）
+    
+    cutoff 剪掉的分支和 anytime 模式预算用尽时的 frontier 节点不会被展开，遍历缓存中没有这些
+    process；主链路经过它们时通过构建器补充查询（结果同样写入 exchange_cache），
+    fetched 记录补充查询的 process。
+    """
+    
+    def __init__(self, builder: 'ProcessTreeBuilder'):
+        super().__init__(config.VERSION)
+        self.builder = builder
+        self.adjacency = builder.exchange_cache
+        self.edge_count = sum(len(exchanges) for exchanges in self.adjacency.values())
+        self.fetched: List[str] = []
+    
+    def _ensure(self, process_id: str):
+        if process_id not in self.adjacency:
+            self.builder.get_upstream_exchanges(process_id)
+            self.fetched.append(process_id)
+    
+    def upstream_exchanges(self, process_id: str) -> List[Dict]:
+        self._ensure(process_id)
+        return super().upstream_exchanges(process_id)
+    
+    def max_value_exchange(self, process_id: str,
+                           allowed_ids: Optional[Iterable[str]] = None) -> Optional[Dict]:
+        self._ensure(process_id)
+        return super().max_value_exchange(process_id, allowed_ids)
+
+
 class ProcessTreeBuilder:
     """构建 UPR 生产过程树"""
     
-    def __init__(self):
+    def __init__(self, batch_size: Optional[int] = None):
+        """
+        Args:
+            batch_size: frontier 模式下每次批量查询的 process 数量（默认使用 config.FRONTIER_BATCH_SIZE）
+        """
         self.conn = None
         self.cursor = None
-        self.visited: Set[str] = set()  # 记录已访问的 process，防止循环
+        self.visited: Set[str] = set()  # 记录已展开的 process，每个 process 只展开一次
+        self.expanded_nodes: Dict[str, ProcessTreeNode] = {}  # process_id -> 首次展开的节点（共享子树）
+        self.expand_shared = config.EXPAND_SHARED_SUBTREES  # 渲染时是否重新展开共享子树
         self.process_names: Dict[str, str] = {}  # 缓存 process 名称
         self.flow_names: Dict[str, str] = {}  # 缓存 flow 名称
         self.full_lci_edges: Dict[tuple, List[str]] = {}  # Full LCI: (upstream, downstream) -> [flow_ids]
+        self.exchange_cache: Dict[str, List[Dict]] = {}  # 缓存每个 process 的上游 exchanges
+        self.batch_size = batch_size or config.FRONTIER_BATCH_SIZE
+        self.snapshot: Optional[ExchangeSnapshot] = None  # 内存快照（加载后遍历不再查询数据库）
+        self.use_prepared = config.USE_PREPARED_STATEMENTS  # 热点查询是否使用 PREPARE/EXECUTE
+        self.condense_cycles = config.CONDENSE_CYCLES  # 是否在 SCC 压缩图上遍历
+        self.condensed: Optional[CondensedGraph] = None  # 最近一次构建使用的压缩图
+        self.cutoff = config.TREE_CUTOFF  # 分支累计比例低于该阈值时不再展开（0 表示不剪枝）
+        self.cutoff_by = config.TREE_CUTOFF_BY  # 累计比例的依据："value" 或 "gwp"
+        self.expanded_scale: Dict[str, float] = {}  # process（或循环代表）-> 展开时的分支累计比例
+        # 最近一次构建被剪掉的分支：process（或循环代表）-> 各分支的累计比例（重新展开时覆盖，即按最高比例计）
+        self.cut_scales: Dict[str, List[float]] = {}
+        self.time_budget = config.ANYTIME_TIME_BUDGET  # anytime 模式的时间预算（秒，0 表示不限）
+        self.node_budget = config.ANYTIME_NODE_BUDGET  # anytime 模式最多展开的 process 数（0 表示不限）
+        self.budget_exhausted: Optional[str] = None  # 最近一次 anytime 构建用尽的预算（未用尽为 None）
+        self.frontier_count = 0  # 最近一次 anytime 构建未展开的 frontier 节点数
+        self.workers = config.CONCURRENT_WORKERS  # 并发模式的线程数（每个线程一个连接）
+        self.use_disk_cache = config.DISK_CACHE_ENABLED  # 是否使用本地磁盘缓存（见 disk_cache.py）
+        self.disk_cache: Optional[DiskCache] = None
+        self.use_offline_store = config.OFFLINE_MODE  # 是否从离线文件读取（不连接数据库，见 offline_store.py）
+        self.store: Optional[OfflineStore] = None
     
     def connect_db(self):
-        """连接到 PostgreSQL 数据库"""
+        """从共享连接池借用 PostgreSQL 数据库连接（离线模式下改为打开离线文件并加载其中的快照）"""
+        if self.use_offline_store:
+            self.store = open_store()
+            if self.snapshot is None:
+                self.snapshot = self.store.exchange_graph()
+            print(f"✓ 离线模式: {self.store.path} (VERSION {self.store.version})")
+            return
         try:
-            self.conn = psycopg2.connect(
-                host=config.PG_HOST,
-                port=config.PG_PORT,
-                user=config.PG_USER,
-                password=config.PG_PASSWORD,
-                database=config.PG_DATABASE
-            )
+            self.conn = db_pool.get_connection(config.PG_DATABASE)
             self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
             print(f"✓ 成功连接到数据库: {config.PG_DATABASE}")
         except Exception as e:
             print(f"✗ 数据库连接失败: {e}")
             raise
+        if self.use_disk_cache and self.disk_cache is None:
+            self.open_disk_cache()
     
     def close_db(self):
-        """关闭数据库连接"""
+        """关闭游标并将连接归还连接池（启用磁盘缓存时先写回本次新查询的记录）"""
+        if self.disk_cache is not None:
+            self.save_disk_cache()
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.conn:
-            self.conn.close()
-            print("✓ 数据库连接已关闭")
+            db_pool.release_connection(self.conn, config.PG_DATABASE)
+            self.conn = None
+            print("✓ 数据库连接已归还连接池")
+    
+    def load_snapshot(self, use_copy: bool = True):
+        """一次性加载当前 VERSION 的 exchange 快照，之后的遍历不再逐节点查询（离线模式已加载）"""
+        if self.store is not None:
+            return
+        self.snapshot = get_snapshot(self.conn, config.PG_DATABASE, config.PG_SCHEMA,
+                                     config.PG_TABLE, use_copy=use_copy)
+    
+    def open_disk_cache(self):
+        """
+        打开本地磁盘缓存，把未过期的上游 exchanges 和名称载入 exchange_cache / 名称缓存
+        
+        各遍历引擎都先查 exchange_cache，缓存命中的 process 不再查询数据库
+        （cte 引擎除外：它总是一次查询整个闭包）。
+        """
+        self.disk_cache = DiskCache(config.PG_DATABASE, config.VERSION, "tree")
+        self.exchange_cache.update(self.disk_cache.load("upstream"))
+        self.process_names.update(cacheable_names(self.disk_cache.load("process"), "Process"))
+        self.flow_names.update(cacheable_names(self.disk_cache.load("flow"), "Flow"))
+        print(f"✓ 磁盘缓存: {len(self.exchange_cache)} 个 process 的上游 exchanges, "
+              f"{len(self.process_names) + len(self.flow_names)} 个名称 ({self.disk_cache.path})")
+    
+    def save_disk_cache(self):
+        """
+        把本次新查询的上游 exchanges 和名称写回磁盘缓存（不写占位名称），并关闭缓存文件
+        
+        已加载快照时 exchange_cache 来自快照，不写回（快照本身就是整个版本的数据）。
+        """
+        try:
+            if self.snapshot is None:
+                self.disk_cache.save("upstream", self.exchange_cache)
+            self.disk_cache.save("process", cacheable_names(self.process_names, "Process"))
+            self.disk_cache.save("flow", cacheable_names(self.flow_names, "Flow"))
+            print(f"✓ 磁盘缓存已写回: {self.disk_cache.written} 条新记录")
+        finally:
+            self.disk_cache.close()
+            self.disk_cache = None
     
     def get_upstream_exchanges(self, process_id: str) -> List[Dict]:
         """
@@ -82,7 +301,16 @@ class ProcessTreeBuilder:
         - provider_id IS NOT NULL
         - is_deleted = false
         - version = VERSION
+        
+        结果会写入 exchange_cache，已缓存（例如 frontier 模式预取过）的 process 不再查询。
+        同时读取 value / unit_id / gwp / gwp_contribution，主链路可直接由缓存推导（见 exchange_view）
         """
+        if process_id in self.exchange_cache:
+            return self.exchange_cache[process_id]
+        
+        if self.snapshot is not None:
+            return self.snapshot.upstream_exchanges(process_id)
+        
         query = f"""
             SELECT 
                 process_id,
@@ -91,7 +319,12 @@ class ProcessTreeBuilder:
                 is_input,
                 is_product,
                 is_deleted,
-                version
+                version,
+                id,
+                value,
+                unit_id,
+                gwp,
+                gwp_contribution
             FROM {config.PG_SCHEMA}.{config.PG_TABLE}
             WHERE process_id = %s
               AND is_input = true
@@ -101,15 +334,397 @@ class ProcessTreeBuilder:
             ORDER BY flow_id
         """
         
-        self.cursor.execute(query, (process_id, config.VERSION))
+        execute_statement(self.cursor, "upstream_exchanges", query, 
+                          (process_id, config.VERSION), self.use_prepared)
         results = self.cursor.fetchall()
+        self.exchange_cache[process_id] = results
         return results
     
+    def get_upstream_exchanges_batch(self, process_ids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        批量获取多个 process 的上游 input exchanges（frontier 模式）
+        
+        使用 process_id = ANY(%s) 按 batch_size 分块查询，条件与 get_upstream_exchanges 相同。
+        每个 process 的结果按 flow_id 排序，没有上游的 process 记为空列表。
+        
+        Args:
+            process_ids: 待查询的 process ID 列表
+        
+        Returns:
+            Dict: process_id -> exchanges 列表
+        """
+        if self.snapshot is not None:
+            grouped = {pid: self.snapshot.upstream_exchanges(pid) for pid in process_ids}
+            self.exchange_cache.update(grouped)
+            return grouped
+        
+        grouped: Dict[str, List[Dict]] = {}
+        for start in range(0, len(process_ids), self.batch_size):
+            grouped.update(self._query_upstream_chunk(self.cursor, process_ids[start:start + self.batch_size]))
+        
+        self.exchange_cache.update(grouped)
+        return grouped
+    
+    def _query_upstream_chunk(self, cursor, process_ids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        在指定游标上查询一块 process 的上游 exchanges（一次 ANY 查询，不写缓存）
+        
+        只读取构建器配置，可在并发模式的工作线程中调用。
+        """
+        grouped: Dict[str, List[Dict]] = {pid: [] for pid in process_ids}
+        execute_statement(cursor, "upstream_exchanges_batch", self._upstream_batch_query(), 
+                          (process_ids, config.VERSION), self.use_prepared)
+        for row in cursor.fetchall():
+            grouped[row['process_id']].append(row)
+        return grouped
+    
+    def _upstream_batch_query(self) -> str:
+        """批量查询上游 exchanges 的 SQL（参数: process ID 列表、版本号）"""
+        return f"""
+            SELECT 
+                process_id,
+                flow_id,
+                provider_id,
+                is_input,
+                is_product,
+                is_deleted,
+                version,
+                id,
+                value,
+                unit_id,
+                gwp,
+                gwp_contribution
+            FROM {config.PG_SCHEMA}.{config.PG_TABLE}
+            WHERE process_id = ANY(%s)
+              AND is_input = true
+              AND provider_id IS NOT NULL
+              AND is_deleted = false
+              AND version = %s
+            ORDER BY process_id, flow_id
+        """
+    
+    def get_reference_outputs(self, process_ids: List[str]) -> Dict[str, float]:
+        """
+        批量查询 process 的参考产品产量（is_input = false 且 is_product = true 的 exchange value）
+        
+        按 batch_size 分块，每块一次 ANY 查询；离线模式从离线文件读取。
+        没有参考产品记录的 process 不在结果中。
+        
+        Returns:
+            Dict: process_id -> 参考产品产量
+        """
+        if self.store is not None:
+            return self.store.reference_outputs(process_ids)
+        
+        query = f"""
+            SELECT process_id, SUM(value) AS amount
+            FROM {config.PG_SCHEMA}.{config.PG_TABLE}
+            WHERE process_id = ANY(%s)
+              AND is_input = false
+              AND is_product = true
+              AND is_deleted = false
+              AND version = %s
+            GROUP BY process_id
+        """
+        outputs: Dict[str, float] = {}
+        for start in range(0, len(process_ids), self.batch_size):
+            execute_statement(self.cursor, "reference_outputs", query,
+                              (process_ids[start:start + self.batch_size], config.VERSION), self.use_prepared)
+            for row in self.cursor.fetchall():
+                if row['amount'] is not None:
+                    outputs[row['process_id']] = float(row['amount'])
+        return outputs
+    
+    def prefetch_upstream_closure(self, root_process_id):
+        """
+        按层级批量预取根节点的全部上游 exchanges（level-synchronous frontier 遍历）
+        
+        每一层的所有 process 一次性（分块）查询，查询次数随树的深度增长，而不是随节点数增长。
+        预取结果写入 exchange_cache，之后 build_tree_recursive 不再访问数据库。
+        
+        Args:
+            root_process_id: 根 process ID，或多个根节点的列表（预取各自闭包的并集，共享的上游只查询一次）
+        """
+        if isinstance(root_process_id, str):
+            frontier = [root_process_id]
+        else:
+            frontier = list(dict.fromkeys(root_process_id))
+        depth = 0
+        
+        while frontier:
+            pending = [pid for pid in frontier if pid not in self.exchange_cache]
+            if pending:
+                self.get_upstream_exchanges_batch(pending)
+            print(f"  层级 {depth}: {len(frontier)} 个 process（新查询 {len(pending)} 个）")
+            
+            next_frontier = []
+            seen = set()
+            for pid in frontier:
+                for exchange in self.exchange_cache[pid]:
+                    provider_id = exchange['provider_id']
+                    if provider_id not in self.exchange_cache and provider_id not in seen:
+                        seen.add(provider_id)
+                        next_frontier.append(provider_id)
+            
+            frontier = next_frontier
+            depth += 1
+        
+        print(f"✓ 预取完成: {len(self.exchange_cache)} 个 process, {depth} 层")
+    
+    def build_tree_frontier(self, process_id: str, full_lci_mode: bool = False) -> ProcessTreeNode:
+        """
+        分层批量构建过程树（frontier 模式）
+        
+        先按层级批量预取整个上游闭包，再用 build_tree_recursive 在内存中组装，
+        因此生成的 Skeleton / Full LCI 树与逐节点查询的结果完全相同。
+        
+        Args:
+            process_id: 根 process ID
+            full_lci_mode: 是否为 Full LCI 模式
+        
+        Returns:
+            ProcessTreeNode: 根节点
+        """
+        print(f"分层预取上游 exchanges（batch_size={self.batch_size}）...")
+        self.prefetch_upstream_closure(process_id)
+        print()
+        return self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
+    
+    def prefetch_upstream_concurrent(self, root_process_id: str, workers: ConnectionWorkers):
+        """
+        并发预取根节点的上游闭包：多个 frontier 块同时在线程池上查询
+        
+        与 prefetch_upstream_closure 不同，不按层级同步：任何一块查询返回后，立即把新发现的
+        provider 分块提交给空闲线程，高延迟链路上各线程的往返时间互相重叠。
+        
+        查询结果只在调用线程中写入 exchange_cache，visited / 名称 / Full LCI 边等缓存
+        只在之后的串行组装中使用，因此都不需要加锁。
+        
+        cutoff > 0 时只预取首次到达时累计比例不低于 cutoff 的 process（同一 provider 的多条边
+        比例相加，是 Skeleton / Full LCI 两种模式的上界）；之后经由比例更高的分支才需要展开的
+        process 由组装阶段在构建器自己的连接上补查，不影响结果。
+        
+        Args:
+            root_process_id: 根 process ID
+            workers: 线程池（每个线程一个连接）
+        """
+        cutoff = self.cutoff or 0.0
+        queued: Set[str] = {root_process_id}
+        pending: List[Tuple[str, float]] = []  # 待查询的 (process_id, 首次到达时的累计比例)
+        in_flight = {}  # future -> 该块 process 的累计比例
+        queries = 0
+        
+        def discover(process_id: str, scale: float):
+            # 已缓存的 process 直接在内存中继续向上游展开，只有未缓存的进入待查询队列
+            stack = [(process_id, scale)]
+            while stack:
+                current_id, current_scale = stack.pop()
+                if current_id not in self.exchange_cache:
+                    pending.append((current_id, current_scale))
+                    continue
+                provider_factors: Dict[str, float] = defaultdict(float)
+                for exchange in self.exchange_cache[current_id]:
+                    provider_factors[exchange['provider_id']] += _branch_factor(exchange, self.cutoff_by)
+                for provider_id, factor in provider_factors.items():
+                    child_scale = current_scale * factor
+                    if provider_id in queued or (cutoff and child_scale < cutoff):
+                        continue
+                    queued.add(provider_id)
+                    stack.append((provider_id, child_scale))
+        
+        discover(root_process_id, 1.0)
+        while pending or in_flight:
+            # 待查询的 process 平均分给空闲线程（每块不超过 batch_size）
+            idle = workers.workers - len(in_flight)
+            while pending and idle > 0:
+                size = min(self.batch_size, -(-len(pending) // idle))
+                chunk = pending[:size]
+                del pending[:size]
+                future = workers.submit(self._query_upstream_chunk, [pid for pid, _ in chunk])
+                in_flight[future] = dict(chunk)
+                queries += 1
+                idle -= 1
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                scales = in_flight.pop(future)
+                self.exchange_cache.update(future.result())
+                for process_id, scale in scales.items():
+                    discover(process_id, scale)
+        
+        print(f"✓ 并发预取完成: {len(self.exchange_cache)} 个 process, {queries} 次查询, "
+              f"{workers.workers} 个线程")
+    
+    def build_tree_concurrent(self, process_id: str, full_lci_mode: bool = False) -> ProcessTreeNode:
+        """
+        并发构建过程树：在有界线程池上并发预取上游闭包和名称，再串行组装
+        
+        组装仍由 build_tree_recursive 在内存中完成，子节点顺序与串行构建相同，
+        生成的树和所有导出文件与逐节点查询的结果逐字节一致。
+        
+        线程数为 workers，不超过连接池上限减去构建器自己占用的一个连接。
+        已加载快照时不需要查询，直接组装。
+        
+        Args:
+            process_id: 根 process ID
+            full_lci_mode: 是否为 Full LCI 模式
+        
+        Returns:
+            ProcessTreeNode: 根节点
+        """
+        if self.snapshot is not None:
+            return self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
+        
+        workers = max(1, min(self.workers, config.DB_POOL_MAX_SIZE - 1))
+        if workers < self.workers:
+            print(f"⚠ 线程数 {self.workers} 超过连接池上限（DB_POOL_MAX_SIZE={config.DB_POOL_MAX_SIZE}），"
+                  f"使用 {workers} 个线程")
+        
+        print(f"并发预取上游 exchanges（{workers} 个线程，batch_size={self.batch_size}）...")
+        with ConnectionWorkers(config.PG_DATABASE, workers) as pool:
+            # 循环压缩需要完整的上游闭包，此时不按 cutoff 限制预取范围
+            cutoff = self.cutoff
+            if self.condense_cycles:
+                self.cutoff = 0.0
+            try:
+                self.prefetch_upstream_concurrent(process_id, pool)
+            finally:
+                self.cutoff = cutoff
+            print()
+            root = self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
+            self.prefetch_names(root, pool)
+        return root
+    
+    def reset_tree(self):
+        """清空单棵树的遍历状态（已展开的 process、共享子树、Full LCI 边），保留 exchange 和名称缓存"""
+        self.visited.clear()
+        self.expanded_nodes.clear()
+        self.expanded_scale.clear()
+        self.full_lci_edges.clear()
+    
+    def build_forest(self, root_process_ids: List[str],
+                     full_lci_mode: bool = False) -> Iterator[Tuple[str, Optional[ProcessTreeNode], Optional[Exception]]]:
+        """
+        多根节点森林：所有根节点共用同一份 exchange 缓存（上游 DAG）和名称缓存
+        
+        先按层级批量预取全部根节点上游闭包的并集（已加载快照时跳过），多个产品共享的背景
+        供应链只查询一次；之后逐棵在内存中组装。每棵树构建前重置遍历状态，因此每棵树的
+        结构、输出和统计与单独构建时相同。
+        
+        预取在调用时立即完成；返回的迭代器逐棵产生 (root_process_id, root, error)：调用方处理
+        （渲染 / 统计）完一棵后再构建下一棵，visited 等状态此时属于当前这棵树。某棵树构建失败时
+        root 为 None、error 为异常（回滚连接上的事务），迭代器继续构建其余根节点。
+        
+        Args:
+            root_process_ids: 根 process ID 列表
+            full_lci_mode: 是否为 Full LCI 模式
+        """
+        if self.snapshot is None:
+            print(f"分层预取 {len(root_process_ids)} 个根节点的上游闭包（并集）...")
+            self.prefetch_upstream_closure(root_process_ids)
+            print()
+        
+        def trees():
+            for process_id in root_process_ids:
+                self.reset_tree()
+                try:
+                    root = self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
+                except Exception as e:
+                    if self.conn is not None and not self.conn.closed:
+                        self.conn.rollback()
+                    yield process_id, None, e
+                    continue
+                yield process_id, root, None
+        
+        return trees()
+    
+    def fetch_upstream_closure_cte(self, root_process_id: str):
+        """
+        用一条 WITH RECURSIVE 查询在服务端展开根节点的整个上游闭包
+        
+        递归部分使用 UNION（而非 UNION ALL），已出现过的 process 不会再次加入工作表，
+        循环依赖在 SQL 中即被截断。一次往返返回闭包内所有 process 的上游 exchanges，
+        写入 exchange_cache；闭包内没有上游记录的 process 记为叶子（空列表）。
+        """
+        filters = """
+              AND e.is_input = true
+              AND e.provider_id IS NOT NULL
+              AND e.is_deleted = false
+              AND e.version = %s"""
+        query = f"""
+            WITH RECURSIVE upstream(process_id) AS (
+                SELECT e.process_id
+                FROM {config.PG_SCHEMA}.{config.PG_TABLE} e
+                WHERE e.process_id = %s{filters}
+                UNION
+                SELECT e.provider_id
+                FROM {config.PG_SCHEMA}.{config.PG_TABLE} e
+                INNER JOIN upstream u ON e.process_id = u.process_id
+                WHERE true{filters}
+            )
+            SELECT 
+                e.process_id,
+                e.flow_id,
+                e.provider_id,
+                e.is_input,
+                e.is_product,
+                e.is_deleted,
+                e.version,
+                e.id,
+                e.value,
+                e.unit_id,
+                e.gwp,
+                e.gwp_contribution
+            FROM {config.PG_SCHEMA}.{config.PG_TABLE} e
+            WHERE e.process_id IN (SELECT process_id FROM upstream){filters}
+            ORDER BY e.process_id, e.flow_id
+        """
+        
+        start_time = datetime.now()
+        self.cursor.execute(query, (root_process_id, config.VERSION, config.VERSION, config.VERSION))
+        edges = self.cursor.fetchall()
+        duration = (datetime.now() - start_time).total_seconds()
+        
+        closure: Dict[str, List[Dict]] = {root_process_id: []}
+        for row in edges:
+            closure.setdefault(row['process_id'], []).append(row)
+        for row in edges:
+            closure.setdefault(row['provider_id'], [])
+        
+        self.exchange_cache.update(closure)
+        print(f"✓ 递归查询完成: {len(closure)} 个 process, {len(edges)} 条 exchange, 耗时 {duration:.2f} 秒")
+    
+    def build_tree_cte(self, process_id: str, full_lci_mode: bool = False) -> ProcessTreeNode:
+        """
+        服务端递归 CTE 构建过程树
+        
+        由 PostgreSQL 一次展开整个上游闭包，再用 build_tree_recursive 在本地组装
+        ProcessTreeNode 结构（build_tree_recursive 仍是参考实现，结果与其一致）。
+        
+        Args:
+            process_id: 根 process ID
+            full_lci_mode: 是否为 Full LCI 模式
+        
+        Returns:
+            ProcessTreeNode: 根节点
+        """
+        if self.snapshot is not None:
+            return self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
+        
+        print(f"服务端递归查询上游闭包（WITH RECURSIVE）...")
+        self.fetch_upstream_closure_cte(process_id)
+        print()
+        return self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
+    
     def get_process_name(self, process_id: str) -> str:
         """获取 process 的名称（如果有的话）"""
         if process_id in self.process_names:
             return self.process_names[process_id]
         
+        if self.store is not None:
+            self.resolve_names([process_id], [])
+            return self.process_names[process_id]
+        
         # 尝试从数据库获取 process 名称
         # 注意：这里假设可能有 tb_processes 表，如果没有则返回 ID
         # 你可以根据实际数据库结构调整
@@ -119,7 +734,8 @@ class ProcessTreeBuilder:
                 WHERE id = %s AND version = %s
                 LIMIT 1
             """
-            self.cursor.execute(query, (process_id, config.VERSION))
+            execute_statement(self.cursor, "process_name", query, 
+                              (process_id, config.VERSION), self.use_prepared)
             result = self.cursor.fetchone()
             name = result['name'] if result else None
         except:
@@ -136,6 +752,10 @@ class ProcessTreeBuilder:
         if flow_id in self.flow_names:
             return self.flow_names[flow_id]
         
+        if self.store is not None:
+            self.resolve_names([], [flow_id])
+            return self.flow_names[flow_id]
+        
         # 尝试从数据库获取 flow 名称
         try:
             query = """
@@ -143,7 +763,8 @@ class ProcessTreeBuilder:
                 WHERE id = %s AND version = %s
                 LIMIT 1
             """
-            self.cursor.execute(query, (flow_id, config.VERSION))
+            execute_statement(self.cursor, "flow_name", query, 
+                              (flow_id, config.VERSION), self.use_prepared)
             result = self.cursor.fetchone()
             name = result['name'] if result else None
         except:
@@ -155,10 +776,106 @@ class ProcessTreeBuilder:
         self.flow_names[flow_id] = name
         return name
     
+    def resolve_names(self, process_ids: List[str], flow_ids: List[str],
+                      workers: Optional[ConnectionWorkers] = None):
+        """
+        批量解析 process / flow 名称并填充缓存（每类一次 id = ANY(%s) 查询）
+        
+        只接受 VERSION 版本的名称，与 get_process_name / get_flow_name 的规则一致。
+        
+        Args:
+            workers: 可选线程池；提供时两类名称分块后在各线程上并发查询，结果在调用线程中写入缓存
+        """
+        missing_processes = [pid for pid in dict.fromkeys(process_ids) if pid not in self.process_names]
+        missing_flows = [fid for fid in dict.fromkeys(flow_ids) if fid not in self.flow_names]
+        
+        def fetch(table: str, ids: List[str]):
+            if self.store is not None:
+                return self.store.fetch_names(table, ids, config.VERSION, latest_fallback=False)
+            if workers is None or not ids:
+                return fetch_names(self.cursor, table, ids, config.VERSION,
+                                   latest_fallback=False, prepared=self.use_prepared)
+            size = min(config.NAME_BATCH_SIZE, -(-len(ids) // workers.workers))
+            return [workers.submit(fetch_names, table, ids[start:start + size], config.VERSION,
+                                   False, self.use_prepared)
+                    for start in range(0, len(ids), size)]
+        
+        def collect(result) -> Dict[str, Dict]:
+            if isinstance(result, dict):
+                return result
+            rows = {}
+            for future in result:
+                rows.update(future.result())
+            return rows
+        
+        # 两类名称的查询都提交之后再等待结果
+        process_rows = fetch("public.tb_processes", missing_processes)
+        flow_rows = fetch("public.tb_flows", missing_flows)
+        
+        if missing_processes:
+            rows = collect(process_rows)
+            for pid in missing_processes:
+                row = rows.get(pid)
+                self.process_names[pid] = (row['name'] if row and row['name'] 
+                                           else f"Process-{pid[:8]}...")
+        
+        if missing_flows:
+            rows = collect(flow_rows)
+            for fid in missing_flows:
+                row = rows.get(fid)
+                self.flow_names[fid] = (row['name'] if row and row['name'] 
+                                        else f"Flow-{fid[:8]}...")
+    
+    def prefetch_names(self, root: ProcessTreeNode, workers: Optional[ConnectionWorkers] = None):
+        """收集树中涉及的全部 ID（含根 flow / 根 process），在渲染前一次性解析名称"""
+        process_ids, flow_ids = collect_tree_ids(root)
+        process_ids.append(config.ROOT_PROCESS_ID)
+        flow_ids.append(config.ROOT_FLOW_ID)
+        self.resolve_names(process_ids, flow_ids, workers)
+    
+    def condense(self, root_process_id: str) -> CondensedGraph:
+        """
+        对根节点的上游闭包做强连通分量压缩（结果保存在 self.condensed）
+        
+        未加载快照时先按层级批量预取闭包（已缓存的 process 不再查询）。
+        """
+        if self.snapshot is None:
+            self.prefetch_upstream_closure(root_process_id)
+        self.condensed = CondensedGraph(self.exchange_view(), [root_process_id])
+        print(f"✓ 循环压缩: {len(self.condensed.component_of)} 个 process -> "
+              f"{len(self.condensed.components)} 个节点，{len(self.condensed.cycles())} 个循环")
+        return self.condensed
+    
+    def write_cycle_report(self, output_file: str):
+        """为最近一次压缩生成循环报告（成员、入口边）"""
+        condensed = self.condensed
+        process_ids, flow_ids = [], []
+        for c in condensed.cycles():
+            process_ids.extend(condensed.components[c])
+            for exchange in condensed.entries.get(c, []):
+                process_ids.append(exchange['process_id'])
+                flow_ids.append(exchange['flow_id'])
+        self.resolve_names(process_ids, flow_ids)
+        write_cycle_report(condensed, output_file, self.get_process_name, self.get_flow_name)
+    
     def build_tree_recursive(self, process_id: str, flow_id: Optional[str] = None, level: int = 0, 
                            full_lci_mode: bool = False) -> ProcessTreeNode:
         """
-        递归构建过程树
+        构建过程树（深度优先，先序）
+        
+        使用显式栈迭代代替 Python 递归，超过 100 跳的深层供应链也不会触发 RecursionError。
+        
+        过程树按 DAG 构建：每个 process 只展开（查询）一次。经由其他下游再次到达已展开的
+        process 时，新节点标记为 shared，并与首次展开的节点共享同一个 children 列表；
+        只有指向当前路径上祖先的回边才标记为 is_cycle（循环依赖）。
+        
+        condense_cycles 为 True 时在 SCC 压缩图上遍历：整个循环作为一个节点（members），
+        其子节点为离开该循环的上游，不再有回边，结果与遍历顺序无关。
+        
+        cutoff > 0 时沿每条分支累乘 exchange value（或 gwp_contribution，见 cutoff_by），
+        累计比例低于 cutoff 的分支不再创建，计入 cut_scales（见 cut_branches / cut_scale_sum）。
+        已展开的 process 经由比例更高的分支再次到达时重新展开（不查询数据库），
+        使其子树按更高的比例剪枝；比例不高于首次展开时直接共享。
         
         Args:
             process_id: 当前 process ID
@@ -169,70 +886,289 @@ class ProcessTreeBuilder:
         Returns:
             ProcessTreeNode: 当前节点及其所有子树
         """
-        # 创建当前节点
-        node = ProcessTreeNode(process_id, flow_id, level)
-        
-        # 检查是否已访问（防止循环）
-        if process_id in self.visited:
-            print(f"{'  ' * level}⚠ 检测到循环: {process_id[:8]}... (已访问)")
-            return node
+        root = None
+        on_path: Set[str] = set()  # 当前 DFS 路径上的 process（用于识别回边）
+        condensed = self.condense(process_id) if self.condense_cycles else None
+        cutoff = self.cutoff or 0.0
+        self.cut_scales.clear()
+        # 栈元素: (process_id, 主 flow_id, 全部 flow_ids, 层级, 父节点, 分支累计比例)；
+        # 父节点为 _EXIT 时表示该 process 的子树已处理完毕，离开当前路径
+        stack = [(process_id, flow_id, None, level, None, 1.0)]
         
-        # 标记为已访问
-        self.visited.add(process_id)
+        while stack:
+            current_id, current_flow, flow_ids, current_level, parent, scale = stack.pop()
+            
+            if parent is _EXIT:
+                on_path.discard(current_id)
+                continue
+            
+            # 压缩模式下同一循环的成员共用一个键（分量代表）
+            key = condensed.representative(current_id) if condensed else current_id
+            
+            # 创建当前节点
+            node = ProcessTreeNode(current_id, current_flow, current_level)
+            if flow_ids:
+                # 添加所有 flow 到节点（Full LCI 模式）
+                for fid in flow_ids:
+                    node.add_flow(fid)
+            if parent is None:
+                root = node
+            else:
+                parent.add_child(node)
+            
+            if condensed:
+                node.members = condensed.members(current_id)
+            
+            # 回边：process 仍在当前路径上，是真正的循环依赖
+            if key in on_path:
+                node.is_cycle = True
+                print(f"{'  ' * current_level}⚠ 检测到循环: {current_id[:8]}... (回边)")
+                continue
+            
+            # 已在其他分支展开过：共享其子树，不再查询
+            # （剪枝模式下经由比例更高的分支到达时重新展开）
+            if key in self.visited and not (cutoff and scale > self.expanded_scale.get(key, scale)):
+                canonical = self.expanded_nodes.get(key)
+                if canonical is not None:
+                    node.shared = True
+                    node.children = canonical.children
+                print(f"{'  ' * current_level}↺ 共享子树: {current_id[:8]}... (已展开)")
+                continue
+            
+            # 标记为已展开
+            self.visited.add(key)
+            self.expanded_nodes[key] = node
+            self.expanded_scale[key] = scale
+            on_path.add(key)
+            stack.append((key, None, None, current_level, _EXIT, scale))
+            
+            # 获取所有上游 exchanges（循环节点取离开循环的边）
+            if node.members:
+                self.visited.update(node.members)
+                upstream_exchanges = condensed.upstream_exchanges(current_id)
+                print(f"{'  ' * current_level}⊚ 循环: {current_id[:8]}... 等 {len(node.members)} 个 process")
+            else:
+                upstream_exchanges = self.get_upstream_exchanges(current_id)
+            
+            if upstream_exchanges:
+                print(f"{'  ' * current_level}├─ Process: {current_id[:8]}... 发现 {len(upstream_exchanges)} 个上游输入")
+            else:
+                print(f"{'  ' * current_level}└─ Process: {current_id[:8]}... (叶子节点)")
+            
+            children = [(upstream_process_id, upstream_flow_id, upstream_flow_ids,
+                         current_level + 1, node, child_scale)
+                        for upstream_process_id, upstream_flow_id, upstream_flow_ids, child_scale
+                        in self._upstream_children(current_id, upstream_exchanges, full_lci_mode, scale)]
+            
+            # 逆序入栈，保证子节点按原顺序先序处理
+            stack.extend(reversed(children))
         
-        # 获取所有上游 exchanges
-        upstream_exchanges = self.get_upstream_exchanges(process_id)
+        return root
+    
+    def _upstream_children(self, current_id: str, upstream_exchanges: List[Dict],
+                           full_lci_mode: bool, scale: float) -> List[tuple]:
+        """
+        把上游 exchanges 转换为子节点描述 (provider_id, 主 flow_id, 全部 flow_ids, 分支累计比例)
         
-        if upstream_exchanges:
-            print(f"{'  ' * level}├─ Process: {process_id[:8]}... 发现 {len(upstream_exchanges)} 个上游输入")
-        else:
-            print(f"{'  ' * level}└─ Process: {process_id[:8]}... (叶子节点)")
+        累计比例低于 cutoff 的分支不返回，记入 cut_scales[current_id]；
+        Full LCI 模式按 provider 分组并记录 full_lci_edges。
         
-        # Full LCI 模式：按 provider_id 分组收集所有 flow
+        同一 process 经由比例更高的分支重新展开时再次调用：边只记录一次，
+        被剪掉的分支按本次（比例最高的一次）覆盖，统计不会因重新展开而重复累加。
+        """
+        cutoff = self.cutoff or 0.0
+        children = []
+        cut = []
         if full_lci_mode and upstream_exchanges:
-            from collections import defaultdict
+            # Full LCI 模式：按 provider_id 分组收集所有 flow
             provider_flows = defaultdict(list)
+            provider_factors = defaultdict(float)  # 同一 provider 的多条 flow 比例相加
             for exchange in upstream_exchanges:
-                upstream_process_id = exchange['provider_id']
-                upstream_flow_id = exchange['flow_id']
-                provider_flows[upstream_process_id].append(upstream_flow_id)
-            
-            # 递归处理每个上游 process（去重）
-            for upstream_process_id, flow_ids in provider_flows.items():
-                # 创建子节点，使用第一个 flow 作为主 flow
-                child_node = self.build_tree_recursive(
-                    upstream_process_id, 
-                    flow_ids[0], 
-                    level + 1,
-                    full_lci_mode=True
-                )
-                # 添加所有 flow 到节点
-                for fid in flow_ids:
-                    child_node.add_flow(fid)
+                provider_flows[exchange['provider_id']].append(exchange['flow_id'])
+                provider_factors[exchange['provider_id']] += _branch_factor(exchange, self.cutoff_by)
+            
+            # 每个上游 process 一个子节点（去重），使用第一个 flow 作为主 flow
+            for upstream_process_id, upstream_flow_ids in provider_flows.items():
+                child_scale = scale * provider_factors[upstream_process_id]
+                if child_scale < cutoff:
+                    cut.append(child_scale)
+                    continue
+                children.append((upstream_process_id, upstream_flow_ids[0], upstream_flow_ids, child_scale))
                 
-                # 记录边的所有 flow（用于后续分析）
-                edge_key = (upstream_process_id, process_id)
+                # 记录边的所有 flow（用于后续分析；重新展开时不重复记录）
+                edge_key = (upstream_process_id, current_id)
                 if edge_key not in self.full_lci_edges:
-                    self.full_lci_edges[edge_key] = []
-                self.full_lci_edges[edge_key].extend(flow_ids)
-                
-                node.add_child(child_node)
+                    self.full_lci_edges[edge_key] = list(upstream_flow_ids)
         else:
             # Skeleton 模式：每个 provider 只取第一条 flow（原有逻辑）
             for exchange in upstream_exchanges:
-                upstream_process_id = exchange['provider_id']
-                upstream_flow_id = exchange['flow_id']
-                
-                # 递归构建子树
-                child_node = self.build_tree_recursive(
-                    upstream_process_id, 
-                    upstream_flow_id, 
-                    level + 1,
-                    full_lci_mode=False
-                )
-                node.add_child(child_node)
+                child_scale = scale * _branch_factor(exchange, self.cutoff_by)
+                if child_scale < cutoff:
+                    cut.append(child_scale)
+                    continue
+                children.append((exchange['provider_id'], exchange['flow_id'], None, child_scale))
+        
+        if cut:
+            self.cut_scales[current_id] = cut
+        else:
+            self.cut_scales.pop(current_id, None)
+        return children
+    
+    @property
+    def cut_branches(self) -> int:
+        """最近一次构建被剪掉的分支数（每个 process 的分支只计一次）"""
+        return sum(len(scales) for scales in self.cut_scales.values())
+    
+    @property
+    def cut_scale_sum(self) -> float:
+        """
+        被剪掉分支的累计比例之和
+        
+        各分支的比例都相对根节点 = 1 计算，但分支之间可能共享下游路径，
+        因此这是一个相对大小的指标，不是被剪掉部分占根节点的份额。
+        """
+        return sum(sum(scales) for scales in self.cut_scales.values())
+    
+    def build_tree_anytime(self, process_id: str, full_lci_mode: bool = False,
+                           time_budget: Optional[float] = None,
+                           node_budget: Optional[int] = None) -> ProcessTreeNode:
+        """
+        按贡献度优先构建过程树（best-first，可随时停止）
+        
+        待展开的节点按分支累计比例（exchange value 之积，cutoff_by 为 gwp 时为 gwp_contribution
+        之积）放入优先队列，每次展开比例最高的节点。达到时间预算或节点预算时停止，返回一棵
+        有效的部分树：尚未展开的节点标记为 frontier。预算都不限制时展开的 process 与
+        build_tree_recursive 相同。
+        
+        子节点在父节点展开时按原顺序创建，输出顺序与展开顺序无关。再次到达已展开的 process
+        时共享其子树；构建结束后按先序把指向路径上祖先的共享引用改为回边（is_cycle）。
+        cutoff 照常剪枝，但每个 process 只展开一次（通常已是比例最高的一次）。
+        不支持 condense_cycles（压缩需要先取得整个上游闭包）。
+        
+        Args:
+            process_id: 根 process ID
+            full_lci_mode: 是否为 Full LCI 模式
+            time_budget: 时间预算（秒，默认 self.time_budget，0 表示不限）
+            node_budget: 最多展开的 process 数（默认 self.node_budget，0 表示不限）
+        
+        Returns:
+            ProcessTreeNode: 根节点
+        """
+        time_budget = self.time_budget if time_budget is None else time_budget
+        node_budget = self.node_budget if node_budget is None else node_budget
+        deadline = time.monotonic() + time_budget if time_budget else None
+        self.cut_scales.clear()
+        self.budget_exhausted = None
+        self.frontier_count = 0
+        
+        root = ProcessTreeNode(process_id, None, 0)
+        # 堆元素: (-分支累计比例, 入队序号, 节点, 分支累计比例)；比例相同时先入队的先展开
+        heap = [(-1.0, 0, root, 1.0)]
+        sequence = 1
+        expanded = 0
+        
+        while heap:
+            if node_budget and expanded >= node_budget:
+                self.budget_exhausted = f"node budget {node_budget}"
+                break
+            if deadline is not None and expanded and time.monotonic() >= deadline:
+                self.budget_exhausted = f"time budget {time_budget:g}s"
+                break
+            
+            _, _, node, scale = heapq.heappop(heap)
+            current_id = node.process_id
+            
+            if current_id in self.visited:
+                self._share_subtree(node)
+                continue
+            
+            self.visited.add(current_id)
+            self.expanded_nodes[current_id] = node
+            self.expanded_scale[current_id] = scale
+            expanded += 1
+            
+            upstream_exchanges = self.get_upstream_exchanges(current_id)
+            if upstream_exchanges:
+                print(f"{'  ' * node.level}├─ Process: {current_id[:8]}... 发现 {len(upstream_exchanges)} 个上游输入"
+                      f"（累计比例 {scale:.3g}）")
+            else:
+                print(f"{'  ' * node.level}└─ Process: {current_id[:8]}... (叶子节点)")
+            
+            for upstream_process_id, upstream_flow_id, upstream_flow_ids, child_scale in \
+                    self._upstream_children(current_id, upstream_exchanges, full_lci_mode, scale):
+                child = ProcessTreeNode(upstream_process_id, upstream_flow_id, node.level + 1)
+                for fid in upstream_flow_ids or ():
+                    child.add_flow(fid)
+                node.add_child(child)
+                heapq.heappush(heap, (-child_scale, sequence, child, child_scale))
+                sequence += 1
+        
+        # 预算用尽：剩余节点中已展开过的 process 直接共享，其余标记为 frontier
+        for _, _, node, _ in heap:
+            if node.process_id in self.visited:
+                self._share_subtree(node)
+            else:
+                node.frontier = True
+                self.frontier_count += 1
+        
+        self._mark_back_edges(root)
+        
+        if self.budget_exhausted:
+            print(f"\n⚠ 已达到 {self.budget_exhausted}：展开 {expanded} 个 process，"
+                  f"{self.frontier_count} 个节点未展开（标记为 frontier）")
+        else:
+            print(f"\n✓ 已完整展开 {expanded} 个 process")
+        return root
+    
+    def _share_subtree(self, node: ProcessTreeNode):
+        """把节点设为已展开 process 的共享引用"""
+        node.shared = True
+        node.children = self.expanded_nodes[node.process_id].children
+    
+    def _mark_back_edges(self, root: ProcessTreeNode):
+        """
+        把指向当前路径上祖先的共享引用改为回边（is_cycle），保证共享后的树结构无环
+        
+        按先序深度优先遍历（每个已展开的 process 只进入一次），判定方式与 build_tree_recursive 相同。
+        """
+        on_path = {root.process_id}
+        done = set()
+        stack = [(root, iter(root.children))]
         
-        return node
+        while stack:
+            node, remaining = stack[-1]
+            for child in remaining:
+                key = child.process_id
+                if child.is_cycle or child.frontier or key in done:
+                    continue
+                if key in on_path:
+                    child.shared = False
+                    child.is_cycle = True
+                    child.children = []
+                    print(f"{'  ' * child.level}⚠ 检测到循环: {key[:8]}... (回边)")
+                    continue
+                # 共享引用进入首次展开的节点，该 process 的子树只遍历一次
+                canonical = self.expanded_nodes[key] if child.shared else child
+                on_path.add(key)
+                stack.append((canonical, iter(canonical.children)))
+                break
+            else:
+                stack.pop()
+                on_path.discard(node.process_id)
+                done.add(node.process_id)
+    
+    def frontier_summary(self) -> Optional[str]:
+        """anytime 构建的预算说明（预算未用尽时返回 None），供 Markdown / TXT 统计信息使用"""
+        if not self.budget_exhausted:
+            return None
+        return f"{self.budget_exhausted} reached, {self.frontier_count} frontier nodes unexpanded"
+    
+    def cutoff_summary(self) -> Optional[str]:
+        """剪枝说明（未启用 cutoff 时返回 None），供 Markdown / TXT 统计信息使用"""
+        if not self.cutoff:
+            return None
+        return (f"cutoff={self.cutoff:g} (by {self.cutoff_by}), {self.cut_branches} branches pruned, "
+                f"sum of pruned branch scales {self.cut_scale_sum:.6g}")
     
     def generate_markdown(self, root: ProcessTreeNode, output_file: str = "process_tree.md", 
                          mode: str = "skeleton"):
@@ -244,148 +1180,240 @@ class ProcessTreeBuilder:
             output_file: 输出文件名
             mode: "skeleton" 或 "full_lci"
         """
-        lines = []
-        
-        # 标题
-        mode_title = "Skeleton Tree (Single Edge)" if mode == "skeleton" else "Full LCI Tree (Multiple Edges)"
-        lines.append(f"# UPR Process Tree Analysis - {mode_title}")
-        lines.append(f"")
-        lines.append(f"**Generated at:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        lines.append(f"**Version:** {config.VERSION}")
-        lines.append(f"**Mode:** {mode_title}")
-        lines.append(f"")
-        lines.append(f"---")
-        lines.append(f"")
-        
-        # 根产品信息
-        lines.append(f"## Product (Root Flow)")
-        lines.append(f"- **Flow ID:** `{config.ROOT_FLOW_ID}`")
-        lines.append(f"- **Flow Name:** {self.get_flow_name(config.ROOT_FLOW_ID)}")
-        lines.append(f"")
-        
-        # 根过程信息
-        lines.append(f"## Root Process (UPR)")
-        lines.append(f"- **Process ID:** `{config.ROOT_PROCESS_ID}`")
-        lines.append(f"- **Process Name:** {self.get_process_name(config.ROOT_PROCESS_ID)}")
-        lines.append(f"")
-        
-        lines.append(f"---")
-        lines.append(f"")
-        lines.append(f"## Process Tree Structure")
-        lines.append(f"")
-        
-        if mode == "skeleton":
-            lines.append(f"*Note: Each upstream → downstream relationship shows only one representative flow.*")
-        else:
-            lines.append(f"*Note: Each upstream → downstream relationship shows ALL flows.*")
-        lines.append(f"")
-        
-        # 递归生成树结构
-        self._write_tree_node(root, lines, prefix="", is_last=True, mode=mode)
-        
-        # 统计信息
-        lines.append(f"")
-        lines.append(f"---")
-        lines.append(f"")
-        lines.append(f"## Statistics")
-        lines.append(f"- **Total Processes:** {len(self.visited)}")
-        lines.append(f"- **Max Depth:** {self._get_max_depth(root)}")
-        if mode == "full_lci" and self.full_lci_edges:
-            total_flows = sum(len(flows) for flows in self.full_lci_edges.values())
-            lines.append(f"- **Total Edges:** {len(self.full_lci_edges)}")
-            lines.append(f"- **Total Flows:** {total_flows}")
-            lines.append(f"- **Avg Flows per Edge:** {total_flows/len(self.full_lci_edges):.2f}")
-        lines.append(f"")
-        
-        # 写入文件
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        # 渲染前批量解析名称
+        self.prefetch_names(root)
+        
+        # 逐行写入带缓冲的文件，不在内存中累积整个输出
+        with open_output(output_file) as f:
+            lines = LineWriter(f)
+            
+            # 标题
+            mode_title = "Skeleton Tree (Single Edge)" if mode == "skeleton" else "Full LCI Tree (Multiple Edges)"
+            lines.append(f"# UPR Process Tree Analysis - {mode_title}")
+            lines.append(f"")
+            lines.append(f"**Generated at:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            lines.append(f"**Version:** {config.VERSION}")
+            lines.append(f"**Mode:** {mode_title}")
+            lines.append(f"")
+            lines.append(f"---")
+            lines.append(f"")
+            
+            # 根产品信息
+            lines.append(f"## Product (Root Flow)")
+            lines.append(f"- **Flow ID:** `{config.ROOT_FLOW_ID}`")
+            lines.append(f"- **Flow Name:** {self.get_flow_name(config.ROOT_FLOW_ID)}")
+            lines.append(f"")
+            
+            # 根过程信息
+            lines.append(f"## Root Process (UPR)")
+            lines.append(f"- **Process ID:** `{config.ROOT_PROCESS_ID}`")
+            lines.append(f"- **Process Name:** {self.get_process_name(config.ROOT_PROCESS_ID)}")
+            lines.append(f"")
+            
+            lines.append(f"---")
+            lines.append(f"")
+            lines.append(f"## Process Tree Structure")
+            lines.append(f"")
+            
+            if mode == "skeleton":
+                lines.append(f"*Note: Each upstream → downstream relationship shows only one representative flow.*")
+            else:
+                lines.append(f"*Note: Each upstream → downstream relationship shows ALL flows.*")
+            if self.expand_shared:
+                lines.append(f"*↺ marks a shared upstream subtree (repeated in full); ⟲ marks a circular dependency "
+                             f"(\"cycle in canonical expansion\": a back edge where the subtree was first expanded, "
+                             f"not an ancestor at this position).*")
+            else:
+                lines.append(f"*↺ marks a shared upstream subtree (expanded at its first occurrence); ⟲ marks a circular dependency.*")
+            if self.condense_cycles:
+                lines.append(f"*⊚ marks a condensed cycle (strongly connected component); its children are the edges leaving the cycle.*")
+            if self.budget_exhausted:
+                lines.append(f"*⋯ marks an unexpanded frontier node (partial tree: the build stopped at its budget).*")
+            lines.append(f"")
+            
+            # 递归生成树结构
+            self._write_tree_node(root, lines, prefix="", is_last=True, mode=mode)
+            
+            # 统计信息
+            lines.append(f"")
+            lines.append(f"---")
+            lines.append(f"")
+            lines.append(f"## Statistics")
+            lines.append(f"- **Total Processes:** {len(self.visited)}")
+            lines.append(f"- **Max Depth:** {self._get_max_depth(root)}")
+            if self.condense_cycles and self.condensed:
+                lines.append(f"- **Cycles (SCC):** {len(self.condensed.cycles())} "
+                             f"({self.condensed.cyclic_process_count()} processes)")
+            if self.cutoff:
+                lines.append(f"- **Cutoff:** {self.cutoff_summary()}")
+            if self.budget_exhausted:
+                lines.append(f"- **Partial Tree:** {self.frontier_summary()}")
+            if mode == "full_lci" and self.full_lci_edges:
+                total_flows = sum(len(flows) for flows in self.full_lci_edges.values())
+                lines.append(f"- **Total Edges:** {len(self.full_lci_edges)}")
+                lines.append(f"- **Total Flows:** {total_flows}")
+                lines.append(f"- **Avg Flows per Edge:** {total_flows/len(self.full_lci_edges):.2f}")
+            lines.append(f"")
         
         print(f"\n✓ Markdown 树状图已生成: {output_file}")
     
     def _write_tree_node(self, node: ProcessTreeNode, lines: List[str], prefix: str = "", 
                         is_last: bool = True, mode: str = "skeleton"):
         """
-        递归写入树节点（Markdown 格式）
+        写入树节点及其子树（Markdown 格式，消费 iter_tree 的先序事件）
         
         Args:
             node: 当前节点
-            lines: 输出行列表
+            lines: 输出行（list 或 LineWriter）
             prefix: 前缀（用于缩进）
             is_last: 是否是最后一个子节点
             mode: "skeleton" 或 "full_lci"
         """
-        # 构建当前行
-        connector = "└─" if is_last else "├─"
-        
-        # 显示 process 信息
-        process_short = node.process_id[:8]
-        process_name = self.get_process_name(node.process_id)
+        prefixes = [prefix]  # prefixes[d]: 深度 d 的节点的前缀（只保留当前路径）
+        path = RenderedPath(self.expand_shared)
         
-        if mode == "skeleton":
-            # Skeleton 模式：只显示一条 flow
-            if node.flow_id:
-                flow_short = node.flow_id[:8]
-                flow_name = self.get_flow_name(node.flow_id)
-                line = f"{prefix}{connector} **[{process_short}...]** {process_name} ← via `{flow_short}...` ({flow_name})"
+        for depth, node, flow_ids, last in iter_tree(node, self.expand_shared):
+            if depth == 0:
+                last = is_last
+            
+            # 构建当前行
+            connector = "└─" if last else "├─"
+            extension = "    " if last else "│   "
+            prefix = prefixes[depth]
+            del prefixes[depth + 1:]
+            prefixes.append(prefix + extension)
+            
+            # 显示 process 信息
+            process_short = node.process_id[:8]
+            process_name = self.get_process_name(node.process_id)
+            marker = _node_marker(node, path.canonical_cycle(depth, node))
+            
+            if mode == "skeleton":
+                # Skeleton 模式：只显示一条 flow
+                if node.flow_id:
+                    flow_short = node.flow_id[:8]
+                    flow_name = self.get_flow_name(node.flow_id)
+                    line = f"{prefix}{connector} **[{process_short}...]** {process_name} ← via `{flow_short}...` ({flow_name}){marker}"
+                else:
+                    # 根节点
+                    line = f"{prefix}{connector} **[{process_short}...]** {process_name}{marker}"
+                lines.append(line)
             else:
-                # 根节点
-                line = f"{prefix}{connector} **[{process_short}...]** {process_name}"
-            lines.append(line)
-        else:
-            # Full LCI 模式：显示 process，然后列出所有 flow
-            if node.flows:
-                # 有多条 flow
-                line = f"{prefix}{connector} **[{process_short}...]** {process_name}"
+                # Full LCI 模式：显示 process，然后列出所有 flow
+                line = f"{prefix}{connector} **[{process_short}...]** {process_name}{marker}"
                 lines.append(line)
                 
-                # 显示所有 flow
-                extension = "    " if is_last else "│   "
-                for i, flow_id in enumerate(node.flows):
+                # 有多条 flow 时全部显示；只有一条 flow 时向后兼容；根节点没有 flow
+                for flow_id in flow_ids:
                     flow_short = flow_id[:8]
                     flow_name = self.get_flow_name(flow_id)
-                    flow_line = f"{prefix}{extension}  → via `{flow_short}...` ({flow_name})"
-                    lines.append(flow_line)
-            elif node.flow_id:
-                # 只有一条 flow（向后兼容）
-                flow_short = node.flow_id[:8]
-                flow_name = self.get_flow_name(node.flow_id)
-                line = f"{prefix}{connector} **[{process_short}...]** {process_name}"
-                lines.append(line)
-                extension = "    " if is_last else "│   "
-                flow_line = f"{prefix}{extension}  → via `{flow_short}...` ({flow_name})"
-                lines.append(flow_line)
-            else:
-                # 根节点
-                line = f"{prefix}{connector} **[{process_short}...]** {process_name}"
-                lines.append(line)
-        
-        # 递归处理子节点
-        if node.children:
-            extension = "    " if is_last else "│   "
-            for i, child in enumerate(node.children):
-                is_last_child = (i == len(node.children) - 1)
-                self._write_tree_node(child, lines, prefix + extension, is_last_child, mode=mode)
+                    lines.append(f"{prefix}{extension}  → via `{flow_short}...` ({flow_name})")
     
     def _get_max_depth(self, node: ProcessTreeNode, current_depth: int = 0) -> int:
-        """计算树的最大深度"""
-        if not node.children:
-            return current_depth
+        """
+        计算树的最大深度（显式栈迭代）
+        
+        共享子树按 DAG 最长路径计算（每个子树只计算一次），与展开后的完整树深度相同。
+        """
+        heights: Dict[int, int] = {}  # id(node) -> 该节点向下的最大层数
+        stack = [(node, False)]
+        while stack:
+            current, children_done = stack.pop()
+            if children_done:
+                heights[id(current)] = max((heights[id(child)] + 1 for child in current.children), default=0)
+            elif id(current) not in heights:
+                stack.append((current, True))
+                stack.extend((child, False) for child in current.children)
+        return current_depth + heights[id(node)]
+    
+    def exchange_view(self) -> ExchangeSnapshot:
+        """
+        以快照接口提供本次遍历已获取的上游 exchanges
+        
+        未剪枝且未受预算限制时遍历会展开根节点的整个上游闭包，主链路上的每个 process 都已在 exchange_cache 中，
+        MainChainBuilder 使用该视图选择 value 最大的边时不再查询 tb_exchanges；遍历未展开的
+        process 由 TraversalView 补充查询（需要构建器仍连接数据库）。已加载快照时直接返回快照。
+        """
+        if self.snapshot is not None:
+            return self.snapshot
+        return TraversalView(self)
+    
+    def generate_main_chain(self, process_id: str, flow_id: Optional[str] = None,
+                            output_file: Optional[str] = None) -> str:
+        """
+        由同一次遍历的 exchange 缓存推导主链路（每层选择 value 最大的 input exchange）
+        
+        须在 build_tree 之后调用；结果与 build_main_chain.py 生产模式相同。
+        
+        Args:
+            process_id: 链路起点 process ID
+            flow_id: 起点的 flow（可选）
+            output_file: 输出 TXT 文件（默认 output/main_chain_<flow 前 8 位>.txt）
+        
+        Returns:
+            输出文件路径
+        """
+        from build_main_chain import MainChainBuilder
+        
+        if output_file is None:
+            output_file = os.path.join(OUTPUT_DIR, f"main_chain_{(flow_id or process_id)[:8]}.txt")
         
-        max_child_depth = current_depth
-        for child in node.children:
-            child_depth = self._get_max_depth(child, current_depth + 1)
-            max_child_depth = max(max_child_depth, child_depth)
+        chain_builder = MainChainBuilder()
+        chain_builder.use_prepared = self.use_prepared
+        chain_builder.use_disk_cache = self.use_disk_cache
+        chain_builder.use_offline_store = self.use_offline_store
+        view = self.exchange_view()
+        chain_builder.snapshot = view
+        chain_builder.connect_db()
+        try:
+            print(f"由遍历缓存推导主链路（遍历未展开的 process 补充查询）...\n")
+            head_node = chain_builder.build_chain_recursive(process_id, flow_id, 0.0, 0)
+            chain_builder.generate_compact_txt(head_node, output_file)
+        finally:
+            chain_builder.close_db()
+        if isinstance(view, TraversalView) and view.fetched:
+            reason = f"遍历已达到 {self.budget_exhausted}" if self.budget_exhausted else "cutoff 剪枝"
+            print(f"⚠ 主链路经过 {len(view.fetched)} 个遍历时未展开的 process（{reason}），"
+                  f"已补充查询，主链路完整")
+        return output_file
+    
+    def build_tree(self, process_id: str, full_lci_mode: bool = False, 
+                   engine: str = "recursive") -> ProcessTreeNode:
+        """
+        按所选遍历引擎构建过程树
         
-        return max_child_depth
+        Args:
+            process_id: 根 process ID
+            full_lci_mode: 是否为 Full LCI 模式
+            engine: "recursive"（逐节点查询）、"frontier"（分层批量查询）、"cte"（服务端递归查询）、
+                    "anytime"（按贡献度优先展开，受 time_budget / node_budget 限制）
+                    或 "concurrent"（线程池并发查询，workers 个连接）
+        """
+        if engine == "concurrent":
+            return self.build_tree_concurrent(process_id, full_lci_mode=full_lci_mode)
+        if engine == "anytime":
+            return self.build_tree_anytime(process_id, full_lci_mode=full_lci_mode)
+        if engine == "frontier":
+            return self.build_tree_frontier(process_id, full_lci_mode=full_lci_mode)
+        if engine == "cte":
+            return self.build_tree_cte(process_id, full_lci_mode=full_lci_mode)
+        return self.build_tree_recursive(process_id, full_lci_mode=full_lci_mode)
     
-    def run(self, output_file: str = "process_tree.md", generate_both: bool = False):
+    def run(self, output_file: str = "process_tree.md", generate_both: bool = False,
+            engine: str = "recursive", use_snapshot: bool = False, with_main_chain: bool = False):
         """
         运行完整的流程：连接数据库 -> 构建树 -> 生成 Markdown
         
+        Skeleton、Full LCI 和主链路共用同一份 exchange 缓存：每个 process 的上游只查询一次。
+        
         Args:
             output_file: 输出文件名（Skeleton 模式）
             generate_both: 是否同时生成 Skeleton 和 Full LCI 两个版本
+            engine: 遍历引擎 - "recursive"、"frontier"、"cte"、"anytime" 或 "concurrent"
+            use_snapshot: 是否先加载整个版本的 exchange 快照
+            with_main_chain: 是否由同一次遍历的缓存同时生成主链路
+        
+        condense_cycles 为 True 时另外生成循环报告 output/cycle_report_<flow 前 8 位>.md
         """
         try:
             print("=" * 60)
@@ -396,6 +1424,9 @@ class ProcessTreeBuilder:
             # 1. 连接数据库
             self.connect_db()
             
+            if use_snapshot:
+                self.load_snapshot()
+            
             # 获取 flow_id 的短名称（用于文件名）
             flow_short = config.ROOT_FLOW_ID[:8]
             
@@ -407,11 +1438,18 @@ class ProcessTreeBuilder:
                 print(f"版本: {config.VERSION}")
                 print()
                 
-                root = self.build_tree_recursive(config.ROOT_PROCESS_ID, full_lci_mode=False)
+                root = self.build_tree(config.ROOT_PROCESS_ID, full_lci_mode=False, engine=engine)
                 
                 print(f"\n生成 Markdown 树状图...")
                 self.generate_markdown(root, output_file, mode="skeleton")
                 
+                if with_main_chain:
+                    print(f"\n由同一次遍历推导主链路...")
+                    self.generate_main_chain(config.ROOT_PROCESS_ID, config.ROOT_FLOW_ID)
+                
+                if self.condense_cycles:
+                    self.write_cycle_report(os.path.join(OUTPUT_DIR, f"cycle_report_{flow_short}.md"))
+            
             else:
                 # 生成两个版本
                 print(f"\n【模式 1/2】构建 Skeleton Tree (单连接边)...")
@@ -421,39 +1459,55 @@ class ProcessTreeBuilder:
                 print()
                 
                 # 构建 Skeleton Tree
-                root_skeleton = self.build_tree_recursive(config.ROOT_PROCESS_ID, full_lci_mode=False)
+                root_skeleton = self.build_tree(config.ROOT_PROCESS_ID, full_lci_mode=False, 
+                                                engine=engine)
                 skeleton_file = os.path.join(OUTPUT_DIR, f"process_tree_skeleton_{flow_short}.md")
                 
                 print(f"\n生成 Skeleton Markdown...")
                 self.generate_markdown(root_skeleton, skeleton_file, mode="skeleton")
                 
-                # 重置 visited 以便重新构建
-                self.visited.clear()
-                self.full_lci_edges.clear()
+                # 重置遍历状态以便重新构建（exchange_cache 保留，Full LCI 树不再查询数据库）
+                self.reset_tree()
                 
                 print(f"\n{'='*60}")
                 print(f"【模式 2/2】构建 Full LCI Tree (多连接边)...")
                 print(f"{'='*60}\n")
                 
                 # 构建 Full LCI Tree
-                root_full = self.build_tree_recursive(config.ROOT_PROCESS_ID, full_lci_mode=True)
+                root_full = self.build_tree(config.ROOT_PROCESS_ID, full_lci_mode=True, engine=engine)
                 full_lci_file = os.path.join(OUTPUT_DIR, f"process_tree_full_lci_{flow_short}.md")
                 
                 print(f"\n生成 Full LCI Markdown...")
                 self.generate_markdown(root_full, full_lci_file, mode="full_lci")
                 
+                main_chain_file = None
+                if with_main_chain:
+                    print(f"\n{'='*60}")
+                    print(f"【主链路】由同一次遍历推导...")
+                    print(f"{'='*60}\n")
+                    main_chain_file = self.generate_main_chain(config.ROOT_PROCESS_ID, config.ROOT_FLOW_ID)
+                
+                cycle_report_file = None
+                if self.condense_cycles:
+                    cycle_report_file = os.path.join(OUTPUT_DIR, f"cycle_report_{flow_short}.md")
+                    self.write_cycle_report(cycle_report_file)
+                
                 print(f"\n{'='*60}")
                 print(f"✓ 两个版本均已生成！")
                 print(f"{'='*60}")
                 print(f"\n生成文件:")
                 print(f"  1. Skeleton Tree: {skeleton_file}")
                 print(f"  2. Full LCI Tree: {full_lci_file}")
+                if main_chain_file:
+                    print(f"  3. Main Chain: {main_chain_file}")
+                if cycle_report_file:
+                    print(f"  {4 if main_chain_file else 3}. Cycle Report: {cycle_report_file}")
                 return
             
             print("\n" + "=" * 60)
             print("✓ 完成！")
             print("=" * 60)
-            
+        
         except Exception as e:
             print(f"\n✗ 执行失败: {e}")
             import traceback
@@ -469,17 +1523,57 @@ def main():
     
     # 检查命令行参数
     generate_both = "--both" in sys.argv or "-b" in sys.argv
+    use_snapshot = "--snapshot" in sys.argv
+    use_prepared = "--no-prepared" not in sys.argv
+    with_main_chain = "--main-chain" in sys.argv or "-m" in sys.argv
+    if "--cte" in sys.argv:
+        engine = "cte"
+    elif "--frontier" in sys.argv or "-f" in sys.argv:
+        engine = "frontier"
+    elif "--anytime" in sys.argv or "--time-budget" in sys.argv or "--node-budget" in sys.argv:
+        engine = "anytime"
+    elif "--concurrent" in sys.argv or "--workers" in sys.argv:
+        engine = "concurrent"
+    else:
+        engine = "recursive"
     
     builder = ProcessTreeBuilder()
+    builder.use_prepared = builder.use_prepared and use_prepared
+    builder.expand_shared = builder.expand_shared or "--expand-shared" in sys.argv
+    builder.condense_cycles = builder.condense_cycles or "--condense" in sys.argv
+    builder.use_disk_cache = builder.use_disk_cache or "--disk-cache" in sys.argv
+    builder.use_offline_store = builder.use_offline_store or "--offline" in sys.argv
+    apply_cutoff_args(builder, sys.argv)
+    if "--time-budget" in sys.argv:
+        builder.time_budget = float(sys.argv[sys.argv.index("--time-budget") + 1])
+    if "--node-budget" in sys.argv:
+        builder.node_budget = int(sys.argv[sys.argv.index("--node-budget") + 1])
+    if "--workers" in sys.argv:
+        builder.workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    
+    if engine == "frontier":
+        print(f"\n⚡ 分层批量查询模式（每批 {builder.batch_size} 个 process）")
+    elif engine == "cte":
+        print(f"\n⚡ 服务端递归查询模式（WITH RECURSIVE，一次往返）")
+    elif engine == "anytime":
+        if builder.condense_cycles:
+            print("\n⚠ 贡献度优先模式不支持 --condense（压缩需要先取得整个上游闭包），已忽略")
+            builder.condense_cycles = False
+        print(f"\n⚡ 贡献度优先模式（时间预算 {builder.time_budget or '不限'} 秒，"
+              f"节点预算 {builder.node_budget or '不限'}）")
+    elif engine == "concurrent":
+        print(f"\n⚡ 线程池并发查询模式（{builder.workers} 个线程，每个线程一个连接）")
     
     if generate_both:
         print("\n🔄 将生成两个版本：Skeleton Tree 和 Full LCI Tree\n")
-        builder.run(generate_both=True)
+        builder.run(generate_both=True, engine=engine, use_snapshot=use_snapshot,
+                    with_main_chain=with_main_chain)
     else:
         print("\n📝 默认模式：仅生成 Skeleton Tree")
         print("   提示：使用 --both 参数可同时生成两个版本\n")
         output_file = os.path.join(OUTPUT_DIR, "process_tree.md")
-        builder.run(output_file=output_file, generate_both=False)
+        builder.run(output_file=output_file, generate_both=False, engine=engine,
+                    use_snapshot=use_snapshot, with_main_chain=with_main_chain)
 
 
 if __name__ == "__main__":
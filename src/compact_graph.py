@@ -0,0 +1,276 @@
+"""
+Compact Exchange Graph - 数组存储的紧凑 exchange 图
+
+ExchangeSnapshot 为每条 exchange 保存一个 dict（含多个 36 字符 UUID 字符串和 float 对象），
+整个背景数据库的快照会占用 GB 级内存。CompactGraph 将 process / flow / unit 的 UUID
+驻留（intern）为连续整数，邻接关系按 CSR 方式存放在 array 中：
+
+    offsets[i] .. offsets[i+1]   process i 的上游 exchanges 在边数组中的区间
+    providers / flows / units    上游 process、flow、unit 的整数下标（-1 表示 NULL）
+    values / gwp / gwp_contribution   float64（NaN 表示 NULL）
+
+对外提供与 ExchangeSnapshot 相同的接口（upstream_exchanges / max_value_exchange / processes），
+查询结果按需生成 dict，构建器和导出器无需修改；节点中的 ID 字符串与图中驻留的字符串是同一对象。
+"""
+
+import math
+import uuid
+from array import array
+from typing import Dict, List, Optional, Iterable, Iterator
+from exchange_snapshot import ExchangeSnapshot
+
+
+class _Interner:
+    """UUID 字符串 <-> 连续整数下标"""
+    
+    def __init__(self):
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+    
+    def intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        i = self.index.get(value)
+        if i is None:
+            i = len(self.ids)
+            self.index[value] = i
+            self.ids.append(value)
+        return i
+    
+    def get(self, i: int) -> Optional[str]:
+        return self.ids[i] if i >= 0 else None
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class _EdgeIds:
+    """
+    exchange ID 存储：标准 UUID 字符串压缩为 16 字节存入一个 bytearray，
+    遇到非标准格式的 ID 时整体退回字符串列表
+    """
+    
+    def __init__(self):
+        self.packed: Optional[bytearray] = bytearray()
+        self.strings: List[str] = []
+    
+    @staticmethod
+    def _pack(value: str) -> Optional[bytes]:
+        try:
+            packed = uuid.UUID(value).bytes
+        except (TypeError, ValueError, AttributeError):
+            return None
+        return packed if str(uuid.UUID(bytes=packed)) == value else None
+    
+    def append(self, value: str):
+        if self.packed is not None:
+            packed = self._pack(value)
+            if packed is not None:
+                self.packed += packed
+                return
+            # 退回字符串列表
+            self.strings = [self.get(k) for k in range(len(self.packed) // 16)]
+            self.packed = None
+        self.strings.append(value)
+    
+    def get(self, k: int) -> str:
+        if self.packed is not None:
+            return str(uuid.UUID(bytes=bytes(self.packed[16 * k:16 * k + 16])))
+        return self.strings[k]
+    
+    def key(self, k: int):
+        """第 k 条边的比较键（与 encode 的结果可比）"""
+        if self.packed is not None:
+            return bytes(self.packed[16 * k:16 * k + 16])
+        return self.strings[k]
+    
+    def encode(self, ids: Iterable[str]) -> frozenset:
+        """把一组 exchange ID 转换为比较键集合"""
+        if self.packed is None:
+            return frozenset(ids)
+        return frozenset(packed for packed in map(self._pack, ids) if packed is not None)
+    
+    def reorder(self, order: Iterable[int]):
+        if self.packed is not None:
+            packed = self.packed
+            reordered = bytearray(len(packed))
+            for i, k in enumerate(order):
+                reordered[16 * i:16 * i + 16] = packed[16 * k:16 * k + 16]
+            self.packed = reordered
+        else:
+            self.strings = [self.strings[k] for k in order]
+    
+    def nbytes(self) -> int:
+        return len(self.packed) if self.packed is not None else 0
+
+
+def _to_float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _from_float(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+class CompactGraph(ExchangeSnapshot):
+    """某个版本 exchange 图的紧凑表示（整数 ID + CSR 数组）"""
+    
+    def __init__(self, version: str = None):
+        super().__init__(version)
+        self.processes_table = _Interner()
+        self.flows_table = _Interner()
+        self.units_table = _Interner()
+        self.edge_ids = _EdgeIds()  # exchange ID（建设模式按 exchange ID 过滤 category）
+        self._allowed_cache = (None, None)  # (allowed_ids 对象, 比较键集合)
+        
+        # CSR 数组（finalize 后有效）
+        self.offsets = array('q')
+        self.providers = array('q')
+        self.flows = array('q')
+        self.units = array('q')
+        self.values = array('d')
+        self.gwp = array('d')
+        self.gwp_contribution = array('d')
+        
+        # 加载期间的 COO 暂存（finalize 后释放）
+        self._sources = array('q')
+    
+    def add_row(self, values: List):
+        """添加一条 exchange 记录（values 顺序与 SNAPSHOT_COLUMNS 一致）"""
+        edge_id, process_id, provider_id, flow_id, value, unit_id, gwp, gwp_contribution = values
+        self._sources.append(self.processes_table.intern(process_id))
+        self.providers.append(self.processes_table.intern(provider_id))
+        self.flows.append(self.flows_table.intern(flow_id))
+        self.units.append(self.units_table.intern(unit_id))
+        self.values.append(_to_float(value))
+        self.gwp.append(_to_float(gwp))
+        self.gwp_contribution.append(_to_float(gwp_contribution))
+        self.edge_ids.append(edge_id)
+        self.edge_count += 1
+    
+    def finalize(self):
+        """
+        将 COO 暂存转换为 CSR：按 process 分段（计数排序，保持读取顺序），
+        段内按 flow_id 稳定排序，与 ExchangeSnapshot / ORDER BY flow_id 一致
+        """
+        process_count = len(self.processes_table)
+        sources = self._sources
+        
+        offsets = array('q', bytes(8 * (process_count + 1)))
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in range(process_count):
+            offsets[i + 1] += offsets[i]
+        
+        # 计数排序得到按 process 分段的边顺序
+        position = array('q', offsets)
+        order = array('q', bytes(8 * len(sources)))
+        for k, source in enumerate(sources):
+            order[position[source]] = k
+            position[source] += 1
+        
+        flow_ids = self.flows_table.ids
+        flows = self.flows
+        for i in range(process_count):
+            start, end = offsets[i], offsets[i + 1]
+            if end - start > 1:
+                order[start:end] = array('q', sorted(
+                    order[start:end], key=lambda k: flow_ids[flows[k]] if flows[k] >= 0 else ''))
+        
+        self.offsets = offsets
+        self.providers = array('q', (self.providers[k] for k in order))
+        self.flows = array('q', (flows[k] for k in order))
+        self.units = array('q', (self.units[k] for k in order))
+        self.values = array('d', (self.values[k] for k in order))
+        self.gwp = array('d', (self.gwp[k] for k in order))
+        self.gwp_contribution = array('d', (self.gwp_contribution[k] for k in order))
+        self.edge_ids.reorder(order)
+        self._sources = array('q')
+        
+        super().finalize()
+        print(f"  紧凑图: {process_count} 个 process ID, {len(self.flows_table)} 个 flow ID, "
+              f"{self.edge_count} 条边, 数组约 {self.nbytes() / (1024 * 1024):.1f} MB")
+    
+    def nbytes(self) -> int:
+        """CSR 数组和压缩 exchange ID 占用的字节数（不含驻留的 process / flow ID 字符串）"""
+        arrays = (self.offsets, self.providers, self.flows, self.units,
+                  self.values, self.gwp, self.gwp_contribution)
+        return sum(a.itemsize * len(a) for a in arrays) + self.edge_ids.nbytes()
+    
+    def index_of(self, process_id: str) -> Optional[int]:
+        """process ID 对应的整数下标（不在图中时返回 None）"""
+        return self.processes_table.index.get(process_id)
+    
+    def edge_range(self, index: int) -> range:
+        """process 下标 index 的上游 exchanges 在边数组中的区间"""
+        return range(self.offsets[index], self.offsets[index + 1])
+    
+    def _row(self, process_id: str, k: int) -> Dict:
+        """把第 k 条边还原为与 ExchangeSnapshot 相同格式的 dict"""
+        return {
+            'id': self.edge_ids.get(k),
+            'process_id': process_id,
+            'provider_id': self.processes_table.ids[self.providers[k]],
+            'flow_id': self.flows_table.get(self.flows[k]),
+            'value': _from_float(self.values[k]),
+            'unit_id': self.units_table.get(self.units[k]),
+            'gwp': _from_float(self.gwp[k]),
+            'gwp_contribution': _from_float(self.gwp_contribution[k]),
+        }
+    
+    def __contains__(self, process_id: str) -> bool:
+        index = self.index_of(process_id)
+        return index is not None and self.offsets[index + 1] > self.offsets[index]
+    
+    def __len__(self) -> int:
+        offsets = self.offsets
+        return sum(1 for i in range(len(offsets) - 1) if offsets[i + 1] > offsets[i])
+    
+    def processes(self) -> Iterator[str]:
+        """所有有上游 exchange 的 process ID"""
+        offsets = self.offsets
+        for i, process_id in enumerate(self.processes_table.ids):
+            if offsets[i + 1] > offsets[i]:
+                yield process_id
+    
+    def upstream_exchanges(self, process_id: str) -> List[Dict]:
+        """获取 process 的所有上游 input exchanges（按 flow_id 排序）"""
+        index = self.index_of(process_id)
+        if index is None:
+            return []
+        process_id = self.processes_table.ids[index]
+        return [self._row(process_id, k) for k in self.edge_range(index)]
+    
+    def max_value_exchange(self, process_id: str,
+                           allowed_ids: Optional[Iterable[str]] = None) -> Optional[Dict]:
+        """
+        获取 process 的 value 最大的上游 input exchange（直接在数组上比较，只为结果生成 dict）
+        
+        与 ORDER BY value DESC NULLS LAST LIMIT 1 等价，忽略 provider_id 为空字符串的记录。
+        """
+        index = self.index_of(process_id)
+        if index is None:
+            return None
+        
+        allowed_keys = None
+        if allowed_ids is not None:
+            # 过滤集合在一次分析中不变，只转换一次
+            cached_ids, allowed_keys = self._allowed_cache
+            if cached_ids is not allowed_ids:
+                allowed_keys = self.edge_ids.encode(allowed_ids)
+                self._allowed_cache = (allowed_ids, allowed_keys)
+        
+        process_ids = self.processes_table.ids
+        values = self.values
+        best = -1
+        for k in self.edge_range(index):
+            if not process_ids[self.providers[k]]:
+                continue
+            if allowed_keys is not None and self.edge_ids.key(k) not in allowed_keys:
+                continue
+            if best < 0:
+                best = k
+            elif not math.isnan(values[k]) and (math.isnan(values[best]) or values[k] > values[best]):
+                best = k
+        
+        return self._row(process_ids[index], best) if best >= 0 else None
@@ -12,9 +12,77 @@ PG_DATABASE = "hiq_background_db"
 PG_SCHEMA = "public"
 PG_TABLE = "tb_exchanges"
 
+# 连接池（所有构建器、批量脚本和菜单功能共享，按数据库名分池）
+DB_POOL_MIN_SIZE = 1  # 创建连接池时预先打开的连接数（之后按需建立，归还的连接最多保留 DB_POOL_MAX_SIZE 个空闲）
+DB_POOL_MAX_SIZE = 8
+DB_POOL_HEALTH_CHECK = True  # 复用连接前是否做健康检查
+DB_POOL_HEALTH_CHECK_IDLE = 30  # 空闲超过多少秒的连接在复用前执行 SELECT 1
+
+# 热点查询（上游 exchange、最大 value exchange、名称查询）是否使用服务端 PREPARE/EXECUTE
+# 设为 False 可与逐次解析的即席查询对比
+USE_PREPARED_STATEMENTS = True
+
 # Query Parameters
 VERSION = "1.4.0"
 
+# 分层批量遍历（frontier 模式）：每次 ANY(%s) 查询最多携带的 process_id 数量
+FRONTIER_BATCH_SIZE = 500
+
+# 批量名称解析：每次 id = ANY(%s) 查询最多携带的 ID 数量
+NAME_BATCH_SIZE = 1000
+
+# 过程树按 DAG 构建：被多个下游引用的上游 process 只展开一次，其余引用共享同一子树。
+# 渲染（Markdown / TXT / JSON / 统计）时是否在每个引用处重新展开共享子树（完整树视图，输出可能很大）
+EXPAND_SHARED_SUBTREES = False
+
+# exchange 快照使用数组存储的紧凑图（UUID 驻留为整数 + CSR 邻接数组），内存约为 dict 快照的数十分之一
+COMPACT_SNAPSHOT = True
+
+# 在强连通分量（SCC）压缩图上构建过程树：每个循环依赖作为一个节点，不再按遍历顺序截断回边，
+# 同时生成循环报告（成员和入口边）
+CONDENSE_CYCLES = False
+
+# Top-k 链路搜索：优先队列最多保留的部分路径数（超过时只保留得分上界最高的部分）
+TOP_K_MAX_FRONTIER = 100000
+# Top-k 链路搜索：最多弹出的部分路径数（value 排序在大循环中上界较松，防止搜索接近穷举）
+TOP_K_MAX_EXPANSIONS = 1000000
+
+# 技术矩阵求解（supply_solver.py）：未安装 scipy 时不动点迭代的最大轮数和收敛容差（相对变化）
+SUPPLY_SOLVER_MAX_ITERATIONS = 1000
+SUPPLY_SOLVER_TOLERANCE = 1e-10
+
+# 过程树剪枝：沿每条分支累乘 exchange value（或 gwp_contribution），累计比例低于阈值的分支不再展开。
+# 0 表示不剪枝；例如 1e-4 即忽略贡献小于根节点 0.01% 的分支
+TREE_CUTOFF = 0.0
+TREE_CUTOFF_BY = "value"  # "value" 或 "gwp"
+
+# 贡献度优先（anytime）构建：按分支累计比例从高到低展开，达到预算时返回标记了未展开 frontier 的部分树。
+# 时间预算（秒）和节点预算（最多展开的 process 数），0 表示不限
+ANYTIME_TIME_BUDGET = 30.0
+ANYTIME_NODE_BUDGET = 0
+
+# 并发构建（--concurrent / --workers N）：线程池大小，每个线程从连接池借用一个连接，
+# 与构建器自己的连接合计不超过 DB_POOL_MAX_SIZE
+CONCURRENT_WORKERS = 4
+
+# asyncio 构建器（async_builder.py，需要 asyncpg）：在途查询上限，即 asyncpg 连接池大小
+ASYNC_MAX_IN_FLIGHT = 32
+
+# 本地磁盘缓存（disk_cache.py，SQLite）：--disk-cache 或设为 True 时，构建器连接数据库后载入未过期的
+# 上游 exchanges / 名称，关闭时写回本次新查询的记录；按 (数据库, 版本, 模式, category 过滤) 分区。
+# 清除缓存: python src/disk_cache.py --clear
+DISK_CACHE_ENABLED = False
+DISK_CACHE_PATH = "cache/upr_cache.sqlite"  # 相对路径相对于项目根目录
+DISK_CACHE_TTL = 24 * 3600  # 记录有效期（秒），0 表示永不过期
+
+# 离线数据（offline_store.py）：某个版本的 exchanges / 名称 / category 过滤集合导出为本地单个 SQLite 文件，
+# --offline 或设为 True 时构建器不连接生产数据库，全部数据从该文件读取。导出: python src/offline_store.py --export
+OFFLINE_MODE = False
+OFFLINE_STORE_PATH = "offline/upr_store.sqlite"  # 相对路径相对于项目根目录
+
+# 导出（Markdown / TXT / JSON）逐行流式写入文件时的缓冲区大小（字节）
+EXPORT_BUFFER_SIZE = 1 << 20
+
 # Root node information
 ROOT_FLOW_ID = "02eef75e-bb2f-4283-95b4-249521aa2c12"  # 线材, 不锈钢
 ROOT_PROCESS_ID = "251da196-55f8-4c57-a783-9888cf33c626"  # 线材,不锈钢, 转炉钢
@@ -0,0 +1,225 @@
+"""
+Cycle Condensation - 强连通分量检测与循环压缩
+
+背景数据库中存在循环依赖（如 电力 ↔ 煤炭），逐节点遍历只能靠 visited 临时截断，
+被截断的是哪一条边取决于遍历顺序。这里对已加载的 exchange 图（快照或遍历缓存）
+运行一次迭代版 Tarjan 算法：
+
+    - 每个强连通分量（SCC）压缩为一个节点，得到无环的压缩图（condensed DAG）
+    - 多于一个 process 的分量（或有自环的 process）即为一个循环
+    - 循环报告列出每个循环的成员和进入该循环的入口边
+
+压缩图上的遍历不再需要截断任何边，结果与遍历顺序无关，时间与边数成线性关系。
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+import config
+
+
+def strongly_connected_components(roots: Iterable[str],
+                                  successors: Callable[[str], Iterable[str]]) -> List[List[str]]:
+    """
+    Tarjan 强连通分量算法（显式栈迭代，不受 Python 递归深度限制）
+    
+    Args:
+        roots: 遍历起点（只处理从这些起点可达的节点）
+        successors: 节点 -> 后继节点（上游 provider）
+    
+    Returns:
+        强连通分量列表；每个分量在其所有后继分量之后输出（上游在前）
+    """
+    index: Dict[str, int] = {}
+    lowlink: Dict[str, int] = {}
+    on_stack = set()
+    stack: List[str] = []
+    components: List[List[str]] = []
+    
+    for root in roots:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors(root)))]
+        
+        while work:
+            node, remaining = work[-1]
+            for succ in remaining:
+                if succ not in index:
+                    # 先深入后继，之后从迭代器的当前位置继续
+                    index[succ] = lowlink[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(successors(succ))))
+                    break
+                if succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    
+    return components
+
+
+class CondensedGraph:
+    """exchange 图的 SCC 压缩视图"""
+    
+    def __init__(self, graph, roots: Optional[Iterable[str]] = None):
+        """
+        Args:
+            graph: 提供 upstream_exchanges / processes 的图（ExchangeSnapshot、CompactGraph 或 exchange_view）
+            roots: 只压缩从这些 process 可达的子图（默认整个图）
+        """
+        self.graph = graph
+        self.roots = list(roots) if roots is not None else sorted(graph.processes())
+        
+        self.components: List[Tuple[str, ...]] = []  # 分量成员（排序后，第一个为代表）
+        self.component_of: Dict[str, int] = {}  # process_id -> 分量下标
+        self.exits: Dict[int, List[Dict]] = {}  # 循环分量 -> 离开分量的上游 exchanges
+        self.entries: Dict[int, List[Dict]] = {}  # 循环分量 -> 从分量外进入的 exchanges
+        self.internal_edges: Dict[int, int] = {}  # 循环分量 -> 分量内部的边数
+        
+        for members in strongly_connected_components(self.roots, self._providers):
+            c = len(self.components)
+            self.components.append(tuple(sorted(members)))
+            for process_id in members:
+                self.component_of[process_id] = c
+        
+        self._collect_edges()
+    
+    def _providers(self, process_id: str) -> Iterable[str]:
+        return (exchange['provider_id'] for exchange in self.graph.upstream_exchanges(process_id))
+    
+    def _collect_edges(self):
+        """一次扫描所有边：区分循环内部的边、离开循环的边和进入循环的边"""
+        for c, members in enumerate(self.components):
+            for process_id in members:
+                for exchange in self.graph.upstream_exchanges(process_id):
+                    upstream = self.component_of[exchange['provider_id']]
+                    if upstream == c:
+                        self.internal_edges[c] = self.internal_edges.get(c, 0) + 1
+                    else:
+                        self.exits.setdefault(c, []).append(exchange)
+                        self.entries.setdefault(upstream, []).append(exchange)
+        
+        # 只保留循环分量的出入边，非循环 process 直接使用原图
+        cyclic = set(self.internal_edges)
+        self.exits = {c: edges for c, edges in self.exits.items() if c in cyclic}
+        self.entries = {c: edges for c, edges in self.entries.items() if c in cyclic}
+    
+    def is_cyclic(self, process_id: str) -> bool:
+        """process 是否属于某个循环（多成员分量或自环）"""
+        return self.component_of[process_id] in self.internal_edges
+    
+    def representative(self, process_id: str) -> str:
+        """process 所在分量的代表（成员中 ID 最小者），与遍历顺序无关"""
+        return self.components[self.component_of[process_id]][0]
+    
+    def members(self, process_id: str) -> Optional[Tuple[str, ...]]:
+        """process 所在循环的全部成员；不在循环中时返回 None"""
+        c = self.component_of[process_id]
+        return self.components[c] if c in self.internal_edges else None
+    
+    def upstream_exchanges(self, process_id: str) -> List[Dict]:
+        """
+        压缩图中的上游 exchanges：循环分量返回所有成员离开该分量的边
+        （按成员 ID、flow_id 排序），其他 process 与原图相同
+        """
+        c = self.component_of[process_id]
+        if c in self.internal_edges:
+            return self.exits.get(c, [])
+        return self.graph.upstream_exchanges(process_id)
+    
+    def upstream_components(self, c: int) -> List[int]:
+        """压缩 DAG 中分量 c 的上游分量（去重，保持边的顺序）"""
+        upstream: Dict[int, None] = {}
+        for process_id in self.components[c]:
+            for exchange in self.graph.upstream_exchanges(process_id):
+                u = self.component_of[exchange['provider_id']]
+                if u != c:
+                    upstream[u] = None
+        return list(upstream)
+    
+    def cycles(self) -> List[int]:
+        """所有循环分量的下标（成员多的在前，成员相同时按代表 ID 排序）"""
+        return sorted(self.internal_edges, key=lambda c: (-len(self.components[c]), self.components[c][0]))
+    
+    def cyclic_process_count(self) -> int:
+        """属于某个循环的 process 总数"""
+        return sum(len(self.components[c]) for c in self.internal_edges)
+
+
+def write_cycle_report(condensed: CondensedGraph, output_file: str,
+                       get_process_name: Callable[[str], str],
+                       get_flow_name: Callable[[str], str]):
+    """
+    生成循环报告（Markdown）：每个循环的成员、入口边和出口边数量
+    
+    Args:
+        condensed: 压缩图
+        output_file: 输出文件
+        get_process_name / get_flow_name: 名称查询（调用前应已批量解析）
+    """
+    cycles = condensed.cycles()
+    
+    lines = []
+    lines.append("# 循环依赖报告 (Strongly Connected Components)")
+    lines.append("")
+    lines.append(f"**生成时间:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    lines.append(f"**版本:** {config.VERSION}")
+    lines.append(f"**分析范围:** {', '.join(f'`{r[:8]}...`' for r in condensed.roots[:5])}"
+                 f"{' ...' if len(condensed.roots) > 5 else ''}")
+    lines.append("")
+    lines.append("## 概览")
+    lines.append("")
+    lines.append(f"- **Process 总数:** {len(condensed.component_of)}")
+    lines.append(f"- **压缩后节点数:** {len(condensed.components)}")
+    lines.append(f"- **循环数:** {len(cycles)}")
+    lines.append(f"- **循环内 process 数:** {condensed.cyclic_process_count()}")
+    lines.append("")
+    
+    for i, c in enumerate(cycles, 1):
+        members = condensed.components[c]
+        entries = condensed.entries.get(c, [])
+        lines.append(f"## 循环 {i}（{len(members)} 个 process）")
+        lines.append("")
+        lines.append(f"- **内部边数:** {condensed.internal_edges[c]}")
+        lines.append(f"- **入口边数:** {len(entries)}")
+        lines.append(f"- **出口边数:** {len(condensed.exits.get(c, []))}")
+        lines.append("")
+        lines.append("### 成员")
+        lines.append("")
+        for process_id in members:
+            lines.append(f"- `{process_id}` {get_process_name(process_id)}")
+        lines.append("")
+        lines.append("### 入口边")
+        lines.append("")
+        if entries:
+            lines.append("| 下游 Process | 进入的成员 | Flow |")
+            lines.append("|--------------|------------|------|")
+            for exchange in entries:
+                downstream, member = exchange['process_id'], exchange['provider_id']
+                flow_id = exchange['flow_id']
+                lines.append(f"| `{downstream[:8]}...` {get_process_name(downstream)} "
+                             f"| `{member[:8]}...` {get_process_name(member)} "
+                             f"| {get_flow_name(flow_id) if flow_id else 'N/A'} |")
+        else:
+            lines.append("*无入口边（分析起点位于该循环中）*")
+        lines.append("")
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+    
+    print(f"✓ 循环报告已生成: {output_file}（{len(cycles)} 个循环）")
@@ -0,0 +1,233 @@
+"""
+Database Connection Pool - 共享数据库连接池
+
+所有构建器（ProcessTreeBuilder、MainChainBuilder）、批量脚本和菜单功能都从这里借用连接，
+同一进程内按数据库名复用已建立的连接，避免每次分析都重新进行 TLS / 认证握手。
+
+生产模式和建设模式使用同一套连接池：每个数据库（hiq_background_db、hiq_editor）各有一个池。
+"""
+
+import atexit
+import hashlib
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, List, Set, Optional
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor
+import config
+
+
+class IdleConnectionPool(pg_pool.ThreadedConnectionPool):
+    """
+    启动时只打开 minconn 个连接，之后按需建立；归还的连接最多保留 maxconn 个空闲
+    
+    psycopg2 的连接池在归还时关闭超过 minconn 的空闲连接，并发构建反复借还时会不断重新握手；
+    而调大 minconn 又会在创建连接池时预先打开全部连接。psycopg2 只在 __init__（预先打开）和
+    _putconn（空闲保留上限）中使用 minconn，因此初始化之后把它设为 maxconn。
+    """
+    
+    def __init__(self, minconn: int, maxconn: int, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.minconn = self.maxconn
+
+
+_pools: Dict[str, IdleConnectionPool] = {}
+# 以连接对象为弱引用键：连接池关闭多余的连接（超过 minconn）时不经过 _forget，
+# 连接对象释放后记录随之消失，不会被恰好复用同一 id() 的新连接继承
+_last_used: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # 连接 -> 最近一次归还的时间
+_prepared: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # 连接 -> 该会话上已 PREPARE 的语句名
+_lock = threading.Lock()
+
+
+def get_pool(database: str) -> IdleConnectionPool:
+    """获取（必要时创建）指定数据库的连接池"""
+    with _lock:
+        if database not in _pools:
+            _pools[database] = IdleConnectionPool(
+                config.DB_POOL_MIN_SIZE,
+                config.DB_POOL_MAX_SIZE,
+                host=config.PG_HOST,
+                port=config.PG_PORT,
+                user=config.PG_USER,
+                password=config.PG_PASSWORD,
+                database=database
+            )
+        return _pools[database]
+
+
+def _is_healthy(conn) -> bool:
+    """
+    健康检查：连接未关闭；复用前空闲超过 DB_POOL_HEALTH_CHECK_IDLE 秒的连接需能执行 SELECT 1
+    """
+    if conn.closed:
+        return False
+    if not config.DB_POOL_HEALTH_CHECK:
+        return True
+    
+    last_used = _last_used.get(conn)
+    if last_used is None:
+        # 新建的连接无需检查
+        return True
+    if time.monotonic() - last_used < config.DB_POOL_HEALTH_CHECK_IDLE:
+        return True
+    
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def get_connection(database: str):
+    """
+    从连接池借用一个连接（经过健康检查）
+    
+    Args:
+        database: 数据库名
+    
+    Returns:
+        psycopg2 连接，使用完毕后必须通过 release_connection 归还
+    """
+    pool = get_pool(database)
+    for _ in range(config.DB_POOL_MAX_SIZE + 1):
+        conn = pool.getconn()
+        if _is_healthy(conn):
+            return conn
+        # 失效连接直接丢弃，连接池会在下次 getconn 时新建
+        print(f"⚠ 丢弃失效的数据库连接: {database}")
+        _forget(conn)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError(f"无法从连接池获取可用连接: {database}")
+
+
+def release_connection(conn, database: str):
+    """
+    归还连接：回滚未结束的事务后放回连接池，已关闭的连接直接丢弃
+    """
+    if conn is None:
+        return
+    pool = get_pool(database)
+    if conn.closed:
+        _forget(conn)
+        pool.putconn(conn, close=True)
+        return
+    try:
+        conn.rollback()
+    except Exception:
+        _forget(conn)
+        pool.putconn(conn, close=True)
+        return
+    _last_used[conn] = time.monotonic()
+    pool.putconn(conn)
+
+
+def _forget(conn):
+    """丢弃连接前清除其状态记录"""
+    _last_used.pop(conn, None)
+    _prepared.pop(conn, None)
+
+
+def execute_statement(cursor, name: str, query: str, params: tuple,
+                      prepared: Optional[bool] = None):
+    """
+    执行热点查询：每个连接只 PREPARE 一次，之后用 EXECUTE 复用服务端的解析和执行计划
+
+    语句名由 name 前缀和 SQL 文本的哈希组成，不同模式/表的同名查询不会冲突。
+    PREPARE 不受事务回滚影响，连接归还连接池后仍然有效。
+
+    Args:
+        cursor: 游标
+        name: 语句名前缀（如 "upstream_exchanges"）
+        query: 使用 %s 占位符的 SQL
+        params: 参数
+        prepared: 是否使用 PREPARE/EXECUTE（默认使用 config.USE_PREPARED_STATEMENTS，False 时直接执行）
+    """
+    if prepared is None:
+        prepared = config.USE_PREPARED_STATEMENTS
+    if not prepared:
+        cursor.execute(query, params)
+        return
+
+    statement = f"{name}_{hashlib.md5(query.encode('utf-8')).hexdigest()[:10]}"
+    statements = _prepared.setdefault(cursor.connection, set())
+    if statement not in statements:
+        counter = iter(range(1, len(params) + 1))
+        server_query = re.sub(r'%s', lambda _: f"${next(counter)}", query)
+        cursor.execute(f"PREPARE {statement} AS {server_query}")
+        statements.add(statement)
+
+    placeholders = ', '.join(['%s'] * len(params))
+    cursor.execute(f"EXECUTE {statement} ({placeholders})", params)
+
+
+class ConnectionWorkers:
+    """
+    有界线程池：每个工作线程从连接池借用一个连接，在自己的游标上执行查询
+    
+    提交的函数以 fn(cursor, *args) 形式调用，只执行查询并返回结果；写入构建器缓存由调用方
+    （提交任务的线程）完成，因此缓存不需要加锁。关闭时等待所有任务结束并归还全部连接。
+    
+    用法:
+        with ConnectionWorkers(config.PG_DATABASE, 4) as workers:
+            future = workers.submit(fetch, chunk)
+    """
+    
+    def __init__(self, database: str, workers: int):
+        self.database = database
+        self.workers = workers
+        self._local = threading.local()
+        self._connections: List = []
+        self._connections_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"db-{database}",
+                                            initializer=self._connect)
+    
+    def _connect(self):
+        """线程初始化：借用连接并创建游标（整个线程生命周期内复用）"""
+        conn = get_connection(self.database)
+        with self._connections_lock:
+            self._connections.append(conn)
+        self._local.cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    def _call(self, fn: Callable, args: tuple):
+        return fn(self._local.cursor, *args)
+    
+    def submit(self, fn: Callable, *args) -> Future:
+        """在某个工作线程的游标上执行 fn(cursor, *args)"""
+        return self._executor.submit(self._call, fn, args)
+    
+    def map(self, fn: Callable, chunks: List) -> List:
+        """并发执行 fn(cursor, chunk)，结果按 chunks 的顺序返回"""
+        return [future.result() for future in [self.submit(fn, chunk) for chunk in chunks]]
+    
+    def close(self):
+        """等待所有任务结束，归还全部连接"""
+        self._executor.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                release_connection(conn, self.database)
+            self._connections.clear()
+    
+    def __enter__(self) -> 'ConnectionWorkers':
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def close_all():
+    """关闭所有连接池中的连接（进程退出时自动调用）"""
+    with _lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+        _last_used.clear()
+        _prepared.clear()
+
+
+atexit.register(close_all)
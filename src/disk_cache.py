@@ -0,0 +1,208 @@
+"""
+Disk Cache - 本地磁盘缓存（SQLite）
+
+同一 VERSION 的数据在一天内多次运行时，每次都要从生产数据库重新读取。启用磁盘缓存后
+（--disk-cache 或 config.DISK_CACHE_ENABLED），构建器在 connect_db 时把未过期的记录载入内存缓存
+（上游 exchanges、名称、建设模式的 category 过滤集合），close_db 时写回本次新查询的记录：
+
+    - 记录按 (database, version, mode, category_filter) 分区，不同版本 / 模式 / 过滤条件互不影响
+    - 每条记录带写入时间，超过 DISK_CACHE_TTL 秒的记录载入时忽略，重新查询后覆盖
+    - 只调整输出格式后重跑报告时，数据全部来自缓存，不再向生产数据库发出查询
+
+缓存文件位于 DISK_CACHE_PATH，使用标准库 sqlite3（WAL 模式，多个进程可同时读写）。
+记录以 JSON 保存（缓存文件可能在多人之间共享，不使用 pickle）：numeric 列（Decimal）保存为 float，
+集合保存为列表；无法解析的记录（如旧版本写入的 pickle）载入时忽略，重新查询后覆盖。
+
+用法:
+    python src/disk_cache.py                                  # 查看缓存统计
+    python src/disk_cache.py --clear                          # 清除全部缓存
+    python src/disk_cache.py --clear --version 1.4.0 --mode editor
+    python src/disk_cache.py --purge                          # 只删除已过期的记录
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime
+from decimal import Decimal
+import config
+
+
+def cache_path(path: Optional[str] = None) -> str:
+    """缓存文件的绝对路径（相对路径相对于项目根目录）"""
+    path = path or config.DISK_CACHE_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+    return path
+
+
+def _connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """打开缓存文件（不存在时创建）"""
+    path = cache_path(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS entries (
+            database TEXT NOT NULL,
+            version TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            category TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (database, version, mode, category, kind, item_id)
+        )
+    """)
+    return conn
+
+
+def _json_default(value):
+    """JSON 不支持的类型：Decimal 转换为 float，集合转换为排序后的列表"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"无法写入磁盘缓存的类型: {type(value).__name__}")
+
+
+class DiskCache:
+    """某个 (database, version, mode, category_filter) 分区的磁盘缓存"""
+    
+    def __init__(self, database: str, version: str, mode: str, category_filter: Optional[str] = None,
+                 path: Optional[str] = None, ttl: Optional[float] = None):
+        """
+        Args:
+            database: 数据来源数据库
+            version: 数据版本（VERSION）
+            mode: 构建器模式（"production" / "editor"；过程树构建器的名称规则不同，使用 "tree"）
+            category_filter: 建设模式的 category 过滤条件
+            path: 缓存文件（默认使用 config.DISK_CACHE_PATH）
+            ttl: 记录有效期（秒，默认使用 config.DISK_CACHE_TTL，0 表示永不过期）
+        """
+        self.partition = (database, version, mode, category_filter or "")
+        self.ttl = config.DISK_CACHE_TTL if ttl is None else ttl
+        self.path = cache_path(path)
+        self.conn = _connect(self.path)
+        self.stored: Dict[str, Set[str]] = {}  # kind -> 缓存中未过期的 item_id（写回时跳过）
+        self.written = 0  # 本次写入的记录数
+    
+    def load(self, kind: str) -> Dict[str, object]:
+        """载入某类（如 "upstream"、"process"）未过期的全部记录：item_id -> 值"""
+        query = """
+            SELECT item_id, payload FROM entries
+            WHERE database = ? AND version = ? AND mode = ? AND category = ? AND kind = ?
+        """
+        params = [*self.partition, kind]
+        if self.ttl:
+            query += " AND fetched_at >= ?"
+            params.append(time.time() - self.ttl)
+        items = {}
+        for item_id, payload in self.conn.execute(query, params):
+            try:
+                items[item_id] = json.loads(payload)
+            except (ValueError, TypeError):
+                continue  # 无法解析的记录视为未缓存，写回时覆盖
+        self.stored.setdefault(kind, set()).update(items)
+        return items
+    
+    def save(self, kind: str, items: Dict[str, object]) -> int:
+        """写回缓存中还没有的记录（同一事务），返回写入条数"""
+        stored = self.stored.setdefault(kind, set())
+        fetched_at = time.time()
+        rows = [(*self.partition, kind, item_id, json.dumps(value, default=_json_default), fetched_at)
+                for item_id, value in items.items() if item_id not in stored]
+        if rows:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            stored.update(row[5] for row in rows)
+            self.written += len(rows)
+        return len(rows)
+    
+    def close(self):
+        """关闭缓存文件"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def clear(version: Optional[str] = None, mode: Optional[str] = None, path: Optional[str] = None) -> int:
+    """删除缓存记录（可按版本 / 模式过滤），返回删除条数"""
+    conditions, params = [], []
+    if version:
+        conditions.append("version = ?")
+        params.append(version)
+    if mode:
+        conditions.append("mode = ?")
+        params.append(mode)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = _connect(path)
+    try:
+        with conn:
+            deleted = conn.execute(f"DELETE FROM entries{where}", params).rowcount
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return deleted
+
+
+def purge_expired(ttl: Optional[float] = None, path: Optional[str] = None) -> int:
+    """删除已过期的记录，返回删除条数"""
+    ttl = config.DISK_CACHE_TTL if ttl is None else ttl
+    if not ttl:
+        return 0
+    conn = _connect(path)
+    try:
+        with conn:
+            return conn.execute("DELETE FROM entries WHERE fetched_at < ?", (time.time() - ttl,)).rowcount
+    finally:
+        conn.close()
+
+
+def stats(path: Optional[str] = None) -> List[Tuple]:
+    """各分区、各类记录的条数和写入时间范围：(database, version, mode, category, kind, 条数, 最早, 最晚)"""
+    conn = _connect(path)
+    try:
+        return conn.execute("""
+            SELECT database, version, mode, category, kind, COUNT(*), MIN(fetched_at), MAX(fetched_at)
+            FROM entries
+            GROUP BY database, version, mode, category, kind
+            ORDER BY database, version, mode, category, kind
+        """).fetchall()
+    finally:
+        conn.close()
+
+
+def main():
+    """主函数：查看统计（默认）、--clear [--version V] [--mode M] 清除缓存、--purge 删除过期记录"""
+    version = sys.argv[sys.argv.index("--version") + 1] if "--version" in sys.argv else None
+    mode = sys.argv[sys.argv.index("--mode") + 1] if "--mode" in sys.argv else None
+    
+    print(f"磁盘缓存: {cache_path()}")
+    if "--clear" in sys.argv:
+        deleted = clear(version, mode)
+        scope = ", ".join(f"{name}={value}" for name, value in (("version", version), ("mode", mode)) if value)
+        print(f"✓ 已清除 {deleted} 条记录" + (f" ({scope})" if scope else ""))
+        return
+    if "--purge" in sys.argv:
+        print(f"✓ 已删除 {purge_expired()} 条过期记录（TTL {config.DISK_CACHE_TTL} 秒）")
+        return
+    
+    rows = stats()
+    if not rows:
+        print("（缓存为空）")
+        return
+    now = time.time()
+    for database, version, mode, category, kind, count, oldest, newest in rows:
+        expired = config.DISK_CACHE_TTL and now - oldest > config.DISK_CACHE_TTL
+        print(f"  {database} v{version} [{mode}{'/' + category if category else ''}] {kind}: {count} 条, "
+              f"{datetime.fromtimestamp(oldest):%Y-%m-%d %H:%M} ~ {datetime.fromtimestamp(newest):%Y-%m-%d %H:%M}"
+              f"{'（含过期记录）' if expired else ''}")
+
+
+if __name__ == "__main__":
+    main()
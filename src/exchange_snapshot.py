@@ -0,0 +1,189 @@
+"""
+Exchange Graph Snapshot - 内存中的 exchange 图快照
+
+按 VERSION 一次性批量读取 tb_exchanges 中所有未删除、有 provider 的 input exchange，
+在内存中建立 process_id -> 上游 exchanges 的邻接索引。
+
+ProcessTreeBuilder 和 MainChainBuilder 加载快照后，遍历过程中不再逐节点查询数据库，
+批量分析（如 batch_main_chain.py）从受网络延迟限制变为仅受 CPU 限制。
+"""
+
+from typing import Dict, List, Optional, Iterable
+from datetime import datetime
+import config
+
+
+# 快照包含的列（顺序即 COPY 输出的列顺序）
+SNAPSHOT_COLUMNS = [
+    "id",
+    "process_id",
+    "provider_id",
+    "flow_id",
+    "value",
+    "unit_id",
+    "gwp",
+    "gwp_contribution",
+]
+
+# 数值列（读取时转换为 float）
+_FLOAT_COLUMNS = {"value", "gwp", "gwp_contribution"}
+
+# 已加载的快照：(database, schema, table, version, compact) -> ExchangeSnapshot
+_SNAPSHOTS: Dict[tuple, 'ExchangeSnapshot'] = {}
+
+
+class _CopyRowWriter:
+    """
+    接收 COPY ... TO STDOUT 的数据块，按行解析为记录（流式，不缓存整个结果）
+    
+    使用 PostgreSQL text 格式：列以制表符分隔，NULL 为 \\N
+    """
+    
+    def __init__(self, on_row):
+        self.on_row = on_row
+        self.buffer = ""
+    
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            if line:
+                self.on_row([None if v == '\\N' else v for v in line.split('\t')])
+    
+    def flush(self):
+        if self.buffer:
+            self.write('\n')
+
+
+class ExchangeSnapshot:
+    """某个版本 exchange 图的内存快照（邻接索引）"""
+    
+    def __init__(self, version: str = None):
+        self.version = version or config.VERSION
+        self.adjacency: Dict[str, List[Dict]] = {}  # process_id -> 上游 exchanges（按 flow_id 排序）
+        self.edge_count = 0
+        self.loaded_at: Optional[datetime] = None
+    
+    def add_row(self, values: List):
+        """添加一条 exchange 记录（values 顺序与 SNAPSHOT_COLUMNS 一致）"""
+        row = dict(zip(SNAPSHOT_COLUMNS, values))
+        for column in _FLOAT_COLUMNS:
+            if row[column] is not None:
+                row[column] = float(row[column])
+        self.adjacency.setdefault(row['process_id'], []).append(row)
+        self.edge_count += 1
+    
+    def finalize(self):
+        """加载完成后按 flow_id 排序，与逐节点查询的 ORDER BY flow_id 保持一致"""
+        for exchanges in self.adjacency.values():
+            exchanges.sort(key=lambda row: row['flow_id'] or '')
+        self.loaded_at = datetime.now()
+    
+    def load(self, conn, schema: str, table: str, use_copy: bool = True):
+        """
+        从数据库一次性读取快照
+        
+        Args:
+            conn: psycopg2 连接
+            schema: exchanges 表所在 schema
+            table: exchanges 表名
+            use_copy: 是否使用 COPY 流式读取（否则使用服务端游标分批读取）
+        """
+        query = f"""
+            SELECT {', '.join(SNAPSHOT_COLUMNS)}
+            FROM {schema}.{table}
+            WHERE is_input = true
+              AND provider_id IS NOT NULL
+              AND is_deleted = false
+              AND version = %s
+        """
+        
+        start_time = datetime.now()
+        cursor = conn.cursor()
+        try:
+            if use_copy:
+                # COPY 不支持参数绑定，先用 mogrify 安全地内联参数
+                select_sql = cursor.mogrify(query, (self.version,)).decode('utf-8')
+                writer = _CopyRowWriter(self.add_row)
+                cursor.copy_expert(f"COPY ({select_sql}) TO STDOUT", writer)
+                writer.flush()
+            else:
+                cursor.close()
+                cursor = conn.cursor(name="exchange_snapshot")
+                cursor.itersize = 20000
+                cursor.execute(query, (self.version,))
+                for values in cursor:
+                    self.add_row(list(values))
+        finally:
+            cursor.close()
+        
+        self.finalize()
+        duration = (datetime.now() - start_time).total_seconds()
+        print(f"✓ 快照已加载: {schema}.{table} (version={self.version}), "
+              f"{len(self)} 个 process, {self.edge_count} 条 exchange, 耗时 {duration:.2f} 秒")
+        return self
+    
+    def __contains__(self, process_id: str) -> bool:
+        return process_id in self.adjacency
+    
+    def __len__(self) -> int:
+        return len(self.adjacency)
+    
+    def processes(self) -> Iterable[str]:
+        """所有有上游 exchange 的 process ID"""
+        return iter(self.adjacency)
+    
+    def upstream_exchanges(self, process_id: str) -> List[Dict]:
+        """获取 process 的所有上游 input exchanges（按 flow_id 排序）"""
+        return self.adjacency.get(process_id, [])
+    
+    def max_value_exchange(self, process_id: str,
+                           allowed_ids: Optional[Iterable[str]] = None) -> Optional[Dict]:
+        """
+        获取 process 的 value 最大的上游 input exchange
+        
+        与 ORDER BY value DESC NULLS LAST LIMIT 1 等价，忽略 provider_id 为空字符串的记录。
+        
+        Args:
+            process_id: process ID
+            allowed_ids: 可选，只在这些 exchange ID 中选择（建设模式的 category 过滤）
+        """
+        best = None
+        for row in self.adjacency.get(process_id, []):
+            if not row['provider_id']:
+                continue
+            if allowed_ids is not None and row['id'] not in allowed_ids:
+                continue
+            if best is None:
+                best = row
+            elif row['value'] is not None and (best['value'] is None or row['value'] > best['value']):
+                best = row
+        return best
+
+
+def get_snapshot(conn, database: str, schema: str, table: str,
+                 version: str = None, use_copy: bool = True, reload: bool = False,
+                 compact: Optional[bool] = None) -> ExchangeSnapshot:
+    """
+    获取（必要时加载）指定数据库/版本的快照
+    
+    同一进程内对同一 (database, schema, table, version) 只加载一次，供多个构建器复用。
+    
+    Args:
+        compact: 是否使用数组存储的 CompactGraph（默认使用 config.COMPACT_SNAPSHOT）
+    """
+    version = version or config.VERSION
+    if compact is None:
+        compact = config.COMPACT_SNAPSHOT
+    key = (database, schema, table, version, compact)
+    if reload or key not in _SNAPSHOTS:
+        print(f"加载 exchange 快照: {database}.{schema}.{table} (version={version})...")
+        if compact:
+            from compact_graph import CompactGraph
+            snapshot = CompactGraph(version)
+        else:
+            snapshot = ExchangeSnapshot(version)
+        _SNAPSHOTS[key] = snapshot.load(conn, schema, table, use_copy=use_copy)
+    return _SNAPSHOTS[key]
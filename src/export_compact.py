@@ -8,7 +8,8 @@
 4. 文件大小大幅减小
 """
 
-from build_process_tree import ProcessTreeBuilder, ProcessTreeNode, OUTPUT_DIR
+from build_process_tree import (ProcessTreeBuilder, ProcessTreeNode, OUTPUT_DIR, apply_cutoff_args,
+                                iter_tree, RenderedPath, LineWriter, open_output)
 import config
 import os
 from typing import List
@@ -31,73 +32,90 @@ class CompactExporter:
             mode: "skeleton" 或 "full_lci"
             include_names: 是否包含名称（默认包含）
         """
-        lines = []
-        
-        # 详细的标题说明
-        lines.append("=" * 80)
-        lines.append(f"UPR Process Tree - {mode.upper()} MODE")
-        lines.append("=" * 80)
-        lines.append("")
-        lines.append("## Basic Information")
-        lines.append(f"Root Product Flow: {config.ROOT_FLOW_ID}")
-        root_flow_name = self.builder.get_flow_name(config.ROOT_FLOW_ID)
-        lines.append(f"  Name: {root_flow_name}")
-        lines.append("")
-        lines.append(f"Root Process: {config.ROOT_PROCESS_ID}")
-        root_process_name = self.builder.get_process_name(config.ROOT_PROCESS_ID)
-        lines.append(f"  Name: {root_process_name}")
-        lines.append("")
-        lines.append(f"Version: {config.VERSION}")
-        lines.append(f"Generated: {self._get_timestamp()}")
-        lines.append("")
-        
-        # 格式说明
-        lines.append("## Format Description")
-        if mode == "skeleton":
-            lines.append("Mode: SKELETON TREE (Single Edge)")
-            lines.append("  - Each upstream → downstream relationship shows ONE representative flow")
-            lines.append("  - Format: process_id | process_name << flow_id | flow_name")
-            lines.append("  - Indentation indicates hierarchy level")
-        else:
-            lines.append("Mode: FULL LCI TREE (Multiple Edges)")
-            lines.append("  - Each upstream → downstream relationship shows ALL flows")
-            lines.append("  - Format:")
-            lines.append("      process_id | process_name")
-            lines.append("        << flow_id_1 | flow_name_1")
-            lines.append("        << flow_id_2 | flow_name_2")
-            lines.append("  - Indentation indicates hierarchy level")
-        lines.append("")
-        lines.append("Notation:")
-        lines.append("  | separates ID and name")
-        lines.append("  << indicates flow connection (upstream provides this flow)")
-        lines.append("  [CYCLE] marks detected circular dependency")
-        lines.append("")
-        lines.append("=" * 80)
-        lines.append("")
-        
-        # 递归生成树
-        self._write_compact_node(root, lines, level=0, mode=mode, include_names=include_names)
-        
-        # 统计信息
-        lines.append("")
-        lines.append("=" * 80)
-        lines.append("## Statistics")
-        lines.append("=" * 80)
-        lines.append(f"Total Processes: {len(self.builder.visited)}")
-        lines.append(f"Max Depth: {self._get_max_depth(root)}")
-        
-        if mode == "full_lci" and self.builder.full_lci_edges:
-            total_flows = sum(len(flows) for flows in self.builder.full_lci_edges.values())
-            total_edges = len(self.builder.full_lci_edges)
-            lines.append(f"Total Edges: {total_edges}")
-            lines.append(f"Total Flows: {total_flows}")
-            lines.append(f"Avg Flows per Edge: {total_flows/total_edges:.2f}")
-        
-        lines.append("=" * 80)
+        # 渲染前批量解析名称
+        if include_names:
+            self.builder.prefetch_names(root)
         
-        # 写入文件
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        # 逐行写入带缓冲的文件，不在内存中累积整个输出
+        with open_output(output_file) as f:
+            lines = LineWriter(f)
+            
+            # 详细的标题说明
+            lines.append("=" * 80)
+            lines.append(f"UPR Process Tree - {mode.upper()} MODE")
+            lines.append("=" * 80)
+            lines.append("")
+            lines.append("## Basic Information")
+            lines.append(f"Root Product Flow: {config.ROOT_FLOW_ID}")
+            root_flow_name = self.builder.get_flow_name(config.ROOT_FLOW_ID)
+            lines.append(f"  Name: {root_flow_name}")
+            lines.append("")
+            lines.append(f"Root Process: {config.ROOT_PROCESS_ID}")
+            root_process_name = self.builder.get_process_name(config.ROOT_PROCESS_ID)
+            lines.append(f"  Name: {root_process_name}")
+            lines.append("")
+            lines.append(f"Version: {config.VERSION}")
+            lines.append(f"Generated: {self._get_timestamp()}")
+            lines.append("")
+            
+            # 格式说明
+            lines.append("## Format Description")
+            if mode == "skeleton":
+                lines.append("Mode: SKELETON TREE (Single Edge)")
+                lines.append("  - Each upstream → downstream relationship shows ONE representative flow")
+                lines.append("  - Format: process_id | process_name << flow_id | flow_name")
+                lines.append("  - Indentation indicates hierarchy level")
+            else:
+                lines.append("Mode: FULL LCI TREE (Multiple Edges)")
+                lines.append("  - Each upstream → downstream relationship shows ALL flows")
+                lines.append("  - Format:")
+                lines.append("      process_id | process_name")
+                lines.append("        << flow_id_1 | flow_name_1")
+                lines.append("        << flow_id_2 | flow_name_2")
+                lines.append("  - Indentation indicates hierarchy level")
+            lines.append("")
+            lines.append("Notation:")
+            lines.append("  | separates ID and name")
+            lines.append("  << indicates flow connection (upstream provides this flow)")
+            lines.append("  [CYCLE] marks detected circular dependency")
+            if self.builder.expand_shared:
+                lines.append("  [CYCLE (canonical)] marks a back edge where a repeated shared subtree was first expanded "
+                             "(not an ancestor at this position)")
+            if self.builder.expand_shared:
+                lines.append("  [SHARED] marks an upstream subtree shared with another branch (repeated in full)")
+            else:
+                lines.append("  [SHARED] marks an upstream subtree shared with another branch (expanded at first occurrence)")
+            if self.builder.condense_cycles:
+                lines.append("  [SCC n] marks a condensed cycle of n processes; its children are the edges leaving the cycle")
+            if self.builder.budget_exhausted:
+                lines.append("  [FRONTIER] marks an unexpanded node (partial tree: the build stopped at its budget)")
+            lines.append("")
+            lines.append("=" * 80)
+            lines.append("")
+            
+            # 递归生成树
+            self._write_compact_node(root, lines, level=0, mode=mode, include_names=include_names)
+            
+            # 统计信息
+            lines.append("")
+            lines.append("=" * 80)
+            lines.append("## Statistics")
+            lines.append("=" * 80)
+            lines.append(f"Total Processes: {len(self.builder.visited)}")
+            lines.append(f"Max Depth: {self._get_max_depth(root)}")
+            if self.builder.cutoff:
+                lines.append(f"Cutoff: {self.builder.cutoff_summary()}")
+            if self.builder.budget_exhausted:
+                lines.append(f"Partial Tree: {self.builder.frontier_summary()}")
+            
+            if mode == "full_lci" and self.builder.full_lci_edges:
+                total_flows = sum(len(flows) for flows in self.builder.full_lci_edges.values())
+                total_edges = len(self.builder.full_lci_edges)
+                lines.append(f"Total Edges: {total_edges}")
+                lines.append(f"Total Flows: {total_flows}")
+                lines.append(f"Avg Flows per Edge: {total_flows/total_edges:.2f}")
+            
+            lines.append("=" * 80)
         
         print(f"✓ 紧凑格式已生成: {output_file}")
         
@@ -113,21 +131,13 @@ class CompactExporter:
         return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     def _get_max_depth(self, node: ProcessTreeNode, current_depth: int = 0) -> int:
-        """计算树的最大深度"""
-        if not node.children:
-            return current_depth
-        
-        max_child_depth = current_depth
-        for child in node.children:
-            child_depth = self._get_max_depth(child, current_depth + 1)
-            max_child_depth = max(max_child_depth, child_depth)
-        
-        return max_child_depth
+        """计算树的最大深度（共享子树按 DAG 最长路径计算）"""
+        return self.builder._get_max_depth(node, current_depth)
     
     def _write_compact_node(self, node: ProcessTreeNode, lines: List[str], level: int = 0,
                            mode: str = "skeleton", include_names: bool = True):
         """
-        写入紧凑格式的节点（优化版）
+        写入紧凑格式的节点及其子树（消费 iter_tree 的先序事件）
         
         格式：
         - Skeleton: {indent}process_id | process_name << flow_id | flow_name
@@ -135,61 +145,60 @@ class CompactExporter:
                     {indent}  << flow_id_1 | flow_name_1
                     {indent}  << flow_id_2 | flow_name_2
         """
-        indent = "  " * level
-        process_id = node.process_id
-        
-        # 获取名称
-        if include_names:
-            process_name = self.builder.get_process_name(process_id)
-        else:
-            process_name = ""
-        
-        if mode == "skeleton":
-            # Skeleton 模式：一行显示
-            if node.flow_id:
-                if include_names:
-                    flow_name = self.builder.get_flow_name(node.flow_id)
-                    line = f"{indent}{process_id} | {process_name} << {node.flow_id} | {flow_name}"
+        base_level = level
+        path = RenderedPath(self.builder.expand_shared)
+        for depth, node, flow_ids, _ in iter_tree(node, self.builder.expand_shared):
+            level = base_level + depth
+            
+            indent = "  " * level
+            process_id = node.process_id
+            canonical_cycle = path.canonical_cycle(depth, node)
+            marker = f" [SCC {len(node.members)}]" if node.members else ""
+            if node.is_cycle:
+                marker += " [CYCLE (canonical)]" if canonical_cycle else " [CYCLE]"
+            else:
+                marker += " [SHARED]" if node.shared else ""
+            marker += " [FRONTIER]" if node.frontier else ""
+            
+            # 获取名称
+            if include_names:
+                process_name = self.builder.get_process_name(process_id)
+            else:
+                process_name = ""
+            
+            if mode == "skeleton":
+                # Skeleton 模式：一行显示
+                if node.flow_id:
+                    if include_names:
+                        flow_name = self.builder.get_flow_name(node.flow_id)
+                        line = f"{indent}{process_id} | {process_name} << {node.flow_id} | {flow_name}"
+                    else:
+                        line = f"{indent}{process_id} << {node.flow_id}"
                 else:
-                    line = f"{indent}{process_id} << {node.flow_id}"
+                    # 根节点
+                    if include_names:
+                        line = f"{indent}{process_id} | {process_name}"
+                    else:
+                        line = f"{indent}{process_id}"
+                
+                lines.append(line + marker)
+            
             else:
-                # 根节点
+                # Full LCI 模式：process 一行，每个 flow 单独一行
                 if include_names:
                     line = f"{indent}{process_id} | {process_name}"
                 else:
                     line = f"{indent}{process_id}"
-            
-            lines.append(line)
-        
-        else:
-            # Full LCI 模式：process 一行，每个 flow 单独一行
-            if include_names:
-                line = f"{indent}{process_id} | {process_name}"
-            else:
-                line = f"{indent}{process_id}"
-            lines.append(line)
-            
-            # 显示所有 flow
-            if node.flows:
-                for flow_id in node.flows:
+                lines.append(line + marker)
+                
+                # 显示所有 flow（只有单条 flow 时即 flow_id）
+                for flow_id in flow_ids:
                     if include_names:
                         flow_name = self.builder.get_flow_name(flow_id)
                         flow_line = f"{indent}  << {flow_id} | {flow_name}"
                     else:
                         flow_line = f"{indent}  << {flow_id}"
                     lines.append(flow_line)
-            elif node.flow_id:
-                # 兼容只有单条 flow 的情况
-                if include_names:
-                    flow_name = self.builder.get_flow_name(node.flow_id)
-                    flow_line = f"{indent}  << {node.flow_id} | {flow_name}"
-                else:
-                    flow_line = f"{indent}  << {node.flow_id}"
-                lines.append(flow_line)
-        
-        # 递归处理子节点
-        for child in node.children:
-            self._write_compact_node(child, lines, level + 1, mode, include_names)
 
 
 def main():
@@ -207,6 +216,11 @@ def main():
     id_only = "--id-only" in sys.argv  # 仅 ID 模式（超紧凑）
     
     builder = ProcessTreeBuilder()
+    builder.expand_shared = builder.expand_shared or "--expand-shared" in sys.argv
+    builder.condense_cycles = builder.condense_cycles or "--condense" in sys.argv
+    builder.use_disk_cache = builder.use_disk_cache or "--disk-cache" in sys.argv
+    builder.use_offline_store = builder.use_offline_store or "--offline" in sys.argv
+    apply_cutoff_args(builder, sys.argv)
     exporter = CompactExporter(builder)
     
     try:
@@ -219,7 +233,7 @@ def main():
             print()
             
             # Skeleton
-            builder.visited.clear()
+            builder.reset_tree()
             root_skeleton = builder.build_tree_recursive(config.ROOT_PROCESS_ID, full_lci_mode=False)
             skeleton_file = os.path.join(OUTPUT_DIR, f"process_tree_skeleton_compact_{flow_short}.txt")
             exporter.export_compact(root_skeleton, skeleton_file, mode="skeleton", 
@@ -230,8 +244,7 @@ def main():
             print("模式 2/2: 生成 Full LCI Tree (紧凑格式)")
             print()
             
-            builder.visited.clear()
-            builder.full_lci_edges.clear()
+            builder.reset_tree()
             root_full = builder.build_tree_recursive(config.ROOT_PROCESS_ID, full_lci_mode=True)
             full_file = os.path.join(OUTPUT_DIR, f"process_tree_full_lci_compact_{flow_short}.txt")
             exporter.export_compact(root_full, full_file, mode="full_lci", 
@@ -244,7 +257,7 @@ def main():
             print(f"\n生成文件:")
             print(f"  1. Skeleton: {skeleton_file}")
             print(f"  2. Full LCI: {full_file}")
-            
+        
         else:
             # 只生成 Skeleton
             print("生成 Skeleton Tree (紧凑格式)")
@@ -266,7 +279,7 @@ def main():
         else:
             print("\n提示: 包含了名称信息（推荐，易于理解）")
             print("      使用 --no-names 或 --id-only 可去除名称")
-        
+    
     except Exception as e:
         print(f"\n✗ 执行失败: {e}")
         import traceback
@@ -6,7 +6,12 @@ Export Process Tree to JSON format
 
 import json
 from typing import Dict, Any
-from build_process_tree import ProcessTreeBuilder, ProcessTreeNode
+from build_process_tree import ProcessTreeBuilder, ProcessTreeNode, RenderedPath, iter_tree, open_output
+
+
+def _nested_json(value: Any, indent_level: int) -> str:
+    """按 json.dump(indent=2) 的格式序列化嵌套在 indent_level 层的值"""
+    return json.dumps(value, indent=2, ensure_ascii=False).replace('\n', '\n' + '  ' * indent_level)
 
 
 class JSONExporter:
@@ -15,9 +20,45 @@ class JSONExporter:
     def __init__(self, builder: ProcessTreeBuilder):
         self.builder = builder
     
+    def _node_fields(self, node: ProcessTreeNode, level: int, canonical_cycle: bool = False) -> Dict[str, Any]:
+        """节点自身的字段（不含 children / children_count），键顺序即输出顺序（canonical_cycle 见 RenderedPath）"""
+        result = {
+            "process_id": node.process_id,
+            "process_name": self.builder.get_process_name(node.process_id),
+            "level": level,
+        }
+        
+        if node.flow_id:
+            result["flow_id"] = node.flow_id
+            result["flow_name"] = self.builder.get_flow_name(node.flow_id)
+        
+        if node.shared:
+            result["shared"] = True
+        if node.is_cycle:
+            result["cycle"] = True
+            if canonical_cycle:
+                result["cycle_canonical"] = True
+        if node.members:
+            result["cycle_members"] = list(node.members)
+        if node.frontier:
+            result["frontier"] = True
+        return result
+    
+    def _child_count(self, node: ProcessTreeNode) -> int:
+        """输出中的子节点数（未展开的共享子树引用为 0）"""
+        if node.shared and not self.builder.expand_shared:
+            return 0
+        return len(node.children)
+    
     def node_to_dict(self, node: ProcessTreeNode) -> Dict[str, Any]:
         """
-        将树节点转换为字典
+        将树节点（及其子树）转换为字典
+        
+        消费 iter_tree 的先序事件，深层树不会触发 RecursionError。
+        共享子树标记 "shared": true，默认只在首次出现处展开（builder.expand_shared 为 True 时
+        在每个引用处展开）；回边标记 "cycle": true（重复展开处不是当前路径祖先的另加 "cycle_canonical": true）；
+        压缩的循环节点带 "cycle_members"；anytime 构建未展开的节点标记 "frontier": true。
+        level 为节点在输出树中的实际层级。
         
         Args:
             node: ProcessTreeNode 对象
@@ -25,26 +66,67 @@ class JSONExporter:
         Returns:
             字典表示的树节点
         """
-        result = {
-            "process_id": node.process_id,
-            "process_name": self.builder.get_process_name(node.process_id),
-            "level": node.level,
-        }
-        
-        if node.flow_id:
-            result["flow_id"] = node.flow_id
-            result["flow_name"] = self.builder.get_flow_name(node.flow_id)
+        path: list = []  # path[d]: 当前路径上深度 d 的节点字典
+        rendered = RenderedPath(self.builder.expand_shared)
         
-        if node.children:
-            result["children"] = [
-                self.node_to_dict(child) for child in node.children
-            ]
-            result["children_count"] = len(node.children)
-        else:
+        for depth, current, _, _ in iter_tree(node, self.builder.expand_shared):
+            result = self._node_fields(current, node.level + depth, rendered.canonical_cycle(depth, current))
             result["children"] = []
-            result["children_count"] = 0
+            result["children_count"] = self._child_count(current)
+            
+            del path[depth:]
+            if path:
+                path[-1]["children"].append(result)
+            path.append(result)
+        
+        return path[0]
+    
+    def write_tree(self, f, node: ProcessTreeNode, indent_level: int = 0):
+        """
+        流式写入节点及其子树的 JSON，输出与 json.dump(node_to_dict(node), indent=2) 完全相同
         
-        return result
+        不构建字典树：每个节点的字段写出后立即丢弃，只保留当前路径上未闭合节点的计数。
+        
+        Args:
+            f: 输出文件句柄
+            node: 根节点
+            indent_level: 根节点所在的缩进层级（嵌套在外层对象中时为 1）
+        """
+        # 栈元素: [已写入的子节点数, 子节点总数, 节点的缩进层级]
+        open_nodes = []
+        
+        def close(entry):
+            _, child_count, level = entry
+            pad = '  ' * (level + 1)
+            f.write(f"\n{pad}],\n{pad}\"children_count\": {child_count}\n{'  ' * level}}}")
+        
+        rendered = RenderedPath(self.builder.expand_shared)
+        for depth, current, _, _ in iter_tree(node, self.builder.expand_shared):
+            while len(open_nodes) > depth:
+                close(open_nodes.pop())
+            
+            level = indent_level + 2 * depth
+            if open_nodes:
+                parent = open_nodes[-1]
+                f.write(",\n" if parent[0] else "\n")
+                f.write('  ' * level)
+                parent[0] += 1
+            
+            pad = '  ' * (level + 1)
+            fields = self._node_fields(current, node.level + depth, rendered.canonical_cycle(depth, current))
+            f.write("{")
+            f.write(",".join(f"\n{pad}{json.dumps(key)}: {_nested_json(value, level + 1)}"
+                             for key, value in fields.items()))
+            
+            child_count = self._child_count(current)
+            if child_count:
+                f.write(f",\n{pad}\"children\": [")
+                open_nodes.append([0, child_count, level])
+            else:
+                f.write(f",\n{pad}\"children\": [],\n{pad}\"children_count\": 0\n{'  ' * level}}}")
+        
+        while open_nodes:
+            close(open_nodes.pop())
     
     def export(self, root: ProcessTreeNode, output_file: str = "process_tree.json"):
         """
@@ -54,42 +136,53 @@ class JSONExporter:
             root: 根节点
             output_file: 输出文件名
         """
-        tree_dict = self.node_to_dict(root)
-        
-        # 添加元数据
-        output_data = {
-            "metadata": {
-                "version": "1.4.0",
-                "total_processes": len(self.builder.visited),
-                "max_depth": self._get_max_depth(root)
-            },
-            "tree": tree_dict
+        # 渲染前批量解析名称
+        self.builder.prefetch_names(root)
+        
+        # 元数据
+        metadata = {
+            "version": "1.4.0",
+            "total_processes": len(self.builder.visited),
+            "max_depth": self._get_max_depth(root)
         }
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
+        if self.builder.cutoff:
+            metadata["cutoff"] = {
+                "threshold": self.builder.cutoff,
+                "by": self.builder.cutoff_by,
+                "pruned_branches": self.builder.cut_branches,
+                "cut_scale_sum": self.builder.cut_scale_sum
+            }
+        
+        if self.builder.budget_exhausted:
+            metadata["partial"] = {
+                "budget": self.builder.budget_exhausted,
+                "frontier_nodes": self.builder.frontier_count
+            }
+        
+        # 流式写入 {"metadata": ..., "tree": ...}，不在内存中构建整棵树的字典
+        with open_output(output_file) as f:
+            f.write(f'{{\n  "metadata": {_nested_json(metadata, 1)},\n  "tree": ')
+            self.write_tree(f, root, indent_level=1)
+            f.write('\n}')
         
         print(f"✓ JSON 文件已生成: {output_file}")
     
     def _get_max_depth(self, node: ProcessTreeNode, current_depth: int = 0) -> int:
-        """计算树的最大深度"""
-        if not node.children:
-            return current_depth
-        
-        max_child_depth = current_depth
-        for child in node.children:
-            child_depth = self._get_max_depth(child, current_depth + 1)
-            max_child_depth = max(max_child_depth, child_depth)
-        
-        return max_child_depth
+        """计算树的最大深度（共享子树按 DAG 最长路径计算）"""
+        return self.builder._get_max_depth(node, current_depth)
 
 
 def main():
     """主函数：同时生成 Markdown 和 JSON"""
-    from build_process_tree import ProcessTreeBuilder
+    import sys
+    from build_process_tree import ProcessTreeBuilder, apply_cutoff_args
     import config
     
     builder = ProcessTreeBuilder()
+    builder.use_disk_cache = builder.use_disk_cache or "--disk-cache" in sys.argv
+    builder.use_offline_store = builder.use_offline_store or "--offline" in sys.argv
+    apply_cutoff_args(builder, sys.argv)
     
     try:
         print("=" * 60)
@@ -121,7 +214,7 @@ def main():
         print("\n" + "=" * 60)
         print("✓ 完成！")
         print("=" * 60)
-        
+    
     except Exception as e:
         print(f"\n✗ 执行失败: {e}")
         import traceback
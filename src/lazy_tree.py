@@ -0,0 +1,204 @@
+"""
+Lazy Process Tree - 按需展开的过程树
+
+ProcessTreeBuilder 要遍历完整个上游闭包才能输出任何内容。LazyProcessNode 的 children
+在首次访问时才查询并缓存，适合交互式浏览（浏览器视图、notebook）：
+
+    - 首次访问某个节点的 children 时，同一父节点下尚未查询的兄弟节点一起批量查询
+      （一次 ANY 查询），之后逐个展开兄弟节点不再访问数据库
+    - expand(depth) 按层批量展开到指定深度：每层一次批量查询
+    - 节点属性与 ProcessTreeNode 相同（process_id / flow_id / flows / level / children / is_cycle ...），
+      同一 process 出现在多个位置时各自展开（共用 exchange 缓存），指向路径上祖先的边标记为 is_cycle
+
+上游 exchanges 写入构建器的 exchange_cache；构建器已加载快照时不查询数据库。
+"""
+
+import sys
+from typing import Iterator, List, Optional
+from datetime import datetime
+import config
+from build_process_tree import ProcessTreeBuilder, apply_cutoff_args
+
+
+class LazyProcessNode:
+    """按需展开的过程树节点（children 首次访问时加载）"""
+    
+    __slots__ = ('process_id', 'flow_id', 'flows', 'level', 'scale', 'parent', 'is_cycle',
+                 '_tree', '_children')
+    
+    # 与 ProcessTreeNode 保持相同的属性：按需展开的树不共享子树，也不压缩循环
+    shared = False
+    members = None
+    
+    def __init__(self, tree: 'LazyProcessTree', process_id: str, flow_id: Optional[str] = None,
+                 level: int = 0, parent: Optional['LazyProcessNode'] = None, scale: float = 1.0):
+        self.process_id = process_id
+        self.flow_id = flow_id
+        self.flows: List[str] = []  # Full LCI 模式：所有 flow_id
+        self.level = level
+        self.scale = scale  # 分支累计比例（用于 cutoff 剪枝）
+        self.parent = parent
+        self.is_cycle = False  # 回边：process 已出现在通往根节点的路径上
+        self._tree = tree
+        self._children: Optional[List['LazyProcessNode']] = None  # None 表示尚未加载
+    
+    @property
+    def loaded(self) -> bool:
+        """children 是否已加载"""
+        return self._children is not None
+    
+    @property
+    def frontier(self) -> bool:
+        """尚未展开的节点"""
+        return self._children is None
+    
+    @property
+    def children(self) -> List['LazyProcessNode']:
+        """子节点（首次访问时连同兄弟节点一起批量查询）"""
+        if self._children is None:
+            self._tree.load(self)
+        return self._children
+    
+    def expand(self, depth: int = 1) -> 'LazyProcessNode':
+        """按层批量展开以该节点为根的 depth 层子树"""
+        self._tree.expand(self, depth)
+        return self
+    
+    def has_ancestor(self, process_id: str) -> bool:
+        """process 是否为该节点自身或其祖先"""
+        node = self
+        while node is not None:
+            if node.process_id == process_id:
+                return True
+            node = node.parent
+        return False
+
+
+class LazyProcessTree:
+    """以指定 process 为根、按需展开的过程树"""
+    
+    def __init__(self, builder: ProcessTreeBuilder, process_id: str, flow_id: Optional[str] = None,
+                 full_lci_mode: bool = False):
+        """
+        Args:
+            builder: 已连接数据库（或已加载快照）的 ProcessTreeBuilder，提供查询和 exchange 缓存
+            process_id: 根 process ID
+            flow_id: 根节点的 flow（可选）
+            full_lci_mode: 是否为 Full LCI 模式（每个 provider 一个子节点，收集所有 flow）
+        """
+        self.builder = builder
+        self.full_lci_mode = full_lci_mode
+        self.prefetch_siblings = True  # 加载节点时是否一起查询尚未加载的兄弟节点
+        self.loaded_count = 0  # 已加载 children 的节点数
+        self.root = LazyProcessNode(self, process_id, flow_id)
+    
+    def _fetch(self, nodes: List[LazyProcessNode]):
+        """批量查询这些节点中尚未缓存的 process（ANY 查询，按 batch_size 分块）"""
+        exchange_cache = self.builder.exchange_cache
+        pending = list(dict.fromkeys(node.process_id for node in nodes
+                                     if node.process_id not in exchange_cache))
+        if pending:
+            self.builder.get_upstream_exchanges_batch(pending)
+    
+    def _materialize(self, node: LazyProcessNode):
+        """由已缓存的上游 exchanges 创建节点的 children"""
+        exchanges = self.builder.get_upstream_exchanges(node.process_id)
+        children = []
+        for provider_id, flow_id, flow_ids, scale in self.builder._upstream_children(
+                node.process_id, exchanges, self.full_lci_mode, node.scale):
+            child = LazyProcessNode(self, provider_id, flow_id, node.level + 1, node, scale)
+            if flow_ids:
+                child.flows = [fid for fid in dict.fromkeys(flow_ids) if fid]
+            if node.has_ancestor(provider_id):
+                child.is_cycle = True
+                child._children = []
+            children.append(child)
+        node._children = children
+        self.loaded_count += 1
+    
+    def load(self, node: LazyProcessNode):
+        """加载节点的 children；兄弟节点中尚未查询的 process 一起批量查询"""
+        if node.loaded:
+            return
+        if self.prefetch_siblings and node.parent is not None:
+            self._fetch([sibling for sibling in node.parent._children if not sibling.loaded])
+        else:
+            self._fetch([node])
+        self._materialize(node)
+    
+    def expand(self, node: Optional[LazyProcessNode] = None, depth: int = 1):
+        """
+        按层展开到指定深度（每层一次批量查询）
+        
+        Args:
+            node: 起点（默认根节点）
+            depth: 展开的层数
+        """
+        level = [node or self.root]
+        for _ in range(depth):
+            pending = [n for n in level if not n.loaded]
+            self._fetch(pending)
+            for n in pending:
+                self._materialize(n)
+            level = [child for n in level for child in n._children if not child.is_cycle]
+            if not level:
+                break
+    
+    def walk(self, node: Optional[LazyProcessNode] = None) -> Iterator[LazyProcessNode]:
+        """先序遍历已加载的部分（不触发查询）"""
+        stack = [node or self.root]
+        while stack:
+            current = stack.pop()
+            yield current
+            if current._children:
+                stack.extend(reversed(current._children))
+
+
+def main():
+    """主函数：按需展开 ROOT_PROCESS_ID 的前几层并打印（--depth N，默认 2；--full-lci）"""
+    depth = int(sys.argv[sys.argv.index("--depth") + 1]) if "--depth" in sys.argv else 2
+    full_lci_mode = "--full-lci" in sys.argv
+    
+    print("=" * 60)
+    print("Lazy Process Tree - 按需展开")
+    print("=" * 60)
+    print()
+    
+    builder = ProcessTreeBuilder()
+    builder.use_disk_cache = builder.use_disk_cache or "--disk-cache" in sys.argv
+    builder.use_offline_store = builder.use_offline_store or "--offline" in sys.argv
+    apply_cutoff_args(builder, sys.argv)
+    try:
+        builder.connect_db()
+        if "--snapshot" in sys.argv:
+            builder.load_snapshot()
+        
+        start_time = datetime.now()
+        tree = LazyProcessTree(builder, config.ROOT_PROCESS_ID, full_lci_mode=full_lci_mode)
+        tree.expand(depth=depth)
+        duration = (datetime.now() - start_time).total_seconds()
+        
+        nodes = list(tree.walk())
+        flow_ids = [fid for node in nodes for fid in (node.flows or [node.flow_id]) if fid]
+        builder.resolve_names([node.process_id for node in nodes], flow_ids)
+        
+        print()
+        for node in nodes:
+            marker = " ⟲" if node.is_cycle else (" ⋯" if node.frontier else "")
+            via = f" ← {builder.get_flow_name(node.flow_id)}" if node.flow_id else ""
+            print(f"{'  ' * node.level}[{node.process_id[:8]}...] "
+                  f"{builder.get_process_name(node.process_id)}{via}{marker}")
+        
+        print(f"\n✓ 展开 {depth} 层: {len(nodes)} 个节点，{tree.loaded_count} 个已加载，"
+              f"耗时 {duration * 1000:.0f} ms（⋯ 为尚未展开的节点）")
+    
+    except Exception as e:
+        print(f"\n✗ 执行失败: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        builder.close_db()
+
+
+if __name__ == "__main__":
+    main()
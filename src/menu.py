@@ -58,7 +58,24 @@ def build_tree():
     print("=" * 70 + "\n")
     
     import build_process_tree
-    build_process_tree.main()
+    
+    # 大型根节点的完整构建可能持续数分钟；给定时间预算时按贡献度优先展开，到时返回部分树
+    print("提示: 输入时间预算（秒）将按贡献度优先构建，到时返回部分树（未展开的节点标记为 ⋯）")
+    budget = input("时间预算（秒，直接回车表示完整构建）: ").strip()
+    print()
+    
+    if not budget:
+        build_process_tree.main()
+    else:
+        try:
+            time_budget = float(budget)
+        except ValueError:
+            print(f"⚠ 无效的时间预算: {budget}")
+        else:
+            builder = build_process_tree.ProcessTreeBuilder()
+            builder.time_budget = time_budget
+            output_file = os.path.join(build_process_tree.OUTPUT_DIR, "process_tree.md")
+            builder.run(output_file=output_file, engine="anytime")
     
     input("\n按 Enter 键返回菜单...")
 
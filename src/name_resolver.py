@@ -0,0 +1,146 @@
+"""
+Name Resolver - 批量名称解析
+
+遍历结束后收集所有涉及的 process / flow / unit ID，每类只用一次 id = ANY(%s) 查询
+解析名称（按 NAME_BATCH_SIZE 分块），在生成 Markdown / TXT / JSON / Graphviz 之前填充缓存，
+避免渲染时逐个 ID 查询数据库。
+"""
+
+from typing import Dict, List, Iterable, Optional, Tuple
+import config
+from db_pool import execute_statement
+
+
+def names_query(table: str, version: Optional[str] = None, latest_fallback: bool = True) -> str:
+    """
+    名称批量查询的 SQL（%s 占位符：ID 列表，指定 version 时还有版本号）
+    
+    Args:
+        table: 完整表名（schema.table）
+        version: 指定版本；为 None 时不按版本过滤（如 tb_units）
+        latest_fallback: 指定版本不存在时是否取最新版本（在 SQL 中用 DISTINCT ON 选择）
+    """
+    if version is None:
+        return f"""
+            SELECT DISTINCT ON (id) id, name, NULL AS version
+            FROM {table}
+            WHERE id = ANY(%s)
+            ORDER BY id
+        """
+    if latest_fallback:
+        # 指定版本优先，其次取最新版本
+        return f"""
+            SELECT DISTINCT ON (id) id, name, version
+            FROM {table}
+            WHERE id = ANY(%s)
+            ORDER BY id, (version = %s) IS TRUE DESC, version DESC NULLS LAST
+        """
+    return f"""
+        SELECT DISTINCT ON (id) id, name, version
+        FROM {table}
+        WHERE id = ANY(%s) AND version = %s
+        ORDER BY id
+    """
+
+
+def fetch_names(cursor, table: str, ids: Iterable[str], version: Optional[str] = None,
+                latest_fallback: bool = True, prepared: Optional[bool] = None) -> Dict[str, Dict]:
+    """
+    批量查询名称
+    
+    Args:
+        cursor: RealDictCursor
+        table: 完整表名（schema.table）
+        ids: 待查询的 ID
+        version: 指定版本；为 None 时不按版本过滤（如 tb_units）
+        latest_fallback: 指定版本不存在时是否取最新版本（在 SQL 中用 DISTINCT ON 选择）
+        prepared: 是否使用 PREPARE/EXECUTE（默认使用 config.USE_PREPARED_STATEMENTS）
+    
+    Returns:
+        Dict: id -> {'id', 'name', 'version'}（未找到的 ID 不在结果中）
+    """
+    ids = list(dict.fromkeys(i for i in ids if i))
+    if not ids:
+        return {}
+    
+    query = names_query(table, version, latest_fallback)
+    
+    results: Dict[str, Dict] = {}
+    try:
+        for start in range(0, len(ids), config.NAME_BATCH_SIZE):
+            chunk = ids[start:start + config.NAME_BATCH_SIZE]
+            params = (chunk,) if version is None else (chunk, version)
+            execute_statement(cursor, "names", query, params, prepared)
+            for row in cursor.fetchall():
+                results[row['id']] = row
+    except Exception as e:
+        print(f"⚠️  批量获取名称失败 ({table}): {e}")
+        cursor.connection.rollback()
+    
+    return results
+
+
+def cacheable_names(names: Dict[str, str], prefix: Optional[str] = None) -> Dict[str, str]:
+    """
+    去掉占位名称，只保留查询到的名称（供磁盘缓存载入 / 写回）
+    
+    未查到或查询失败时构建器使用占位名称（"<prefix>-<ID 前 8 位>..."，unit 为 "N/A"），
+    写入磁盘缓存会让一次临时失败在整个有效期内都显示占位名称。
+    
+    Args:
+        names: ID -> 名称
+        prefix: 占位名称前缀（"Process" / "Flow"）；为 None 时占位名称为 "N/A"（unit）
+    """
+    if prefix is None:
+        return {item_id: name for item_id, name in names.items() if name != "N/A"}
+    return {item_id: name for item_id, name in names.items() if name != f"{prefix}-{item_id[:8]}..."}
+
+
+def collect_tree_ids(root) -> Tuple[List[str], List[str]]:
+    """
+    收集过程树中所有 process ID 和 flow ID（按首次出现顺序去重）
+    
+    Args:
+        root: ProcessTreeNode 根节点
+    
+    Returns:
+        (process_ids, flow_ids)
+    """
+    process_ids: Dict[str, None] = {}
+    flow_ids: Dict[str, None] = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        process_ids[node.process_id] = None
+        if node.flow_id:
+            flow_ids[node.flow_id] = None
+        for flow_id in node.flows:
+            flow_ids[flow_id] = None
+        # 共享子树在首次展开处已收集
+        if not node.shared:
+            stack.extend(reversed(node.children))
+    return list(process_ids), list(flow_ids)
+
+
+def collect_chain_ids(head_node) -> Tuple[List[str], List[str], List[str]]:
+    """
+    收集主链路中所有 process / flow / unit ID
+    
+    Args:
+        head_node: MainChainNode 头节点
+    
+    Returns:
+        (process_ids, flow_ids, unit_ids)
+    """
+    process_ids: Dict[str, None] = {}
+    flow_ids: Dict[str, None] = {}
+    unit_ids: Dict[str, None] = {}
+    current = head_node
+    while current:
+        process_ids[current.process_id] = None
+        if current.flow_id:
+            flow_ids[current.flow_id] = None
+        if current.unit_id:
+            unit_ids[current.unit_id] = None
+        current = current.next_node
+    return list(process_ids), list(flow_ids), list(unit_ids)
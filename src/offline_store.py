@@ -0,0 +1,339 @@
+"""
+Offline Store - 单文件离线数据（SQLite）
+
+把某个 VERSION 用到的数据一次性导出到本地单个文件，之后 ProcessTreeBuilder / MainChainBuilder
+可以完全不连接生产数据库运行（--offline），批量分析和 what-if 分析在笔记本或 CI 上只受本地磁盘限制，
+也不再给共享的 hiq_background_db 增加负载：
+
+    - exchanges: 该版本所有未删除的 tb_exchanges 记录（输入和输出）
+    - names: exchanges 涉及的 tb_processes / tb_flows 名称（每个 ID 一行：指定版本优先，否则最新版本）
+             和 tb_units 名称
+    - category_filter: 建设模式的 category 过滤集合（来自 hiq_editor 的 tw_process_data，导出时加 --editor）
+
+OfflineStore 提供构建器需要的数据源接口：
+
+    exchange_graph()          上游 exchange 图（ExchangeSnapshot / CompactGraph，与 load_snapshot 相同）
+    fetch_names(...)          与 name_resolver.fetch_names 相同的名称查询（不需要游标）
+    all_exchanges(process_id) 与 get_all_exchanges 查询相同的行
+    reference_outputs(ids)    与 get_reference_outputs 相同的参考产品产量
+    category_exchange_ids(c)  建设模式的 category 过滤集合
+
+构建器连接时打开离线文件（不再借用数据库连接），遍历走快照路径，名称、根节点 exchanges 和
+category 过滤集合改由离线文件提供，输出与使用快照连接生产数据库时相同。
+
+用法:
+    python src/offline_store.py --export            # 导出当前 VERSION（生产数据库）
+    python src/offline_store.py --export --editor   # 同时导出建设模式的 category 过滤集合
+    python src/offline_store.py                     # 查看离线文件信息
+    python src/build_process_tree.py --both --offline
+    python batch_main_chain.py --offline --workers 8
+"""
+
+import os
+import sqlite3
+import sys
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime
+import config
+import db_pool
+from exchange_snapshot import ExchangeSnapshot, SNAPSHOT_COLUMNS
+from name_resolver import fetch_names
+
+# 导出的 exchange 列（get_all_exchanges 和快照用到的全部列）
+EXCHANGE_COLUMNS = [
+    "id",
+    "process_id",
+    "flow_id",
+    "provider_id",
+    "value",
+    "unit_id",
+    "gwp",
+    "gwp_contribution",
+    "is_input",
+    "is_product",
+    "exchange_group",
+    "description",
+]
+
+# 每次 IN (...) 查询最多携带的 ID 数量（SQLite 参数个数上限）
+_SQLITE_BATCH_SIZE = 500
+
+# 已打开的离线文件：路径 -> OfflineStore
+_STORES: Dict[str, 'OfflineStore'] = {}
+
+
+def store_path(path: Optional[str] = None) -> str:
+    """离线文件的绝对路径（相对路径相对于项目根目录）"""
+    path = path or config.OFFLINE_STORE_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+    return path
+
+
+def _sqlite_value(value):
+    """numeric 列（Decimal）转换为 float，其余原样写入"""
+    return float(value) if isinstance(value, Decimal) else value
+
+
+class OfflineStore:
+    """某个版本的离线数据文件（只读）"""
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = store_path(path)
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"离线数据文件不存在: {self.path}（先运行 python src/offline_store.py --export）")
+        self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        self.conn.row_factory = sqlite3.Row
+        self.meta = {row['key']: row['value'] for row in self.conn.execute("SELECT key, value FROM meta")}
+        self.version = self.meta['version']
+        self._graph: Optional[ExchangeSnapshot] = None
+    
+    def exchange_graph(self, compact: Optional[bool] = None) -> ExchangeSnapshot:
+        """
+        上游 exchange 图（有 provider 的 input exchange），首次调用时读取并缓存
+        
+        Args:
+            compact: 是否使用数组存储的 CompactGraph（默认使用 config.COMPACT_SNAPSHOT）
+        """
+        if self._graph is not None:
+            return self._graph
+        if compact is None:
+            compact = config.COMPACT_SNAPSHOT
+        if compact:
+            from compact_graph import CompactGraph
+            graph = CompactGraph(self.version)
+        else:
+            graph = ExchangeSnapshot(self.version)
+        
+        start_time = datetime.now()
+        rows = self.conn.execute(f"""
+            SELECT {', '.join(SNAPSHOT_COLUMNS)}
+            FROM exchanges
+            WHERE is_input = 1 AND provider_id IS NOT NULL
+        """)
+        for row in rows:
+            graph.add_row(list(row))
+        graph.finalize()
+        duration = (datetime.now() - start_time).total_seconds()
+        print(f"✓ 离线快照已加载: {self.path} (version={self.version}), "
+              f"{len(graph)} 个 process, {graph.edge_count} 条 exchange, 耗时 {duration:.2f} 秒")
+        self._graph = graph
+        return graph
+    
+    def fetch_names(self, table: str, ids: Iterable[str], version: Optional[str] = None,
+                    latest_fallback: bool = True) -> Dict[str, Dict]:
+        """
+        批量查询名称，参数和返回值与 name_resolver.fetch_names 相同
+        
+        离线文件中每个 ID 只保存一行（指定版本优先，否则最新版本）；latest_fallback 为 False 时
+        只返回指定版本的名称。
+        """
+        kind = table.split('.')[-1]
+        ids = list(dict.fromkeys(i for i in ids if i))
+        results: Dict[str, Dict] = {}
+        for start in range(0, len(ids), _SQLITE_BATCH_SIZE):
+            chunk = ids[start:start + _SQLITE_BATCH_SIZE]
+            rows = self.conn.execute(f"""
+                SELECT id, name, version FROM names
+                WHERE kind = ? AND id IN ({', '.join('?' * len(chunk))})
+            """, [kind, *chunk])
+            for row in rows:
+                if version is not None and not latest_fallback and row['version'] != version:
+                    continue
+                results[row['id']] = dict(row)
+        return results
+    
+    def all_exchanges(self, process_id: str) -> List[Dict]:
+        """process 的全部 exchanges，列和顺序与 get_all_exchanges 的查询相同（输入在前，value 降序）"""
+        rows = self.conn.execute("""
+            SELECT flow_id, provider_id, value, is_input, unit_id, gwp, gwp_contribution, description, id
+            FROM exchanges
+            WHERE process_id = ?
+            ORDER BY is_input DESC, value IS NULL, value DESC
+        """, (process_id,))
+        return [{**dict(row), 'is_input': bool(row['is_input'])} for row in rows]
+    
+    def reference_outputs(self, process_ids: Iterable[str]) -> Dict[str, float]:
+        """process 的参考产品产量，与 ProcessTreeBuilder.get_reference_outputs 相同（没有记录的不在结果中）"""
+        process_ids = list(dict.fromkeys(process_ids))
+        outputs: Dict[str, float] = {}
+        for start in range(0, len(process_ids), _SQLITE_BATCH_SIZE):
+            chunk = process_ids[start:start + _SQLITE_BATCH_SIZE]
+            rows = self.conn.execute(f"""
+                SELECT process_id, SUM(value) AS amount FROM exchanges
+                WHERE is_input = 0 AND is_product = 1 AND process_id IN ({', '.join('?' * len(chunk))})
+                GROUP BY process_id
+            """, chunk)
+            for row in rows:
+                if row['amount'] is not None:
+                    outputs[row['process_id']] = float(row['amount'])
+        return outputs
+    
+    def category_exchange_ids(self, category_id: str) -> Optional[frozenset]:
+        """建设模式的 category 过滤集合（导出时未包含该 category 则为 None）"""
+        rows = self.conn.execute("SELECT exchange_id FROM category_filter WHERE category_id = ?",
+                                 (category_id,)).fetchall()
+        if not rows and self.meta.get('category_filter') != category_id:
+            return None
+        return frozenset(row['exchange_id'] for row in rows)
+    
+    def close(self):
+        """关闭离线文件"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def open_store(path: Optional[str] = None, version: Optional[str] = None) -> OfflineStore:
+    """
+    打开（必要时读取）离线文件；同一进程内同一文件只打开一次，供多个构建器复用
+    
+    离线文件的版本与 version（默认 config.VERSION）不一致时报错。
+    """
+    path = store_path(path)
+    version = version or config.VERSION
+    if path not in _STORES:
+        _STORES[path] = OfflineStore(path)
+    store = _STORES[path]
+    if store.version != version:
+        raise ValueError(f"离线数据版本 {store.version} 与当前 VERSION {version} 不一致，请重新导出")
+    return store
+
+
+def export_store(path: Optional[str] = None, version: Optional[str] = None, with_editor: bool = False) -> str:
+    """
+    从生产数据库导出指定版本的离线文件（覆盖已有文件）
+    
+    Args:
+        path: 输出文件（默认使用 config.OFFLINE_STORE_PATH）
+        version: 数据版本（默认使用 config.VERSION）
+        with_editor: 是否同时导出建设模式的 category 过滤集合（需要能连接 hiq_editor）
+    
+    Returns:
+        输出文件路径
+    """
+    path = store_path(path)
+    version = version or config.VERSION
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    
+    start_time = datetime.now()
+    out = sqlite3.connect(tmp_path)
+    try:
+        out.executescript(f"""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE exchanges ({', '.join(EXCHANGE_COLUMNS)});
+            CREATE TABLE names (kind TEXT, id TEXT, name TEXT, version TEXT, PRIMARY KEY (kind, id));
+            CREATE TABLE category_filter (category_id TEXT, exchange_id TEXT, PRIMARY KEY (category_id, exchange_id));
+        """)
+        
+        conn = db_pool.get_connection(config.PG_DATABASE)
+        process_ids, flow_ids, unit_ids = set(), set(), set()
+        try:
+            # exchanges：服务端游标分批读取
+            cursor = conn.cursor(name="offline_export")
+            cursor.itersize = 20000
+            try:
+                cursor.execute(f"""
+                    SELECT {', '.join(EXCHANGE_COLUMNS)}
+                    FROM {config.PG_SCHEMA}.{config.PG_TABLE}
+                    WHERE is_deleted = false
+                      AND version = %s
+                """, (version,))
+                while True:
+                    rows = cursor.fetchmany(cursor.itersize)
+                    if not rows:
+                        break
+                    out.executemany(f"INSERT INTO exchanges VALUES ({', '.join('?' * len(EXCHANGE_COLUMNS))})",
+                                    [[_sqlite_value(value) for value in row] for row in rows])
+                    for row in rows:
+                        process_ids.update(pid for pid in (row[1], row[3]) if pid)
+                        flow_ids.add(row[2])
+                        unit_ids.add(row[5])
+            finally:
+                cursor.close()
+            exchange_count = out.execute("SELECT COUNT(*) FROM exchanges").fetchone()[0]
+            print(f"✓ 已导出 {exchange_count} 条 exchange")
+            
+            # 名称：只导出 exchanges 涉及的 ID（以及配置中的根节点）
+            process_ids.add(config.ROOT_PROCESS_ID)
+            flow_ids.add(config.ROOT_FLOW_ID)
+            from psycopg2.extras import RealDictCursor
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                for kind, ids, name_version in (("tb_processes", process_ids, version),
+                                                ("tb_flows", flow_ids, version),
+                                                ("tb_units", unit_ids, None)):
+                    rows = fetch_names(cursor, f"{config.PG_SCHEMA}.{kind}", ids, name_version)
+                    out.executemany("INSERT INTO names VALUES (?, ?, ?, ?)",
+                                    [(kind, row['id'], row['name'], row['version']) for row in rows.values()])
+                    print(f"✓ 已导出 {len(rows)} 个 {kind} 名称")
+            finally:
+                cursor.close()
+        finally:
+            db_pool.release_connection(conn, config.PG_DATABASE)
+        
+        meta = {'version': version, 'database': config.PG_DATABASE,
+                'exported_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        
+        if with_editor:
+            from build_main_chain import MainChainBuilder
+            builder = MainChainBuilder(mode="editor")
+            builder.use_offline_store = False
+            builder.connect_db()
+            try:
+                out.executemany("INSERT INTO category_filter VALUES (?, ?)",
+                                [(builder.category_filter, exchange_id)
+                                 for exchange_id in builder.category_exchange_ids])
+            finally:
+                builder.close_db()
+            meta['category_filter'] = builder.category_filter
+        
+        out.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        out.execute("CREATE INDEX idx_exchanges_process ON exchanges (process_id)")
+        out.commit()
+    finally:
+        out.close()
+    
+    os.replace(tmp_path, path)
+    _STORES.pop(path, None)
+    duration = (datetime.now() - start_time).total_seconds()
+    print(f"✓ 离线数据已导出: {path} (version={version}), 大小 {os.path.getsize(path) / 1e6:.1f} MB, "
+          f"耗时 {duration:.2f} 秒")
+    return path
+
+
+def main():
+    """主函数：--export [--editor] 导出当前 VERSION；否则显示离线文件信息"""
+    if "--export" in sys.argv:
+        print("=" * 60)
+        print(f"导出离线数据: {config.PG_DATABASE} (version={config.VERSION})")
+        print("=" * 60)
+        try:
+            export_store(with_editor="--editor" in sys.argv)
+        except Exception as e:
+            print(f"\n✗ 导出失败: {e}")
+            import traceback
+            traceback.print_exc()
+        return
+    
+    try:
+        store = OfflineStore()
+    except FileNotFoundError as e:
+        print(f"✗ {e}")
+        return
+    try:
+        print(f"离线数据: {store.path}")
+        for key, value in store.meta.items():
+            print(f"  {key}: {value}")
+        for table in ("exchanges", "names", "category_filter"):
+            print(f"  {table}: {store.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]} 行")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
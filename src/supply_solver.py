@@ -0,0 +1,291 @@
+"""
+Supply Solver - 稀疏技术矩阵求解全供应链活动量
+
+过程树只展示结构，不计算每单位根产品实际需要多少上游活动。这里由已加载的
+tb_exchanges input 边（快照或遍历缓存）组装技术矩阵：
+
+    A[provider, process] = value / output[process]   （process 每单位参考产品需要的 provider 产品量）
+    (I - A) · s = d                                  （d 为根 process 的单位需求，s 为各 process 的活动量）
+
+output 为 process 的参考产品产量（is_input = false 且 is_product = true 的 exchange value），
+由 reference_outputs 批量查询；未提供或查不到时按 1 计，并给出提示。
+一次稀疏线性求解即可得到整个上游闭包的活动量，代替沿指数级数量的树路径逐条累乘；
+多个根节点共用一次 LU 分解。
+
+可选依赖 scipy：安装后使用稀疏 LU 分解（scipy.sparse.linalg.splu）；未安装时退回
+纯 Python 的不动点迭代 s ← d + A·s（技术矩阵满足生产性条件时收敛）。
+"""
+
+import os
+import sys
+from typing import Callable, Dict, Iterable, List, Optional
+from datetime import datetime
+import config
+
+try:
+    import numpy as np
+    from scipy import sparse
+    from scipy.sparse.linalg import splu
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# 确保输出目录存在
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'output')
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+class TechnosphereSolver:
+    """由 exchange 图组装的技术矩阵及其求解"""
+    
+    def __init__(self, graph, roots: Optional[Iterable[str]] = None,
+                 reference_outputs: Optional[Callable[[List[str]], Dict[str, float]]] = None):
+        """
+        Args:
+            graph: 提供 upstream_exchanges / processes 的图（ExchangeSnapshot、CompactGraph 或 exchange_view）
+            roots: 只组装这些 process 的上游闭包（默认整个图）
+            reference_outputs: 批量查询参考产品产量的函数（如 ProcessTreeBuilder.get_reference_outputs）；
+                               为 None 时各 process 的参考产量按 1 计
+        """
+        self.graph = graph
+        self.process_ids: List[str] = []  # 矩阵下标 -> process_id
+        self.index: Dict[str, int] = {}  # process_id -> 矩阵下标
+        # A 的非零元（COO）：A[providers[k], processes[k]] += values[k]
+        self.providers: List[int] = []
+        self.processes: List[int] = []
+        self.values: List[float] = []
+        self._lu = None
+        
+        start_time = datetime.now()
+        self._assemble(list(roots) if roots is not None else list(graph.processes()))
+        if reference_outputs is not None:
+            self._normalize(reference_outputs(self.process_ids))
+        else:
+            print("⚠ 未提供参考产品产量，各 process 按 1 计（exchange value 视为每单位产品的投入量）")
+        duration = (datetime.now() - start_time).total_seconds()
+        print(f"✓ 技术矩阵: {len(self.process_ids)} 个 process, {len(self.values)} 个非零元, "
+              f"耗时 {duration:.2f} 秒")
+    
+    def _intern(self, process_id: str) -> int:
+        i = self.index.get(process_id)
+        if i is None:
+            i = len(self.process_ids)
+            self.index[process_id] = i
+            self.process_ids.append(process_id)
+        return i
+    
+    def _assemble(self, roots: List[str]):
+        """从根节点出发收集上游闭包的所有 input 边（显式栈，每个 process 只读取一次）"""
+        stack = [self._intern(process_id) for process_id in roots]
+        expanded = set()
+        while stack:
+            j = stack.pop()
+            if j in expanded:
+                continue
+            expanded.add(j)
+            for exchange in self.graph.upstream_exchanges(self.process_ids[j]):
+                if not exchange['provider_id'] or not exchange['value']:
+                    continue
+                i = self._intern(exchange['provider_id'])
+                self.providers.append(i)
+                self.processes.append(j)
+                self.values.append(float(exchange['value']))
+                if i not in expanded:
+                    stack.append(i)
+    
+    def _normalize(self, outputs: Dict[str, float]):
+        """每列除以该 process 的参考产品产量；产量缺失或不为正的 process 按 1 计并提示"""
+        amounts = []
+        missing = 0
+        for process_id in self.process_ids:
+            amount = outputs.get(process_id)
+            if amount is None or amount <= 0:
+                missing += 1
+                amount = 1.0
+            amounts.append(amount)
+        self.values = [value / amounts[j] for j, value in zip(self.processes, self.values)]
+        
+        scaled = sum(1 for amount in amounts if amount != 1.0)
+        if scaled:
+            print(f"✓ {scaled} 个 process 的参考产品产量不为 1，已按产量归一化")
+        if missing:
+            print(f"⚠ {missing} 个 process 没有有效的参考产品产量记录，按 1 计")
+    
+    def factorize(self):
+        """对 I - A 做一次稀疏 LU 分解（仅 scipy 可用时），之后的求解都复用它"""
+        if not SCIPY_AVAILABLE or self._lu is not None:
+            return
+        n = len(self.process_ids)
+        technosphere = sparse.identity(n, format='csc') - sparse.coo_matrix(
+            (self.values, (self.providers, self.processes)), shape=(n, n)).tocsc()
+        try:
+            self._lu = splu(technosphere)
+        except RuntimeError as e:
+            # 技术矩阵奇异（例如存在 value 之积为 1 的闭合循环）
+            print(f"✗ 技术矩阵分解失败: {e}")
+            raise
+    
+    def solve(self, root_process_id: str, demand: float = 1.0) -> Dict[str, float]:
+        """
+        求解单个根节点的活动量
+        
+        Returns:
+            Dict: process_id -> 每 demand 单位根产品所需的活动量（不含 0）
+        """
+        return self.solve_many([root_process_id], demand)[root_process_id]
+    
+    def solve_many(self, root_process_ids: List[str], demand: float = 1.0) -> Dict[str, Dict[str, float]]:
+        """
+        一次求解多个根节点（scipy 可用时共用一次分解，多列右端项一起回代）
+        
+        Returns:
+            Dict: 根 process_id -> {process_id -> 活动量}
+        """
+        missing = [pid for pid in root_process_ids if pid not in self.index]
+        if missing:
+            raise KeyError(f"根节点不在技术矩阵中: {', '.join(pid[:8] for pid in missing)}")
+        
+        if not SCIPY_AVAILABLE:
+            return {pid: self._solve_iterative(self.index[pid], demand) for pid in root_process_ids}
+        
+        self.factorize()
+        n = len(self.process_ids)
+        rhs = np.zeros((n, len(root_process_ids)))
+        for column, pid in enumerate(root_process_ids):
+            rhs[self.index[pid], column] = demand
+        solution = self._lu.solve(rhs)
+        
+        results = {}
+        for column, pid in enumerate(root_process_ids):
+            supply = solution[:, column]
+            results[pid] = {self.process_ids[i]: float(supply[i]) for i in np.flatnonzero(supply)}
+        return results
+    
+    def _solve_iterative(self, root: int, demand: float) -> Dict[str, float]:
+        """
+        不动点迭代 s ← d + A·s（scipy 不可用时的退回方案）
+        
+        每轮只沿有活动量的 process 的 input 边传播，收敛判据为 SUPPLY_SOLVER_TOLERANCE（相对变化）。
+        """
+        inputs: Dict[int, List[tuple]] = {}
+        for i, j, value in zip(self.providers, self.processes, self.values):
+            inputs.setdefault(j, []).append((i, value))
+        
+        supply = {root: demand}
+        for _ in range(config.SUPPLY_SOLVER_MAX_ITERATIONS):
+            updated = {root: demand}
+            for j, amount in supply.items():
+                for i, value in inputs.get(j, ()):
+                    updated[i] = updated.get(i, 0.0) + value * amount
+            change = max(abs(updated.get(i, 0.0) - supply.get(i, 0.0)) for i in updated.keys() | supply.keys())
+            scale = max(abs(amount) for amount in updated.values())
+            supply = updated
+            if change <= config.SUPPLY_SOLVER_TOLERANCE * scale:
+                break
+        else:
+            print(f"⚠ 迭代 {config.SUPPLY_SOLVER_MAX_ITERATIONS} 轮未收敛（技术矩阵可能不满足生产性条件），"
+                  f"结果仅供参考；安装 scipy 可直接求解")
+        
+        return {self.process_ids[i]: amount for i, amount in supply.items() if amount}
+
+
+def write_supply_report(supply: Dict[str, float], root_process_id: str, output_file: str,
+                        get_process_name, top_n: int = 100):
+    """
+    生成活动量报告（Markdown）：按活动量降序列出前 top_n 个 process
+    
+    Args:
+        supply: solve 的结果
+        root_process_id: 根 process ID
+        output_file: 输出文件
+        get_process_name: 名称查询（调用前应已批量解析）
+        top_n: 最多列出的 process 数
+    """
+    ranked = sorted(supply.items(), key=lambda item: -abs(item[1]))
+    
+    lines = []
+    lines.append("# 全供应链活动量 (Supply Vector)")
+    lines.append("")
+    lines.append(f"**生成时间:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    lines.append(f"**版本:** {config.VERSION}")
+    lines.append(f"**根节点:** `{root_process_id}` {get_process_name(root_process_id)}")
+    if root_process_id == config.ROOT_PROCESS_ID:
+        lines.append(f"**产品 Flow:** `{config.ROOT_FLOW_ID}`")
+    lines.append(f"**求解器:** {'scipy 稀疏 LU 分解' if SCIPY_AVAILABLE else '不动点迭代（未安装 scipy）'}")
+    lines.append("")
+    lines.append("*每单位根产品所需的各上游 process 活动量（以各自参考产品的产量计）。*")
+    lines.append("")
+    lines.append(f"- **涉及 process 数:** {len(supply)}")
+    lines.append("")
+    lines.append("| 序号 | Process ID | Process Name | 活动量 |")
+    lines.append("|------|------------|--------------|--------|")
+    for rank, (process_id, amount) in enumerate(ranked[:top_n], 1):
+        lines.append(f"| {rank} | `{process_id[:8]}...` | {get_process_name(process_id)} | {amount:.6g} |")
+    if len(ranked) > top_n:
+        lines.append(f"| ... | ... | 还有 {len(ranked) - top_n} 个 process | ... |")
+    lines.append("")
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+    
+    print(f"✓ 活动量报告已生成: {output_file}")
+
+
+def main():
+    """
+    主函数：求解 ROOT_PROCESS_ID（或 --batch 时 process_ids.txt 中全部 process）的活动量
+    
+    --snapshot: 先加载整个版本的 exchange 快照；否则按层级批量预取根节点的上游闭包
+    """
+    from build_process_tree import ProcessTreeBuilder
+    
+    use_snapshot = "--snapshot" in sys.argv
+    if "--batch" in sys.argv:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from batch_main_chain import read_process_ids
+        roots = read_process_ids("process_ids.txt")
+    else:
+        roots = [config.ROOT_PROCESS_ID]
+    if not roots:
+        return
+    
+    print("=" * 60)
+    print("Supply Solver - 技术矩阵求解")
+    print("=" * 60)
+    if not SCIPY_AVAILABLE:
+        print("⚠ scipy 未安装，使用不动点迭代求解；安装: pip install scipy")
+    print()
+    
+    builder = ProcessTreeBuilder()
+    try:
+        builder.connect_db()
+        if use_snapshot:
+            builder.load_snapshot()
+        else:
+            # 多个根节点一次预取闭包的并集，共享的上游只查询一次
+            builder.prefetch_upstream_closure(roots)
+        
+        solver = TechnosphereSolver(builder.exchange_view(), roots, builder.get_reference_outputs)
+        solutions = solver.solve_many(roots)
+        
+        for process_id, supply in solutions.items():
+            # 报告只列出活动量最大的前 100 个 process，只解析这些名称
+            top_ids = sorted(supply, key=lambda pid: -abs(supply[pid]))[:100]
+            builder.resolve_names(top_ids + [process_id], [])
+            output_file = os.path.join(OUTPUT_DIR, f"supply_vector_{process_id[:8]}.md")
+            write_supply_report(supply, process_id, output_file, builder.get_process_name)
+        
+        print("\n" + "=" * 60)
+        print(f"✓ 完成！共求解 {len(solutions)} 个根节点")
+        print("=" * 60)
+    
+    except Exception as e:
+        print(f"\n✗ 执行失败: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        builder.close_db()
+
+
+if __name__ == "__main__":
+    main()
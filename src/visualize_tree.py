@@ -15,6 +15,11 @@ from build_process_tree import ProcessTreeBuilder, ProcessTreeNode
 import config
 
 
+def _graph_id(node: ProcessTreeNode) -> str:
+    """图节点 ID：压缩的循环使用分量代表（成员中 ID 最小者）"""
+    return node.members[0] if node.members else node.process_id
+
+
 class TreeVisualizer:
     """将过程树可视化为图形"""
     
@@ -39,6 +44,9 @@ class TreeVisualizer:
         self.dot.attr('node', shape='box', style='rounded,filled', fillcolor='lightblue')
         self.dot.attr('edge', color='gray', arrowhead='vee')
         
+        # 渲染前批量解析名称
+        self.builder.prefetch_names(root)
+        
         # 添加节点和边
         self._add_node_recursive(root)
         
@@ -46,41 +54,64 @@ class TreeVisualizer:
     
     def _add_node_recursive(self, node: ProcessTreeNode):
         """
-        递归添加节点和边
+        添加节点及其子树的所有节点和边（显式栈迭代，添加顺序与递归实现一致）
+        
+        过程树本身是 DAG：共享子树在图中只有一份，每个引用只添加一条边。
+        压缩的循环以分量代表为图节点 ID，从不同成员进入同一循环的边都指向这个节点。
         
         Args:
             node: 当前节点
         """
-        # 获取节点信息
-        process_id = node.process_id
-        process_name = self.builder.get_process_name(process_id)
-        process_short = process_id[:8]
-        
-        # 添加节点标签
-        label = f"{process_short}...\n{process_name}"
-        
-        # 根节点使用不同颜色
-        if node.level == 0:
-            self.dot.node(process_id, label, fillcolor='lightcoral')
-        else:
-            self.dot.node(process_id, label)
+        # 栈元素: ("node", 节点, None) 添加节点；("edge", 子节点, 父节点) 添加边
+        stack = [("node", node, None)]
         
-        # 递归处理子节点
-        for child in node.children:
-            child_process_id = child.process_id
+        while stack:
+            action, node, parent = stack.pop()
             
-            # 添加子节点
-            self._add_node_recursive(child)
+            if action == "edge":
+                # 添加边（从子节点指向当前节点）
+                if node.flow_id:
+                    flow_short = node.flow_id[:8]
+                    flow_name = self.builder.get_flow_name(node.flow_id)
+                    edge_label = f"{flow_short}...\n{flow_name}"
+                else:
+                    edge_label = ""
+                
+                if node.is_cycle:
+                    # 回边（循环依赖）用虚线表示
+                    self.dot.edge(_graph_id(node), _graph_id(parent), label=edge_label, style='dashed')
+                else:
+                    self.dot.edge(_graph_id(node), _graph_id(parent), label=edge_label)
+                continue
             
-            # 添加边（从子节点指向当前节点）
-            if child.flow_id:
-                flow_short = child.flow_id[:8]
-                flow_name = self.builder.get_flow_name(child.flow_id)
-                edge_label = f"{flow_short}...\n{flow_name}"
+            # 共享子树和回边指向的 process 已作为图节点添加，图中只需连一条边
+            if node.shared or node.is_cycle:
+                continue
+            
+            # 获取节点信息
+            process_id = node.process_id
+            process_name = self.builder.get_process_name(process_id)
+            process_short = process_id[:8]
+            
+            # 添加节点标签
+            label = f"{process_short}...\n{process_name}"
+            if node.members:
+                label += f"\n⊚ 循环: {len(node.members)} 个 process"
+            
+            # 根节点使用不同颜色，压缩的循环使用双线边框，未展开的 frontier 节点使用虚线边框
+            if node.level == 0:
+                self.dot.node(_graph_id(node), label, fillcolor='lightcoral')
+            elif node.members:
+                self.dot.node(_graph_id(node), label, peripheries='2')
+            elif node.frontier:
+                self.dot.node(_graph_id(node), label, style='rounded,filled,dashed')
             else:
-                edge_label = ""
+                self.dot.node(_graph_id(node), label)
             
-            self.dot.edge(child_process_id, process_id, label=edge_label)
+            # 子节点：先添加子树，再添加子节点到当前节点的边（逆序入栈）
+            for child in reversed(node.children):
+                stack.append(("edge", child, node))
+                stack.append(("node", child, None))
     
     def render(self, output_file: str = "process_tree", format: str = "png"):
         """
@@ -144,7 +175,7 @@ def main():
         print("\n" + "=" * 60)
         print("✓ 完成！")
         print("=" * 60)
-        
+    
     except Exception as e:
         print(f"\n✗ 执行失败: {e}")
         import traceback
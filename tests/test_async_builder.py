@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+async_builder 的离线测试：用内存中的假 asyncpg 连接池驱动 prefetch_upstream_async 和 build_chain_async
+
+假连接池模拟 asyncpg 的类型行为：uuid 列默认返回 uuid.UUID，只有在连接初始化时注册了
+文本编解码器才返回 str。运行: python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import sys
+import types
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import config
+import async_builder
+
+VERSION = config.VERSION
+A, B, C = (str(uuid.UUID(int=n)) for n in (1, 2, 3))
+F1, F2 = (str(uuid.UUID(int=n)) for n in (11, 12))
+U1 = str(uuid.UUID(int=21))
+
+# 上游关系: A <- B <- C（exchange 行与数据库列相同）
+EXCHANGES = [
+    {'id': str(uuid.UUID(int=31)), 'process_id': A, 'flow_id': F1, 'provider_id': B, 'is_input': True,
+     'is_product': False, 'is_deleted': False, 'version': VERSION, 'value': 2.0, 'unit_id': U1,
+     'gwp': 1.0, 'gwp_contribution': 0.6},
+    {'id': str(uuid.UUID(int=32)), 'process_id': B, 'flow_id': F2, 'provider_id': C, 'is_input': True,
+     'is_product': False, 'is_deleted': False, 'version': VERSION, 'value': 0.5, 'unit_id': U1,
+     'gwp': 1.0, 'gwp_contribution': 0.3},
+]
+NAMES = {A: "Process A", B: "Process B", C: "Process C", F1: "Flow 1", F2: "Flow 2", U1: "kg"}
+UUID_COLUMNS = {'id', 'process_id', 'flow_id', 'provider_id', 'unit_id'}
+
+
+class FakeConnection:
+    """记录 set_type_codec 调用的假连接"""
+    
+    def __init__(self):
+        self.text_uuid = False
+    
+    async def set_type_codec(self, typename, encoder, decoder, schema, format):
+        if typename == 'uuid' and format == 'text':
+            self.text_uuid = True
+
+
+class FakePool:
+    """按 SQL 文本分派的假连接池（只实现构建器用到的查询）"""
+    
+    def __init__(self):
+        self.connection = FakeConnection()
+    
+    def _row(self, row):
+        if self.connection.text_uuid:
+            return dict(row)
+        return {key: uuid.UUID(value) if key in UUID_COLUMNS and value else value for key, value in row.items()}
+    
+    async def fetch(self, query, *params):
+        await asyncio.sleep(0)
+        ids = [str(value) for value in params[0]] if isinstance(params[0], list) else [str(params[0])]
+        if "process_id = ANY" in query:
+            rows = [row for row in EXCHANGES if row['process_id'] in ids]
+        elif "id = ANY" in query:
+            rows = [{'id': i, 'name': NAMES[i], 'version': VERSION} for i in ids if i in NAMES]
+        elif "process_id = $1" in query:
+            rows = sorted((row for row in EXCHANGES if row['process_id'] == ids[0]),
+                          key=lambda row: row['value'], reverse=True)
+        else:
+            raise AssertionError(f"unexpected query: {query}")
+        return [self._row(row) for row in rows]
+    
+    async def close(self):
+        pass
+
+
+async def _create_pool(init=None, **kwargs):
+    pool = FakePool()
+    if init is not None:
+        await init(pool.connection)
+    return pool
+
+
+class AsyncBuilderTest(unittest.TestCase):
+    """asyncpg 返回的 uuid 必须是 str，缓存和名称字典才能按 ID 命中"""
+    
+    def setUp(self):
+        self._saved = (getattr(async_builder, 'asyncpg', None), async_builder.ASYNCPG_AVAILABLE,
+                       config.DISK_CACHE_ENABLED, config.OFFLINE_MODE, config.ROOT_PROCESS_ID, config.ROOT_FLOW_ID)
+        async_builder.asyncpg = types.SimpleNamespace(create_pool=_create_pool)
+        async_builder.ASYNCPG_AVAILABLE = True
+        config.DISK_CACHE_ENABLED = False
+        config.OFFLINE_MODE = False
+        config.ROOT_PROCESS_ID = A
+        config.ROOT_FLOW_ID = F1
+    
+    def tearDown(self):
+        (async_builder.asyncpg, async_builder.ASYNCPG_AVAILABLE, config.DISK_CACHE_ENABLED,
+         config.OFFLINE_MODE, config.ROOT_PROCESS_ID, config.ROOT_FLOW_ID) = self._saved
+    
+    def test_prefetch_upstream_async(self):
+        builder = async_builder.AsyncProcessTreeBuilder(max_in_flight=4)
+        
+        async def run():
+            await builder.connect()
+            try:
+                await builder.prefetch_upstream_async(A)
+            finally:
+                await builder.close()
+        asyncio.run(run())
+        
+        self.assertEqual(set(builder.exchange_cache), {A, B, C})
+        self.assertEqual([row['provider_id'] for row in builder.exchange_cache[A]], [B])
+        self.assertTrue(all(isinstance(row['provider_id'], str)
+                            for rows in builder.exchange_cache.values() for row in rows))
+        self.assertEqual(builder.process_names[C], "Process C")
+        self.assertEqual(builder.flow_names[F2], "Flow 2")
+    
+    def test_build_chain_async(self):
+        builder = async_builder.AsyncMainChainBuilder(max_in_flight=4)
+        
+        async def run():
+            await builder.connect()
+            try:
+                head = await builder.build_chain_async(A)
+                await builder.resolve_names_async([A, B, C], [F1, F2], [U1])
+                return head
+            finally:
+                await builder.close()
+        head = asyncio.run(run())
+        
+        chain = []
+        node = head
+        while node is not None:
+            chain.append(node.process_id)
+            node = node.next_node
+        self.assertEqual(chain, [A, B, C])
+        self.assertEqual(builder.process_names[B], "Process B")
+
+
+if __name__ == '__main__':
+    unittest.main()